@@ -0,0 +1,503 @@
+from astnodes import *
+from typenodes import *
+from commonitems import Fun, native_functions
+from target import Target
+from callconv import REGPARM
+
+# Heap allocator runtime.
+#
+# With an allocator other than libc's, calls to malloc, calloc, realloc and
+# free are redirected to the routines below, which take their arguments the
+# way the internal convention passes them (like the ones in runtime.py). The
+# heap state is shared by every unit of a program, so the allocator is a unit
+# of its own that is linked with the program, with or without libc. Memory
+# comes straight from the kernel through mmap, a chunk at a time.
+#
+# - classes: segregated power-of-two size classes. Each block carries its
+#   size in a header right before the memory it hands out; a freed block is
+#   pushed onto the free list of its class and reused by the next request of
+#   that class, and otherwise blocks are carved from the current chunk by
+#   bumping a pointer. Blocks too large for a class get a mapping of their
+#   own, which free unmaps.
+# - arena: blocks are only rounded up to the alignment and always bumped
+#   from the chunk; free does nothing, and everything is given back to the
+#   kernel when the program exits.
+#
+# Whatever is left of a chunk when a block no longer fits in it is not used.
+
+ALLOCATORS = ("libc", "classes", "arena")
+
+CHUNK = 1 << 22  # bytes mapped at a time for small blocks
+MAX_CLASS = 18  # log2 of the largest block size served from a chunk
+PAGE = 4096
+
+ALLOC_FUNS = {
+    f.name: f
+    for f in (
+        Fun(
+            name="__pycc_malloc",
+            typ=TypeFun(params=[TypeInt], ret=TypeVoid.as_ptr()),
+        ),
+        Fun(
+            name="__pycc_calloc",
+            typ=TypeFun(params=[TypeInt, TypeInt], ret=TypeVoid.as_ptr()),
+        ),
+        Fun(
+            name="__pycc_realloc",
+            typ=TypeFun(params=[TypeVoid.as_ptr(), TypeInt], ret=TypeVoid.as_ptr()),
+        ),
+        Fun(name="__pycc_free", typ=TypeFun(params=[TypeVoid.as_ptr()], ret=TypeVoid)),
+    )
+}
+
+for fun in ALLOC_FUNS.values():
+    fun.initialized = True
+    fun.regparm = min(REGPARM, len(fun.typ.params))
+
+# libc function each routine stands for
+REPLACES = {name: name[len("__pycc_") :] for name in ALLOC_FUNS}
+
+
+def redirect_allocations(prog: Program) -> int:
+    # only calls to the libc functions themselves, not to a function of the
+    # program that happens to share the name
+    changes = 0
+    for fun, libc in REPLACES.items():
+        for node in walk(prog):
+            if not isinstance(node, CallExp) or node.callee.lit != libc:
+                continue
+            if node.callee.resolved_as is native_functions[libc]:
+                node.callee = VarExp(
+                    pos=node.callee.pos, lit=fun, resolved_as=ALLOC_FUNS[fun]
+                )
+                changes += 1
+    return changes
+
+
+def allocator_unit(target: Target, allocator: str) -> str:
+    header = 2 * target.word  # keeps blocks aligned to two words
+    params = dict(
+        header=header,
+        min_class=header.bit_length(),  # room for the header and a word
+        max_class=MAX_CLASS,
+        max_size=1 << MAX_CLASS,
+        chunk=CHUNK,
+        page=PAGE,
+    )
+    heap = target.sysv and HEAP_X86_64 or HEAP_X86
+    snippets = {name: asm.format(**params) for name, asm in heap.items()}
+    code = target.sysv and ALLOC_X86_64 or ALLOC_X86
+    code = {**code, **(target.sysv and MODES_X86_64 or MODES_X86)[allocator]}
+
+    lines = [
+        f"    .local {var}\n    .comm {var}, {size}, {target.word}"
+        for var, size in (
+            ("__pycc_heap_top", target.word),
+            ("__pycc_heap_end", target.word),
+            ("__pycc_heap_free", (MAX_CLASS + 1) * target.word),
+        )
+    ]
+    lines.append("    .text")
+    for name in sorted(ALLOC_FUNS):
+        lines.append(f"    .globl {name}")
+        lines.append(code[name].format(**params, **snippets))
+    lines.append(code["__pycc_heap_grow"].format(**params))
+    lines.append('    .section  .note.GNU-stack, "", @progbits')
+    return "\n".join(lines)
+
+
+# --- x86 --- #
+
+# eax: block (with its size in ebx) carved from the chunk, or 0
+HEAP_X86 = {
+    "bump": """\
+    movl __pycc_heap_top, %eax
+    movl __pycc_heap_end, %edx
+    subl %eax, %edx
+    cmpl %ebx, %edx
+    jae 3f
+    call __pycc_heap_grow
+    testl %eax, %eax
+    jz 4f
+3:  leal (%eax,%ebx), %edx
+    movl %edx, __pycc_heap_top
+    movl %ebx, (%eax)
+    addl ${header}, %eax
+4:""",
+    # eax: a mapping of its own for ecx bytes, or 0
+    "large": """\
+    leal {header}+{page}-1(%ecx), %ebx
+    andl $-{page}, %ebx
+    movl %ebx, %ecx
+    call __pycc_mmap
+    testl %eax, %eax
+    jz 6f
+    movl %ebx, (%eax)
+    addl ${header}, %eax
+6:""",
+}
+
+MODES_X86 = {
+    "classes": {
+        "__pycc_malloc": """\
+__pycc_malloc:
+    testl %ecx, %ecx
+    js 9f
+    pushl %ebx
+    leal {header}-1(%ecx), %eax
+    bsrl %eax, %eax
+    incl %eax
+    cmpl ${min_class}, %eax
+    jge 1f
+    movl ${min_class}, %eax
+1:  cmpl ${max_class}, %eax
+    ja 5f
+    movl __pycc_heap_free(,%eax,4), %edx
+    testl %edx, %edx
+    jz 2f
+    movl (%edx), %ecx
+    movl %ecx, __pycc_heap_free(,%eax,4)
+    movl %edx, %eax
+    popl %ebx
+    ret
+2:  movl %eax, %ecx
+    movl $1, %ebx
+    shll %cl, %ebx
+{bump}
+    popl %ebx
+    ret
+5:
+{large}
+    popl %ebx
+    ret
+9:  xorl %eax, %eax
+    ret""",
+        "__pycc_free": """\
+__pycc_free:
+    testl %ecx, %ecx
+    jz 1f
+    movl -{header}(%ecx), %eax
+    cmpl ${max_size}, %eax
+    ja 2f
+    bsrl %eax, %eax
+    movl __pycc_heap_free(,%eax,4), %edx
+    movl %edx, (%ecx)
+    movl %ecx, __pycc_heap_free(,%eax,4)
+1:  ret
+2:  pushl %ebx
+    leal -{header}(%ecx), %ebx
+    movl %eax, %ecx
+    movl $91, %eax
+    int $0x80
+    popl %ebx
+    ret""",
+    },
+    "arena": {
+        "__pycc_malloc": """\
+__pycc_malloc:
+    testl %ecx, %ecx
+    js 9f
+    pushl %ebx
+    leal 2*{header}-1(%ecx), %ebx
+    andl $-{header}, %ebx
+    cmpl ${max_size}, %ebx
+    ja 5f
+{bump}
+    popl %ebx
+    ret
+5:
+{large}
+    popl %ebx
+    ret
+9:  xorl %eax, %eax
+    ret""",
+        "__pycc_free": """\
+__pycc_free:
+    ret""",
+    },
+}
+
+ALLOC_X86 = {
+    "__pycc_calloc": """\
+__pycc_calloc:
+    testl %ecx, %ecx
+    js 1f
+    testl %edx, %edx
+    js 1f
+    movl %ecx, %eax
+    imull %edx, %eax
+    jo 1f
+    pushl %edi
+    pushl %eax
+    movl %eax, %ecx
+    call __pycc_malloc
+    popl %ecx
+    testl %eax, %eax
+    jz 2f
+    movl %eax, %edi
+    movl %eax, %edx
+    xorl %eax, %eax
+    rep stosb
+    movl %edx, %eax
+2:  popl %edi
+    ret
+1:  xorl %eax, %eax
+    ret""",
+    "__pycc_realloc": """\
+__pycc_realloc:
+    testl %ecx, %ecx
+    jnz 1f
+    movl %edx, %ecx
+    jmp __pycc_malloc
+1:  testl %edx, %edx
+    js 3f
+    movl -{header}(%ecx), %eax
+    subl ${header}, %eax
+    cmpl %eax, %edx
+    ja 2f
+    movl %ecx, %eax
+    ret
+2:  pushl %esi
+    pushl %edi
+    pushl %ecx
+    pushl %eax
+    movl %edx, %ecx
+    call __pycc_malloc
+    popl %ecx
+    popl %esi
+    testl %eax, %eax
+    jz 4f
+    movl %eax, %edi
+    pushl %eax
+    pushl %esi
+    rep movsb
+    popl %ecx
+    call __pycc_free
+    popl %eax
+4:  popl %edi
+    popl %esi
+    ret
+3:  xorl %eax, %eax
+    ret""",
+    "__pycc_heap_grow": """\
+__pycc_mmap:
+    pushl %ebx
+    pushl %esi
+    pushl %edi
+    pushl %ebp
+    movl $192, %eax
+    xorl %ebx, %ebx
+    movl $3, %edx
+    movl $0x22, %esi
+    movl $-1, %edi
+    xorl %ebp, %ebp
+    int $0x80
+    cmpl $-{page}, %eax
+    jbe 1f
+    xorl %eax, %eax
+1:  popl %ebp
+    popl %edi
+    popl %esi
+    popl %ebx
+    ret
+__pycc_heap_grow:
+    movl ${chunk}, %ecx
+    call __pycc_mmap
+    testl %eax, %eax
+    jz 1f
+    leal {chunk}(%eax), %edx
+    movl %edx, __pycc_heap_end
+    movl %eax, __pycc_heap_top
+1:  ret""",
+}
+
+
+# --- x86-64 --- #
+
+# rax: block (with its size in rsi) carved from the chunk, or 0
+HEAP_X86_64 = {
+    "bump": """\
+    movq __pycc_heap_top(%rip), %rax
+    movq __pycc_heap_end(%rip), %rdx
+    subq %rax, %rdx
+    cmpq %rsi, %rdx
+    jae 3f
+    pushq %rsi
+    call __pycc_heap_grow
+    popq %rsi
+    testq %rax, %rax
+    jz 4f
+3:  leaq (%rax,%rsi), %rdx
+    movq %rdx, __pycc_heap_top(%rip)
+    movq %rsi, (%rax)
+    addq ${header}, %rax
+4:""",
+    # rax: a mapping of its own for rdi bytes, or 0
+    "large": """\
+    leaq {header}+{page}-1(%rdi), %rdi
+    andq $-{page}, %rdi
+    pushq %rdi
+    call __pycc_mmap
+    popq %rsi
+    testq %rax, %rax
+    jz 6f
+    movq %rsi, (%rax)
+    addq ${header}, %rax
+6:""",
+}
+
+MODES_X86_64 = {
+    "classes": {
+        "__pycc_malloc": """\
+__pycc_malloc:
+    movslq %edi, %rdi
+    testq %rdi, %rdi
+    js 9f
+    leaq {header}-1(%rdi), %rcx
+    bsrq %rcx, %rcx
+    incl %ecx
+    cmpl ${min_class}, %ecx
+    jge 1f
+    movl ${min_class}, %ecx
+1:  cmpl ${max_class}, %ecx
+    ja 5f
+    leaq __pycc_heap_free(%rip), %rdx
+    movq (%rdx,%rcx,8), %rax
+    testq %rax, %rax
+    jz 2f
+    movq (%rax), %rsi
+    movq %rsi, (%rdx,%rcx,8)
+    ret
+2:  movl $1, %esi
+    shlq %cl, %rsi
+{bump}
+    ret
+5:
+{large}
+    ret
+9:  xorl %eax, %eax
+    ret""",
+        "__pycc_free": """\
+__pycc_free:
+    testq %rdi, %rdi
+    jz 1f
+    movq -{header}(%rdi), %rsi
+    cmpq ${max_size}, %rsi
+    ja 2f
+    bsrq %rsi, %rcx
+    leaq __pycc_heap_free(%rip), %rdx
+    movq (%rdx,%rcx,8), %rax
+    movq %rax, (%rdi)
+    movq %rdi, (%rdx,%rcx,8)
+1:  ret
+2:  subq ${header}, %rdi
+    movl $11, %eax
+    syscall
+    ret""",
+    },
+    "arena": {
+        "__pycc_malloc": """\
+__pycc_malloc:
+    movslq %edi, %rdi
+    testq %rdi, %rdi
+    js 9f
+    leaq 2*{header}-1(%rdi), %rsi
+    andq $-{header}, %rsi
+    cmpq ${max_size}, %rsi
+    ja 5f
+{bump}
+    ret
+5:
+{large}
+    ret
+9:  xorl %eax, %eax
+    ret""",
+        "__pycc_free": """\
+__pycc_free:
+    ret""",
+    },
+}
+
+ALLOC_X86_64 = {
+    "__pycc_calloc": """\
+__pycc_calloc:
+    movslq %edi, %rax
+    movslq %esi, %rcx
+    testq %rax, %rax
+    js 1f
+    testq %rcx, %rcx
+    js 1f
+    imulq %rcx, %rax
+    cmpq $0x7fffffff, %rax
+    ja 1f
+    pushq %rax
+    movl %eax, %edi
+    call __pycc_malloc
+    popq %rcx
+    testq %rax, %rax
+    jz 2f
+    movq %rax, %rdi
+    movq %rax, %rdx
+    xorl %eax, %eax
+    rep stosb
+    movq %rdx, %rax
+2:  ret
+1:  xorl %eax, %eax
+    ret""",
+    "__pycc_realloc": """\
+__pycc_realloc:
+    testq %rdi, %rdi
+    jnz 1f
+    movl %esi, %edi
+    jmp __pycc_malloc
+1:  movslq %esi, %rsi
+    testq %rsi, %rsi
+    js 3f
+    movq -{header}(%rdi), %rcx
+    subq ${header}, %rcx
+    cmpq %rcx, %rsi
+    ja 2f
+    movq %rdi, %rax
+    ret
+2:  pushq %rdi
+    pushq %rcx
+    movl %esi, %edi
+    call __pycc_malloc
+    popq %rcx
+    popq %rsi
+    testq %rax, %rax
+    jz 4f
+    pushq %rax
+    pushq %rsi
+    movq %rax, %rdi
+    rep movsb
+    popq %rdi
+    call __pycc_free
+    popq %rax
+4:  ret
+3:  xorl %eax, %eax
+    ret""",
+    "__pycc_heap_grow": """\
+__pycc_mmap:
+    movq %rdi, %rsi
+    xorl %edi, %edi
+    movl $3, %edx
+    movl $0x22, %r10d
+    movq $-1, %r8
+    xorl %r9d, %r9d
+    movl $9, %eax
+    syscall
+    cmpq $-{page}, %rax
+    jbe 1f
+    xorl %eax, %eax
+1:  ret
+__pycc_heap_grow:
+    movl ${chunk}, %edi
+    call __pycc_mmap
+    testq %rax, %rax
+    jz 1f
+    leaq {chunk}(%rax), %rdx
+    movq %rdx, __pycc_heap_end(%rip)
+    movq %rax, __pycc_heap_top(%rip)
+1:  ret""",
+}
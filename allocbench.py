@@ -0,0 +1,109 @@
+import os
+import sys
+import time
+import argparse
+import tempfile
+import subprocess
+from driver import BuildError, Driver
+from allocator import ALLOCATORS
+from interface import InterfaceError
+from target import TARGETS
+
+# Allocator microbenchmarks.
+#
+# Builds every program in benchmarks/alloc once per allocator, runs each
+# build a few times and reports the best wall time and the peak resident
+# memory of each allocator, next to the first one given. Every build of a
+# program has to print the same thing.
+
+BENCH_DIR = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "benchmarks", "alloc"
+)
+
+
+def measure(exe: str) -> tuple[float, int, bytes]:
+    # wall seconds, peak RSS in KiB and output of one run
+    start = time.perf_counter()
+    proc = subprocess.Popen([exe], stdout=subprocess.PIPE, stdin=subprocess.DEVNULL)
+    out = proc.stdout.read()
+    _, status, usage = os.wait4(proc.pid, 0)
+    seconds = time.perf_counter() - start
+    proc.returncode = os.waitstatus_to_exitcode(status)
+    if proc.returncode != 0:
+        raise BuildError(f"{exe} terminó con estado {proc.returncode}")
+    return seconds, usage.ru_maxrss, out
+
+
+def bench(
+    sources: list[str], allocators: list[str], target: str, nolibc: bool, runs: int
+):
+    with tempfile.TemporaryDirectory(prefix="pycc-alloc") as tmp:
+        for source in sources:
+            name = os.path.splitext(os.path.basename(source))[0]
+            results, outputs = [], set()
+            for allocator in allocators:
+                exe = os.path.join(tmp, f"{name}-{allocator}")
+                driver = Driver(
+                    target=target,
+                    cache_dir=None,
+                    build_dir=os.path.join(tmp, "build"),
+                    nolibc=nolibc,
+                    allocator=allocator,
+                )
+                driver.build([source], exe)
+                best = min(measure(exe) for _ in range(runs))
+                results.append((allocator, *best))
+                outputs.add(best[2])
+            if len(outputs) > 1:
+                raise BuildError(f"'{source}' da resultados distintos por asignador")
+
+            base = results[0][1]
+            for allocator, seconds, rss, _ in results:
+                print(
+                    f"{name:<10} {allocator:<8} {seconds * 1000:9.1f} ms"
+                    f" {rss:8} KiB  x{base / seconds:.2f}"
+                )
+
+
+def main():
+    args = argparse.ArgumentParser(prog="allocbench.py")
+    args.add_argument(
+        "programas",
+        nargs="*",
+        help="programas a medir (por defecto, todos los de benchmarks/alloc)",
+    )
+    args.add_argument(
+        "--malloc",
+        action="append",
+        choices=ALLOCATORS,
+        help="asignador a comparar (por defecto, todos los disponibles)",
+    )
+    args.add_argument("--target", choices=sorted(TARGETS), default="x86_64")
+    args.add_argument(
+        "--nolibc",
+        action="store_true",
+        help="enlaza sin libc (y por tanto sin su malloc)",
+    )
+    args.add_argument(
+        "--runs", type=int, default=3, help="ejecuciones de cada programa"
+    )
+    opts = args.parse_args()
+
+    allocators = opts.malloc or [
+        a for a in ALLOCATORS if not (opts.nolibc and a == "libc")
+    ]
+    if opts.nolibc and "libc" in allocators:
+        print("error: --nolibc no admite el asignador de libc", file=sys.stderr)
+        sys.exit(1)
+    sources = opts.programas or sorted(
+        os.path.join(BENCH_DIR, f) for f in os.listdir(BENCH_DIR) if f.endswith(".c")
+    )
+    try:
+        bench(sources, allocators, opts.target, opts.nolibc, max(1, opts.runs))
+    except (BuildError, InterfaceError, OSError) as e:
+        print(f"error: {e}", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,4 @@
-from dataclasses import dataclass, field
+from dataclasses import dataclass, field, fields
 from typenodes import *
 from typing import Tuple, Optional, Union
 
@@ -11,12 +11,37 @@ def monkeypatch(cls):
     return decor
 
 
+def children(ast: "Ast"):
+    for f in fields(ast):
+        val = getattr(ast, f.name)
+        if isinstance(val, Ast):
+            yield val
+        elif isinstance(val, list):
+            yield from (v for v in val if isinstance(v, Ast))
+
+
+def transform(ast: "Ast", fn):
+    for f in fields(ast):
+        val = getattr(ast, f.name)
+        if isinstance(val, Ast):
+            setattr(ast, f.name, fn(val))
+        elif isinstance(val, list):
+            setattr(ast, f.name, [fn(v) if isinstance(v, Ast) else v for v in val])
+
+
+def walk(ast: "Ast"):
+    yield ast
+    for child in children(ast):
+        yield from walk(child)
+
+
 # --- Nodos --- #
 
 
 @dataclass
 class Ast:
     pos: int
+    rtype: "Type" = field(default=None, init=False, repr=False, compare=False)
 
 
 # Expresiones
@@ -72,6 +97,8 @@ class CallExp(Ast):
 class AssignExp(Ast):
     var: Ast
     exp: Ast
+    op: str = None  # of a compound assignment, `x += e`; `++x` is `x += 1`
+    postfix: bool = False  # `x++`: the value is the one before the update
 
 
 @dataclass
@@ -130,12 +157,32 @@ class IfStmt(Ast):
     cond: Ast
     then: BlockStmt
     else_: Union[BlockStmt, None]
+    swap: bool = False  # lay the else branch out first
+    cold: bool = False  # the branch laid out second never runs
 
 
 @dataclass
 class WhileStmt(Ast):
     cond: Ast
     block: Ast
+    step: Union[Ast, None] = None  # `for` increment, run before each re-test
+    counted: "CountedLoop" = None
+
+
+@dataclass
+class SwitchCase(Ast):
+    exp: Union[Ast, None]  # None for `default`
+    stmts: list[Ast]
+    value: int = field(default=None, init=False)  # of `exp`, once resolved
+
+
+@dataclass
+class SwitchStmt(Ast):
+    cond: Ast
+    cases: list[SwitchCase]
+    # made from an else-if chain (see switch.py): a case with statements never
+    # falls through into the next one, and `break` leaves the enclosing loop
+    chain: bool = False
 
 
 @dataclass
@@ -164,6 +211,8 @@ class FunDefTop(Ast):
     body: list[Ast]
     max_stack_size: int = 0
     resolved_as: "Global" = None
+    param_locals: list["Local"] = field(default_factory=list)
+    section: str = ".text"
 
 
 @dataclass
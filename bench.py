@@ -0,0 +1,192 @@
+import io
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import subprocess
+import vm
+from driver import BuildError, Driver
+from allocator import ALLOCATORS
+from interface import InterfaceError
+from passes import LEVELS
+from target import TARGETS
+
+# Benchmark harness.
+#
+# Every program in benchmarks/ reads its problem size from stdin. Each one is
+# built with the driver and timed natively at the size given in golden.json,
+# and run in the VM at a smaller size to count the instructions it executes,
+# a number that does not depend on the machine or its load. The output of
+# both runs must match the golden one.
+#
+# Results are written as JSON so that runs of different commits can be
+# compared (--compare); --update records the outputs of the current build as
+# the golden ones.
+
+BENCH_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmarks")
+GOLDEN = os.path.join(BENCH_DIR, "golden.json")
+
+
+class BenchError(Exception):
+    pass
+
+
+def run_native(exe: str, inp: str) -> tuple[float, bytes]:
+    start = time.perf_counter()
+    proc = subprocess.run([exe], input=inp.encode(), capture_output=True)
+    seconds = time.perf_counter() - start
+    if proc.returncode != 0:
+        raise BenchError(f"{exe} terminó con estado {proc.returncode}")
+    return seconds, proc.stdout
+
+
+def run_vm(source: str, level: str, inp: str) -> tuple[int, bytes]:
+    with open(source, "r") as f:
+        prog = vm.load_program(f.read(), level=level)
+    if prog is None:
+        raise BenchError(f"no se pudo cargar '{source}' en la VM")
+    prog.out, prog.inp = io.BytesIO(), io.BytesIO(inp.encode())
+    try:
+        prog.run()
+    except vm.VMError as e:
+        raise BenchError(f"'{source}' en la VM: {e}")
+    return sum(prog.counts), prog.out.getvalue()
+
+
+def check(name: str, kind: str, golden: dict, out: bytes, update: bool):
+    if update:
+        golden[kind]["output"] = out.decode()
+    elif out.decode() != golden[kind]["output"]:
+        raise BenchError(f"'{name}' no da la salida esperada ({kind})")
+
+
+def bench(names: list[str], golden: dict, opts) -> dict:
+    results = {}
+    with tempfile.TemporaryDirectory(prefix="pycc-bench") as tmp:
+        for name in names:
+            source = os.path.join(BENCH_DIR, name + ".c")
+            exe = os.path.join(tmp, name)
+            driver = Driver(
+                target=opts.target,
+                level=opts.level,
+                cache_dir=None,
+                build_dir=os.path.join(tmp, "build"),
+                nolibc=opts.nolibc,
+                allocator=opts.malloc or (opts.nolibc and "classes" or "libc"),
+            )
+            driver.build([source], exe)
+
+            runs = []
+            for _ in range(opts.runs):
+                seconds, out = run_native(exe, golden[name]["run"]["input"])
+                check(name, "run", golden[name], out, opts.update)
+                runs.append(seconds)
+            result = {"seconds": min(runs), "runs": runs}
+
+            if not opts.no_count:
+                count, out = run_vm(source, opts.level, golden[name]["count"]["input"])
+                check(name, "count", golden[name], out, opts.update)
+                result["instructions"] = count
+            results[name] = result
+            print(summary(name, result), file=sys.stderr)
+    return results
+
+
+def summary(name: str, result: dict, base: dict = None) -> str:
+    line = f"{name:<10} {result['seconds'] * 1000:9.1f} ms"
+    if base is not None:
+        line += f" (x{base['seconds'] / result['seconds']:.2f})"
+    if "instructions" in result:
+        line += f" {result['instructions']:12} instrucciones"
+        if base is not None and "instructions" in base:
+            line += f" ({result['instructions'] - base['instructions']:+})"
+    return line
+
+
+def commit() -> str:
+    proc = subprocess.run(
+        ["git", "rev-parse", "--short", "HEAD"],
+        cwd=BENCH_DIR,
+        capture_output=True,
+        text=True,
+    )
+    return proc.returncode == 0 and proc.stdout.strip() or None
+
+
+def main():
+    args = argparse.ArgumentParser(prog="bench.py")
+    args.add_argument(
+        "programas",
+        nargs="*",
+        help="programas a medir (por defecto, todos los de golden.json)",
+    )
+    args.add_argument("-O", dest="level", choices=LEVELS, default="2")
+    args.add_argument("--target", choices=sorted(TARGETS), default="x86_64")
+    args.add_argument("--nolibc", action="store_true")
+    args.add_argument("--malloc", choices=ALLOCATORS)
+    args.add_argument(
+        "--runs", type=int, default=3, help="ejecuciones nativas de cada programa"
+    )
+    args.add_argument(
+        "--no-count",
+        action="store_true",
+        help="no cuenta las instrucciones en la VM",
+    )
+    args.add_argument("-o", dest="out", metavar="JSON", help="guarda los resultados")
+    args.add_argument(
+        "--compare",
+        metavar="JSON",
+        help="compara con los resultados guardados de otra ejecución",
+    )
+    args.add_argument(
+        "--update",
+        action="store_true",
+        help="toma las salidas de esta ejecución como las esperadas",
+    )
+    opts = args.parse_args()
+    opts.runs = max(1, opts.runs)
+
+    with open(GOLDEN, "r") as f:
+        golden = json.load(f)
+    names = opts.programas or sorted(golden)
+    unknown = [name for name in names if name not in golden]
+    if unknown:
+        print(f"error: '{unknown[0]}' no está en golden.json", file=sys.stderr)
+        sys.exit(1)
+
+    try:
+        results = bench(names, golden, opts)
+    except (BenchError, BuildError, InterfaceError, OSError) as e:
+        print(f"error: {e}", file=sys.stderr)
+        sys.exit(1)
+
+    report = {
+        "commit": commit(),
+        "target": opts.target,
+        "level": opts.level,
+        "nolibc": opts.nolibc,
+        "malloc": opts.malloc,
+        "benchmarks": results,
+    }
+    if opts.out is not None:
+        with open(opts.out, "w") as f:
+            json.dump(report, f, indent=2)
+            f.write("\n")
+    if opts.update:
+        with open(GOLDEN, "w") as f:
+            json.dump(golden, f, indent=2)
+            f.write("\n")
+
+    if opts.compare is not None:
+        with open(opts.compare, "r") as f:
+            base = json.load(f)
+        print(f"comparado con {base.get('commit', None) or opts.compare}:")
+        for name, result in results.items():
+            if name in base["benchmarks"]:
+                print(summary(name, result, base["benchmarks"][name]))
+
+
+if __name__ == "__main__":
+    main()
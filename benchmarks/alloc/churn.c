@@ -0,0 +1,13 @@
+// malloc and free of one small block, over and over
+int main() {
+  int total = 0;
+  for (int i = 0; i < 5000000; i = i + 1) {
+    int *p = (int*) malloc(16);
+    p[0] = i & 255;
+    p[3] = i & 7;
+    total = total + p[0] - p[3];
+    free((void*) p);
+  }
+  printf("%i\n", total);
+  return 0;
+}
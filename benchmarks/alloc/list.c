@@ -0,0 +1,22 @@
+// build a long linked list, walk it and free it, several times
+int main() {
+  int total = 0;
+  for (int round = 0; round < 5; round = round + 1) {
+    int **head = (int**) 0;
+    for (int i = 0; i < 1000000; i = i + 1) {
+      int **node = (int**) malloc(sizeof(int*) * 2);
+      node[0] = (int*) head;
+      int *value = (int*) (node + 1);
+      *value = i % 100;
+      head = node;
+    }
+    while (head != (int**) 0) {
+      int **next = (int**) head[0];
+      total = total + *((int*) (head + 1));
+      free((void*) head);
+      head = next;
+    }
+  }
+  printf("%i\n", total);
+  return 0;
+}
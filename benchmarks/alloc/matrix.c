@@ -0,0 +1,22 @@
+// zeroed rows of a matrix, filled in and released
+int main() {
+  int total = 0;
+  for (int round = 0; round < 1000; round = round + 1) {
+    int **rows = (int**) calloc(300, sizeof(int*));
+    for (int i = 0; i < 300; i = i + 1) {
+      rows[i] = (int*) calloc(300, sizeof(int));
+    }
+    for (int i = 0; i < 300; i = i + 1) {
+      int *row = rows[i];
+      total = total + row[(i + round) % 300];
+      row[i] = 1;
+    }
+    for (int i = 0; i < 300; i = i + 1) {
+      total = total + rows[i][i];
+      free((void*) rows[i]);
+    }
+    free((void*) rows);
+  }
+  printf("%i\n", total);
+  return 0;
+}
@@ -0,0 +1,40 @@
+// a pool of live blocks of random sizes, replaced at random; one in 256
+// is large
+int main() {
+  int slots = 4096;
+  int **live = (int**) calloc(slots, sizeof(int*));
+  int *sizes = (int*) calloc(slots, sizeof(int));
+  int seed = 12345;
+  int total = 0;
+  for (int i = 0; i < 2000000; i = i + 1) {
+    seed = seed * 1103515245 + 12345;
+    int r = (seed / 65536) & 32767;
+    int k = r % slots;
+    int *old = live[k];
+    if (old != (int*) 0) {
+      int n = sizes[k];
+      if (old[0] != k || old[n - 1] != n) {
+        printf("corrupto %i\n", k);
+        return 1;
+      }
+      total = total + n;
+      free((void*) old);
+    }
+    int n = 1 + r % 256;
+    if (r % 256 == 0) {
+      n = 30000 + r;
+    }
+    int *p = (int*) malloc(n * sizeof(int));
+    p[0] = k;
+    p[n - 1] = n;
+    live[k] = p;
+    sizes[k] = n;
+  }
+  for (int k = 0; k < slots; k = k + 1) {
+    free((void*) live[k]);
+  }
+  free((void*) live);
+  free((void*) sizes);
+  printf("%i\n", total);
+  return 0;
+}
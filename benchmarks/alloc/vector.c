@@ -0,0 +1,23 @@
+// grow arrays one element at a time, doubling them with realloc
+int main() {
+  int total = 0;
+  for (int v = 0; v < 5000; v = v + 1) {
+    int cap = 1;
+    int len = 0;
+    int *items = (int*) malloc(cap * sizeof(int));
+    for (int i = 0; i < 4000; i = i + 1) {
+      if (len == cap) {
+        cap = cap * 2;
+        items = (int*) realloc((void*) items, cap * sizeof(int));
+      }
+      items[len] = i;
+      len = len + 1;
+    }
+    for (int i = 0; i < len; i = i + 1) {
+      total = total + items[i] % 3;
+    }
+    free((void*) items);
+  }
+  printf("%i\n", total);
+  return 0;
+}
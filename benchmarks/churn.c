@@ -0,0 +1,28 @@
+// allocation churn: a window of live blocks of varying sizes, the oldest
+// freed as each new one is allocated
+int main() {
+  int n = 0;
+  scanf("%i", &n);
+  int window = 64;
+  int **live = (int**) calloc(window, sizeof(int*));
+  int total = 0;
+  for (int i = 0; i < n; i = i + 1) {
+    int k = i % window;
+    int *old = live[k];
+    if (old != (int*) 0) {
+      total = total + old[0] + old[old[1] - 1];
+      free((void*) old);
+    }
+    int size = 3 + (i * 7) % 61;
+    int *p = (int*) malloc(size * sizeof(int));
+    p[0] = i & 127;
+    p[1] = size;
+    p[size - 1] = k;
+    live[k] = p;
+  }
+  for (int k = 0; k < window; k = k + 1) {
+    free((void*) live[k]);
+  }
+  printf("%i\n", total);
+  return 0;
+}
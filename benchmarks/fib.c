@@ -0,0 +1,14 @@
+// naive recursive Fibonacci
+int fib(int n) {
+  if (n < 2) {
+    return n;
+  }
+  return fib(n - 1) + fib(n - 2);
+}
+
+int main() {
+  int n = 0;
+  scanf("%i", &n);
+  printf("fib(%i) = %i\n", n, fib(n));
+  return 0;
+}
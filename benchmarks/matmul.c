@@ -0,0 +1,30 @@
+// product of two n x n matrices, row-major
+int main() {
+  int n = 0;
+  scanf("%i", &n);
+  int *a = (int*) malloc(n * n * sizeof(int));
+  int *b = (int*) malloc(n * n * sizeof(int));
+  int *c = (int*) calloc(n * n, sizeof(int));
+  for (int i = 0; i < n; i = i + 1) {
+    for (int j = 0; j < n; j = j + 1) {
+      a[i * n + j] = (i + 2 * j) % 7 - 3;
+      b[i * n + j] = (3 * i + j) % 5 - 2;
+    }
+  }
+  for (int i = 0; i < n; i = i + 1) {
+    for (int k = 0; k < n; k = k + 1) {
+      int x = a[i * n + k];
+      int *row = b + k * n;
+      int *out = c + i * n;
+      for (int j = 0; j < n; j = j + 1) {
+        out[j] = out[j] + x * row[j];
+      }
+    }
+  }
+  int sum = 0;
+  for (int i = 0; i < n * n; i = i + 1) {
+    sum = sum + c[i] * (i % 13 + 1);
+  }
+  printf("%i\n", sum);
+  return 0;
+}
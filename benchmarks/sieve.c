@@ -0,0 +1,22 @@
+// primes up to n, sieve of Eratosthenes
+int main() {
+  int n = 0;
+  scanf("%i", &n);
+  int *composite = (int*) calloc(n + 1, sizeof(int));
+  int count = 0;
+  int last = 0;
+  for (int i = 2; i <= n; i = i + 1) {
+    if (composite[i] == 0) {
+      count = count + 1;
+      last = i;
+      if (i <= n / i) {
+        for (int j = i * i; j <= n; j = j + i) {
+          composite[j] = 1;
+        }
+      }
+    }
+  }
+  printf("%i primos, el mayor %i\n", count, last);
+  free((void*) composite);
+  return 0;
+}
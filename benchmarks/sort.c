@@ -0,0 +1,53 @@
+// quicksort of n pseudo-random numbers
+void quicksort(int *v, int lo, int hi) {
+  while (lo < hi) {
+    int pivot = v[lo + (hi - lo) / 2];
+    int i = lo;
+    int j = hi;
+    while (i <= j) {
+      while (v[i] < pivot) {
+        i = i + 1;
+      }
+      while (v[j] > pivot) {
+        j = j - 1;
+      }
+      if (i <= j) {
+        int t = v[i];
+        v[i] = v[j];
+        v[j] = t;
+        i = i + 1;
+        j = j - 1;
+      }
+    }
+    // recurse into the smaller half, loop on the larger one
+    if (j - lo < hi - i) {
+      quicksort(v, lo, j);
+      lo = i;
+    } else {
+      quicksort(v, i, hi);
+      hi = j;
+    }
+  }
+}
+
+int main() {
+  int n = 0;
+  scanf("%i", &n);
+  int *v = (int*) malloc(n * sizeof(int));
+  int seed = 2463534;
+  for (int i = 0; i < n; i = i + 1) {
+    seed = seed * 1103515245 + 12345;
+    v[i] = (seed / 65536) & 32767;
+  }
+  quicksort(v, 0, n - 1);
+  int sorted = 1;
+  int sum = 0;
+  for (int i = 1; i < n; i = i + 1) {
+    if (v[i - 1] > v[i]) {
+      sorted = 0;
+    }
+    sum = sum + v[i] * (i % 7);
+  }
+  printf("ordenado %i, suma %i\n", sorted, sum);
+  return 0;
+}
@@ -0,0 +1,50 @@
+// a text of n characters (one per int) scanned for words, vowels and every
+// occurrence of a pattern
+int main() {
+  int n = 0;
+  scanf("%i", &n);
+  int *text = (int*) malloc((n + 1) * sizeof(int));
+  int seed = 7;
+  for (int i = 0; i < n; i = i + 1) {
+    seed = seed * 1103515245 + 12345;
+    int r = (seed / 65536) & 32767;
+    if (r % 6 == 0) {
+      text[i] = 32;
+    } else {
+      text[i] = 97 + r % 5;
+    }
+  }
+  text[n] = 0;
+
+  int pattern[4];
+  pattern[0] = 97;
+  pattern[1] = 98;
+  pattern[2] = 97;
+  pattern[3] = 0;
+
+  int words = 0;
+  int vowels = 0;
+  int found = 0;
+  int inword = 0;
+  for (int *p = text; *p != 0; p = p + 1) {
+    int c = *p;
+    if (c == 32) {
+      inword = 0;
+    } else if (inword == 0) {
+      inword = 1;
+      words = words + 1;
+    }
+    if (c == 97 || c == 101 || c == 105 || c == 111 || c == 117) {
+      vowels = vowels + 1;
+    }
+    int k = 0;
+    while (pattern[k] != 0 && p[k] == pattern[k]) {
+      k = k + 1;
+    }
+    if (pattern[k] == 0) {
+      found = found + 1;
+    }
+  }
+  printf("%i palabras, %i vocales, %i apariciones\n", words, vowels, found);
+  return 0;
+}
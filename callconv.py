@@ -0,0 +1,62 @@
+from astnodes import *
+from typenodes import *
+from commonitems import *
+from target import Target, X86
+
+# Internal calling convention.
+#
+# Functions defined or declared in the program can never have their address
+# taken (the resolver rejects functions used as values), so every call to them
+# is a direct call we control. Those functions take their first REGPARM
+# arguments in registers, fastcall style; `main` and the native functions keep
+# the cdecl stack convention. The rule only looks at the signature, so every
+# unit compiled with it enabled agrees on it.
+#
+# On System V targets every function, main and the natives included, already
+# takes its first arguments in registers, so there is nothing to choose.
+
+REGPARM = 2
+
+
+def regparm_of(name: str, sig: TypeFun, target: Target = X86) -> int:
+    if target.sysv:
+        return min(len(target.param_regs), len(sig.params))
+    if name == "main":
+        return 0
+    return min(REGPARM, len(sig.params))
+
+
+def assign_regparm(fun: FunDefTop, regparm: int, target: Target = X86):
+    # register parameters are spilled to the frame by the prologue; the frame
+    # layout pass later packs their slots with the rest of the locals
+    off = 2 * target.word  # saved frame pointer and return address
+    for i, local in enumerate(fun.param_locals):
+        if i < regparm:
+            size, align = local.typ.sizeof(), local.typ.alignof()
+            fun.max_stack_size = align_up(fun.max_stack_size + size, align)
+            local.addr = fun.max_stack_size
+        else:
+            local.addr = -off
+            off += target.sysv and target.word or local.typ.arg_size()
+
+
+def assign_calling_conventions(
+    prog: Program, globals: dict[str, Item], target: Target = X86
+):
+    for top in prog.topdecls:
+        head = isinstance(top, FunDefTop) and top.head or top
+        if not isinstance(head, FunDeclTop):
+            continue
+
+        fun = globals.get(head.name, None)
+        if not isinstance(fun, Fun):
+            continue
+
+        fun.regparm = regparm_of(head.name, head.sig, target)
+        if isinstance(top, FunDefTop):
+            assign_regparm(top, fun.regparm, target)
+
+    # functions imported from other units follow the same rule
+    for name, fun in globals.items():
+        if isinstance(fun, Fun) and name not in native_functions:
+            fun.regparm = regparm_of(name, fun.typ, target)
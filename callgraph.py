@@ -0,0 +1,141 @@
+from astnodes import *
+from typenodes import *
+from commonitems import *
+from compiler import Compiler
+from insn import PSEUDO
+from target import Target
+from dataclasses import dataclass, field
+from typing import Callable
+
+# Call graph and unreachable code stripping.
+#
+# Calls are always direct (functions cannot be used as values), so the edges
+# of the call graph are just the functions each body calls, as resolved. A
+# function not reachable from `main` can never run, and a global or static
+# local only used by such functions is never read, so neither is emitted.
+#
+# Only whole programs can be stripped: a unit compiled apart does not know
+# who calls its functions.
+
+
+@dataclass
+class CallGraph:
+    funs: dict[str, FunDefTop] = field(default_factory=dict)
+    calls: dict[str, set[str]] = field(default_factory=dict)  # name -> callees
+
+    def reachable(self, roots=("main",)) -> set[str]:
+        live, pending = set(), [r for r in roots if r in self.funs]
+        while pending:
+            name = pending.pop()
+            if name in live:
+                continue
+            live.add(name)
+            pending += [c for c in self.calls[name] if c in self.funs]
+        return live
+
+
+def build_call_graph(prog: Program) -> CallGraph:
+    graph = CallGraph()
+    for top in prog.topdecls:
+        if not isinstance(top, FunDefTop):
+            continue
+        graph.funs[top.head.name] = top
+        graph.calls[top.head.name] = {
+            node.callee.resolved_as.name
+            for node in walk(top)
+            if isinstance(node, CallExp) and isinstance(node.callee.resolved_as, Fun)
+        }
+    return graph
+
+
+@dataclass
+class Stripped:
+    kind: str  # "función", "global" or "estática"
+    name: str
+    size: int  # instructions for functions, bytes for data
+
+
+@dataclass
+class StripReport:
+    stripped: list[Stripped] = field(default_factory=list)
+
+    def lines(self) -> list[str]:
+        lines = []
+        for s in self.stripped:
+            unit = s.kind == "función" and "instrucciones" or "bytes"
+            lines.append(f"eliminada {s.kind} '{s.name}' ({s.size} {unit})")
+        code = sum(s.size for s in self.stripped if s.kind == "función")
+        data = sum(s.size for s in self.stripped if s.kind != "función")
+        lines.append(f"ahorro: {code} instrucciones, {data} bytes de datos")
+        return lines
+
+
+def used_globals(funs: list[FunDefTop]) -> set[int]:
+    return {
+        id(node.resolved_as)
+        for fun in funs
+        for node in walk(fun)
+        if isinstance(node, VarExp) and isinstance(node.resolved_as, Global)
+    }
+
+
+def strip_statics(body: list[Ast], used: set[int], report: StripReport):
+    # statics whose initializer has no effects can go with their stores
+    for node in (n for stmt in body for n in walk(stmt)):
+        if not isinstance(node, VarStmt) or not node.is_static:
+            continue
+        keep = []
+        for var in node.vars:
+            pure = var.exp is None or isinstance(var.exp, NumExp)
+            if id(var.resolved_as) in used or not pure:
+                keep.append(var)
+            else:
+                typ = var.resolved_as.typ
+                report.stripped.append(Stripped("estática", var.name, typ.sizeof()))
+        node.vars = keep
+
+
+def code_size(fun: FunDefTop, globals: dict, target: Target) -> int:
+    cmp = Compiler(globals=globals, target=target)
+    fun.compile(cmp)
+    return sum(insn.op not in PSEUDO for insn in cmp.asm)
+
+
+def strip_unreachable(
+    prog: Program,
+    report: StripReport = None,
+    measure: Callable[[FunDefTop], int] = None,
+) -> int:
+    # stripped functions are never compiled, unless `measure` compiles them
+    # to tell how much code was saved
+    graph = build_call_graph(prog)
+    if "main" not in graph.funs:
+        return 0
+    live = graph.reachable()
+    used = used_globals([graph.funs[name] for name in live])
+    report = report if report is not None else StripReport()
+    before = len(report.stripped)
+
+    topdecls = []
+    for top in prog.topdecls:
+        if isinstance(top, FunDefTop) and top.head.name not in live:
+            size = measure is not None and measure(top) or 0
+            report.stripped.append(Stripped("función", top.head.name, size))
+            continue
+        if isinstance(top, VarTop):
+            vars = []
+            for var in top.vars:
+                if id(var.resolved_as) in used:
+                    vars.append(var)
+                else:
+                    size = var.resolved_as.typ.sizeof()
+                    report.stripped.append(Stripped("global", var.name, size))
+            if not vars:
+                continue
+            top.vars = vars
+        if isinstance(top, FunDefTop):
+            strip_statics(top.body, used, report)
+        topdecls.append(top)
+
+    prog.topdecls = topdecls
+    return len(report.stripped) - before
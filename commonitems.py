@@ -23,6 +23,7 @@ class Global(Item):
 class Fun(Item):
     name: str = ""
     initialized: bool = False
+    regparm: int = 0  # leading arguments passed in registers
 
 
 @dataclass
@@ -50,7 +51,7 @@ def _printf_resolve(self, res):
         targ = arg.resolve(res)
         tparam = TypeInt
 
-        if targ != tparam:
+        if not assignable(tparam, targ):
             res.throw(
                 self,
                 f"función tomó argumento de tipo {targ}, pero se necesita tipo {tparam}",
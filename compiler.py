@@ -1,51 +1,33 @@
+import gc
 from astnodes import *
 from typenodes import *
 from commonitems import *
-from resolver import Resolver
+from resolver import Resolver, constant_value
+from target import *
+from runtime import RUNTIME_FUNS, runtime_asm
+from insn import OPCODES, Insn, directive, label, render
 from dataclasses import dataclass, field
-from typing import Union
-
-
-@dataclass
-class Reg:
-    name: str
-    off: int = 0
-
-    def __add__(self, o):
-        if o == 0:
-            return f"(%{self.name})"
-        else:
-            return f"{o}(%{self.name})"
-
-    def __sub__(self, o):
-        return self.__add__(-o)
-
-    def __str__(self):
-        return self.name
-
-    def deref(self):
-        return f"(%{self.name})"
-
-
-EAX = Reg("eax")
-EBX = Reg("ebx")
-EDX = Reg("edx")
-EBP = Reg("ebp")
-ESP = Reg("esp")
+from typing import Iterator, Union
 
 
 @monkeypatch(Local)
-def reg(self: Local, off: int = 0) -> str:
+def reg(self: Local, off: int = 0) -> Mem:
     return EBP - (self.addr + off)
 
 
 @monkeypatch(Global)
-def reg(self: Global) -> str:
-    return self.name
+def reg(self: Global) -> Sym:
+    return Sym(self.name)
+
+
+IMMEDIATES: dict[int, Imm] = {}  # shared, like the operands in target.py
 
 
 def S(n):
-    return f"${n}"
+    imm = IMMEDIATES.get(n, None)
+    if imm is None:
+        imm = IMMEDIATES[n] = Imm(n)
+    return imm
 
 
 @dataclass
@@ -55,32 +37,63 @@ class Compiler:
     label_count: int = 0
     header: list[str] = field(default_factory=list)
     constants: list[str] = field(default_factory=list)
-    asm: list[str] = field(default_factory=list)
+    asm: list[Insn] = field(default_factory=list)  # see insn.py
     break_stack: list[str] = field(default_factory=list)
     continue_stack: list[str] = field(default_factory=list)
+    unroll_factor: int = 4
+    target: Target = X86
+    depth: int = 0  # words pushed by the expression being compiled
+    instrument: "Instrumentation" = None
+    label_prefix: str = ""  # keeps labels apart when units are compiled apart
+    runtime: set[str] = field(default_factory=set)  # runtime routines called
+    freestanding: bool = False  # the runtime is a unit of its own, no libc
 
     @staticmethod
     def of_resolver(res: Resolver):
         return Compiler(globals=res.globals)
 
     def compile(self, ast: Ast):
-        ast.compile(self)
+        # the stream grows by an object per instruction, none of them in a
+        # cycle; a running collector would walk it again and again as it grows
+        enabled = gc.isenabled()
+        gc.disable()
+        try:
+            ast.compile(self)
+        finally:
+            if enabled:
+                gc.enable()
         return self
 
-    def generate(self):
-        def gen():
-            # yield " " * 4 + ".file  ???" # TODO
+    def items(self) -> Iterator[Union[str, Insn]]:
+        # the whole output in order, instructions as they are
+        # yield " " * 4 + ".file  ???" # TODO
+
+        if self.header:
+            yield from self.header
+            yield ""
 
-            if self.header:
-                yield from self.header
-                yield ""
+        if self.constants:
+            yield " " * 4 + ".section  .rodata"
+            yield from self.constants
+            yield ""
 
-            if self.constants:
-                yield " " * 4 + ".section  .rodata"
-                yield from self.constants
-                yield ""
+        yield from self.asm
+        if self.instrument is not None:
+            yield from self.instrument.runtime(self.target)
+        if self.runtime and not self.freestanding:
+            yield from runtime_asm(self.runtime, self.target)
+        yield " " * 4 + '.section  .note.GNU-stack, "", @progbits'
 
-            yield from self.asm
+    def generate(self):
+        def gen():
+            batch = []  # rendered a batch at a time, not every line at once
+            for item in self.items():
+                batch.append(item)
+                if len(batch) == 4096:
+                    yield "\n".join(render(batch, self.target))
+                    batch.clear()
+            if batch:
+                yield "\n".join(render(batch, self.target))
 
         return "\n".join(gen())
 
@@ -89,13 +102,13 @@ class Compiler:
     def make_label(self, string: str) -> str:
         off = self.label_count
         self.label_count += 1
-        return string + str(off)
+        return string + self.label_prefix + str(off)
 
     def add_line(self, line):
-        self.asm.append("    " + line)
+        self.asm.append(directive(line))
 
-    def label(self, label):
-        self.asm.append(label + ":")
+    def label(self, name):
+        self.asm.append(label(name))
 
     def add_string(self, string: str) -> str:
         label = "." + self.make_label("L")
@@ -109,44 +122,97 @@ class Compiler:
         self.constants.append(f'    .float "{num}"')
         return label
 
-    def add_global(self, name) -> None:
-        self.header.append(f"    .comm {name}, 4, 4")
+    def add_global(self, name, typ: Type) -> None:
+        self.header.append(f"    .comm {name}, {typ.sizeof()}, {typ.alignof()}")
 
     def nl(self):
         self.add_line("")
 
+    def probe(self, node: Ast):
+        counter = self.instrument and self.instrument.counter(node)
+        if counter:
+            self.emit("inc", Sym(counter), size=4)
+
+    def emit_prologue(self, bytes_locals: int):
+        self.emit("push", EBP)
+        self.emit("mov", ESP, EBP)
+        align = self.target.stack_align()
+        bytes_locals = (bytes_locals + align - 1) // align * align
+        if bytes_locals != 0:
+            self.sub(S(bytes_locals), ESP)
+        self.depth = 0
+
     def emit_return(self):
-        self.movl(EBP, ESP)
-        self.popl(EBP)
+        self.emit("mov", EBP, ESP)
+        self.emit("pop", EBP)
         self.ret()
 
+    # --- Instructions --- #
+
+    def emit(self, inst: str, *args, size: int = None):
+        self.asm.append(Insn(OPCODES[inst], size or self.target.word, *args))
+
+    def load(self, orig, typ: Type, to: Reg = EAX):
+        # values live extended to full registers: signed ones with their
+        # sign, unsigned ones with zeros
+        size = typ.sizeof()
+        if size == self.target.word:
+            self.mov(orig, to)
+        elif not typ.is_unsigned():
+            self.emit("movs", orig, to, size=size)
+        elif size == 4:
+            self.emit("mov", orig, to, size=4)  # clears the upper half
+        else:
+            self.emit("movz", orig, to, size=size)
+
+    def convert(self, typ: Type, frm: Type):
+        # turns a value of type `frm` in EAX into one of type `typ`
+        if typ is None or frm is None:
+            return  # left untyped by the resolver, as `p = arr` is
+        if not (typ.is_integer() and frm.is_integer()):
+            return
+        narrowed = typ.sizeof() < 4
+        # ints and unsigned ints only differ in how the upper half is filled
+        resigned = typ == TypeUInt and not frm.is_unsigned() or frm == TypeUInt
+        if narrowed or typ != frm and resigned and self.target.word > 4:
+            self.load(EAX, typ)
+
+    def store(self, orig: Reg, to, typ: Type):
+        self.emit("mov", orig, to, size=typ.sizeof())
+
     # fmt: off
-    def addl(self, orig, to): self.add_line(f'addl {orig}, {to}')
-    def subl(self, orig, to): self.add_line(f'subl {orig}, {to}')
-    def imull(self, orig, to): self.add_line(f'imull {orig}, {to}')
-    def movl(self, orig, to): self.add_line(f'movl {orig}, {to}')
-    def cmpl(self, orig, to): self.add_line(f'cmpl {orig}, {to}')
-    def leal(self, orig, to): self.add_line(f'leal {orig}, {to}')
-    def andl(self, orig, to): self.add_line(f'andl {orig}, {to}')
-    def orl(self, orig, to): self.add_line(f'orl {orig}, {to}')
-    def xorl(self, orig, to): self.add_line(f'xorl {orig}, {to}')
-
-    def idivl(self, arg): self.add_line(f'idivl {arg}')
-    def pushl(self, arg): self.add_line(f'pushl {arg}')
-    def popl(self, arg): self.add_line(f'popl {arg}')
-    def neg(self, arg): self.add_line(f'neg {arg}')
-    def call(self, arg): self.add_line(f'call {arg}')
-
-    def jmp(self, arg): self.add_line(f'jmp {arg}')
-    def je(self, arg): self.add_line(f'je {arg}')
-    def jne(self, arg): self.add_line(f'jne {arg}')
-    def jge(self, arg): self.add_line(f'jge {arg}')
-    def jg(self, arg): self.add_line(f'jg {arg}')
-    def jle(self, arg): self.add_line(f'jle {arg}')
-    def jl(self, arg): self.add_line(f'jl {arg}')
-
-    def cdq(self): self.add_line(f'cdq')
-    def ret(self): self.add_line(f'ret')
+    def add(self, orig, to): self.emit('add', orig, to)
+    def sub(self, orig, to): self.emit('sub', orig, to)
+    def imul(self, orig, to): self.emit('imul', orig, to)
+    def mov(self, orig, to): self.emit('mov', orig, to)
+    def cmp(self, orig, to): self.emit('cmp', orig, to)
+    def lea(self, orig, to): self.emit('lea', orig, to)
+    def and_(self, orig, to): self.emit('and', orig, to)
+    def or_(self, orig, to): self.emit('or', orig, to)
+    def xor(self, orig, to): self.emit('xor', orig, to)
+
+    def idiv(self, arg): self.emit('idiv', arg)
+    def div(self, arg): self.emit('div', arg, size=4)
+    def push(self, arg): self.depth += 1; self.emit('push', arg)
+    def pop(self, arg): self.depth -= 1; self.emit('pop', arg)
+    def neg(self, arg): self.emit('neg', arg)
+    def not_(self, arg): self.emit('not', arg)
+    def call(self, arg): self.emit('call', arg)
+
+    def jmp(self, arg): self.emit('jmp', arg)
+    def je(self, arg): self.emit('je', arg)
+    def jne(self, arg): self.emit('jne', arg)
+    def jge(self, arg): self.emit('jge', arg)
+    def jg(self, arg): self.emit('jg', arg)
+    def jle(self, arg): self.emit('jle', arg)
+    def jl(self, arg): self.emit('jl', arg)
+    def ja(self, arg): self.emit('ja', arg)  # unsigned
+    def jae(self, arg): self.emit('jae', arg)
+    def jbe(self, arg): self.emit('jbe', arg)
+    def jb(self, arg): self.emit('jb', arg)
+
+    def cwd(self): self.emit(self.target.word == 8 and 'cqto' or 'cltd')
+    def ret(self): self.emit('ret')
     # fmt: on
 
 
@@ -155,30 +221,29 @@ class Compiler:
 
 @monkeypatch(NumExp)
 def compile(self: NumExp, cmp: Compiler):
-    cmp.movl(S(self.lit), EAX)
+    cmp.mov(S(wrap(self.lit)), EAX)
 
 
 @monkeypatch(StrExp)
 def compile(self: StrExp, cmp: Compiler):
-    label = S(cmp.add_string(self.lit))
-    cmp.movl(label, EAX)
+    label = Sym(cmp.add_string(self.lit))
+    cmp.lea(label, EAX)
 
 
 @monkeypatch(VarExp)
 def compile(self: VarExp, cmp: Compiler):
     typ = self.resolved_as.typ
-    inst = isinstance(typ, TypeArray) and cmp.leal or cmp.movl
-    inst(self.resolved_as.reg(), EAX)
+    if isinstance(typ, TypeArray):
+        cmp.lea(self.resolved_as.reg(), EAX)
+    else:
+        cmp.load(self.resolved_as.reg(), typ)
 
 
 @monkeypatch(UnaryExp)
 def compile(self: UnaryExp, cmp: Compiler):
     if self.op == "&":
         if isinstance(self.exp, VarExp):
-            if isinstance(self.exp.resolved_as, Local):
-                cmp.leal(self.exp.resolved_as.reg(), EAX)
-            else:  # is a Global
-                cmp.movl(S(self.exp.resolved_as.reg()), EAX)
+            cmp.lea(self.exp.resolved_as.reg(), EAX)
         elif isinstance(self.exp, UnaryExp) and self.exp.op == "*":
             self.exp.exp.compile(cmp)
         else:
@@ -186,23 +251,28 @@ def compile(self: UnaryExp, cmp: Compiler):
         return
 
     if self.op == "*":
-        self.exp.compile(cmp)
-        if not (isinstance(self.exp, UnaryExp) and self.exp.op == "&"):
-            cmp.movl(EAX.deref(), EAX)
+        if isinstance(self.exp, UnaryExp) and self.exp.op == "&":
+            self.exp.exp.compile(cmp)  # *&e is just e
+        else:
+            self.exp.compile(cmp)
+            if not isinstance(self.rtype, TypeArray):
+                cmp.load(EAX.deref(), self.rtype)  # a row's value is its address
         return
 
     self.exp.compile(cmp)
 
+    # unsigned ints are computed in the low half, which clears the upper one
+    size = self.rtype == TypeUInt and 4 or None
     if self.op == "-":
-        cmp.neg(EAX)
+        cmp.emit("neg", EAX, size=size)
     elif self.op == "~":
-        # EAX xor 1111..111 = ~EAX
-        cmp.xorl(S(4294967295), EAX)
+        cmp.emit("not", EAX, size=size)
     elif self.op == "!":
         label = cmp.make_label(".J")
-        cmp.cmpl(S(0), EAX)
+        cmp.cmp(S(0), EAX)
+        cmp.mov(S(0), EAX)
         cmp.jne(label)
-        cmp.movl(S(0), EAX)
+        cmp.mov(S(1), EAX)
         cmp.label(label)
 
 
@@ -215,13 +285,25 @@ JUMP_TYPES = {
     "!=": "je",
 }
 
+UNSIGNED_JUMP_TYPES = {
+    "<": "jae",
+    ">": "jbe",
+    ">=": "jb",
+    "<=": "ja",
+    "==": "jne",
+    "!=": "je",
+}
+
+ARITHMETIC = {"+": "add", "-": "sub", "*": "imul", "&": "and", "|": "or", "^": "xor"}
+SHIFTS = {"<<": "shl", ">>": "sar"}
+
 
 @monkeypatch(BinaryExp)
 def compile(self: BinaryExp, cmp: Compiler):
     if self.op in {"&&", "||"}:
         self.exp1.compile(cmp)
         j = cmp.make_label(".J")
-        cmp.cmpl(S(0), EAX)
+        cmp.cmp(S(0), EAX)
         if self.op == "&&":
             cmp.je(j)
         else:
@@ -231,99 +313,255 @@ def compile(self: BinaryExp, cmp: Compiler):
         return
 
     self.exp1.compile(cmp)
-    cmp.pushl(EAX)
+    cmp.push(EAX)
 
     self.exp2.compile(cmp)
-    cmp.movl(EAX, EBX)
-    cmp.popl(EAX)
-
-    if self.op == "+":
-        cmp.addl(EBX, EAX)
-    elif self.op == "-":
-        cmp.subl(EBX, EAX)
-    elif self.op == "*":
-        cmp.imull(EBX, EAX)
-    elif self.op == "/":
-        cmp.cdq()
-        cmp.idivl(EBX)
-    elif self.op == "&":
-        cmp.andl(EBX, EAX)
-    elif self.op == "|":
-        cmp.orl(EBX, EAX)
-    elif self.op == "^":
-        cmp.xorl(EBX, EAX)
-    elif self.op == "%":
-        cmp.cdq()
-        cmp.idivl(EBX)
-        cmp.movl(EDX, EAX)
+    cmp.mov(EAX, EBX)
+    cmp.pop(EAX)
+
+    if self.op in ARITHMETIC or self.op in {"/", "%"} or self.op in SHIFTS:
+        compile_operation(cmp, self.op, self.rtype)
     else:
         # remaining cases: <, >, <=, >=, ==, !=
-        cond_jump = getattr(cmp, JUMP_TYPES[self.op])
+        jumps, size = JUMP_TYPES, None
+        if promote(self.exp1.rtype, self.exp2.rtype) == TypeUInt:
+            jumps, size = UNSIGNED_JUMP_TYPES, 4
+        cond_jump = getattr(cmp, jumps[self.op])
 
         no = cmp.make_label(".J")
         fin = cmp.make_label(".J")
-        cmp.cmpl(EBX, EAX)
+        cmp.emit("cmp", EBX, EAX, size=size)
         cond_jump(no)
-        cmp.movl(S(1), EAX)
+        cmp.mov(S(1), EAX)
         cmp.jmp(fin)
 
         cmp.label(no)
-        cmp.movl(S(0), EAX)
+        cmp.mov(S(0), EAX)
         cmp.label(fin)
 
 
+def compile_operation(cmp: Compiler, op: str, typ: Type):
+    # EAX = EAX op EBX, computed in `typ`; clobbers ECX and EDX
+    # unsigned ints are computed in the low half, which clears the upper one
+    unsigned = typ == TypeUInt
+    size = unsigned and 4 or None
+    if op in ARITHMETIC:
+        cmp.emit(ARITHMETIC[op], EBX, EAX, size=size)
+    elif op in {"/", "%"}:
+        if unsigned:
+            cmp.emit("xor", EDX, EDX, size=4)
+            cmp.div(EBX)
+        else:
+            cmp.cwd()
+            cmp.idiv(EBX)
+        if op == "%":
+            cmp.mov(EDX, EAX)
+    else:
+        cmp.mov(EBX, ECX)
+        shift = unsigned and op == ">>" and "shr" or SHIFTS[op]
+        cmp.emit(shift, ECX, EAX, size=size)
+        if op == "<<" and not unsigned and cmp.target.word > 4:
+            cmp.load(EAX, TypeInt)  # the sign is bit 31
+
+
+def is_leaf(exp: Ast) -> bool:
+    # leaves only ever touch EAX, so they can't clobber argument registers
+    return isinstance(exp, (NumExp, StrExp, VarExp, SizeofExp)) or (
+        isinstance(exp, UnaryExp) and exp.op == "&" and isinstance(exp.exp, VarExp)
+    )
+
+
+def register_args(fun: Fun, nargs: int, target: Target) -> int:
+    # how many of the arguments of a call to `fun` go in registers
+    if target.sysv:
+        return min(nargs, len(target.param_regs))
+    return min(getattr(fun, "regparm", 0), nargs)
+
+
+def argument_order(args: list[Ast], regparm: int) -> list[int]:
+    # the order CallExp.compile evaluates the arguments in
+    stack = list(range(len(args) - 1, regparm - 1, -1))
+    complex_args = [k for k in range(regparm) if not is_leaf(args[k])]
+    leaves = [k for k in range(regparm) if is_leaf(args[k])]
+    return stack + complex_args[:0:-1] + complex_args[:1] + leaves
+
+
 @monkeypatch(CallExp)
 def compile(self: CallExp, cmp: Compiler):
     fun: Fun = self.callee.resolved_as
+    target = cmp.target
+    regparm = register_args(fun, len(self.args), target)
+    reg_args = list(zip(self.args[:regparm], target.param_regs))
+    stack_args = self.args[regparm:]
+
+    # System V wants %rsp 16-byte aligned at the call
+    pad = target.sysv and (cmp.depth + len(stack_args)) % 2
+    if pad:
+        cmp.sub(S(target.word), ESP)
+        cmp.depth += 1
+
+    for arg in reversed(stack_args):
+        arg.compile(cmp)
+        cmp.push(EAX)
 
-    for arg in reversed(self.args):
+    # anything but a leaf may itself call or divide, so those are evaluated
+    # first (all but the last one through the stack) and leaves are loaded
+    # straight into place at the end
+    complex_args = [(arg, reg) for arg, reg in reg_args if not is_leaf(arg)]
+    for arg, _ in reversed(complex_args[1:]):
+        arg.compile(cmp)
+        cmp.push(EAX)
+    if complex_args:
+        arg, reg = complex_args[0]
         arg.compile(cmp)
-        cmp.pushl(EAX)
+        cmp.mov(EAX, reg)
+    for _, reg in complex_args[1:]:
+        cmp.pop(reg)
+    for arg, reg in reg_args:
+        if is_leaf(arg):
+            arg.compile(cmp)
+            cmp.mov(EAX, reg)
+
+    if target.sysv:
+        cmp.mov(S(0), EAX)  # no vector registers used by variadic calls
+        size_args = (len(stack_args) + pad) * target.word
+    else:
+        size_args = sum(p.arg_size() for p in fun.typ.params[regparm:])
 
+    cmp.probe(self)
     cmp.call(fun.name)
-    size_args = sum(p.sizeof() for p in fun.typ.params)
+    if fun.name in RUNTIME_FUNS:
+        cmp.runtime.add(fun.name)
+    cmp.depth -= len(stack_args) + pad
     if size_args > 0:
-        cmp.addl(S(size_args), ESP)
+        cmp.add(S(size_args), ESP)
+
+    ret = fun.typ.ret
+    if ret != TypeVoid and ret.sizeof() < target.word:
+        cmp.load(EAX, ret)  # callees only set the low bits
 
 
 @monkeypatch(AssignExp)
 def compile(self: AssignExp, cmp: Compiler):
+    if self.op is not None:
+        self.update(cmp, used=True)
+        return
+    self.assign(cmp)
+    cmp.convert(self.rtype, self.exp.rtype)  # the value is the one stored
+
+
+@monkeypatch(AssignExp)
+def assign(self: AssignExp, cmp: Compiler):
+    # compiles the assignment leaving its value out
+    if self.op is not None:
+        self.update(cmp, used=False)
+        return
     self.exp.compile(cmp)
 
     if isinstance(self.var, VarExp):
-        cmp.movl(EAX, self.var.resolved_as.reg())
+        cmp.store(EAX, self.var.resolved_as.reg(), self.var.resolved_as.typ)
 
     elif isinstance(self.var, UnaryExp) and self.var.op == "*":
-        cmp.pushl(EAX)
+        cmp.push(EAX)
         self.var.exp.compile(cmp)
-        cmp.movl(EAX, EBX)
-        cmp.popl(EAX)
-        cmp.movl(EAX, EBX.deref())
+        cmp.mov(EAX, EBX)
+        cmp.pop(EAX)
+        cmp.store(EAX, EBX.deref(), self.var.rtype)
+
+
+# operators applied in place, on the memory of the variable
+IN_PLACE = {"+": "add", "-": "sub", "&": "and", "|": "or", "^": "xor", **SHIFTS}
+
+
+@monkeypatch(AssignExp)
+def update(self: AssignExp, cmp: Compiler, used: bool):
+    # Compound assignments and increments evaluate the address once and,
+    # unless the operator has no memory form, change the memory with a single
+    # instruction. The right side goes in EBX and the address in ECX, swapped
+    # for shifts, whose count has to be in %cl.
+    typ = self.rtype
+    size = typ.sizeof()
+    shift = self.op in SHIFTS
+    src, addr = shift and (ECX, EBX) or (EBX, ECX)
+
+    imm = constant_value(self.exp)
+    if imm is not None and self.op in IN_PLACE:
+        bits = 8 * min(size, 4)  # as wide as the memory changed
+        src = S((imm + 2 ** (bits - 1)) % 2**bits - 2 ** (bits - 1))
+    elif imm is not None:
+        src = S(imm)
+    if isinstance(self.var, VarExp):
+        if imm is None:
+            self.exp.compile(cmp)
+            cmp.mov(EAX, src)
+        mem = self.var.resolved_as.reg()
+    else:
+        self.var.exp.compile(cmp)
+        if imm is None:
+            cmp.push(EAX)
+            self.exp.compile(cmp)
+            cmp.mov(EAX, src)
+            cmp.pop(addr)
+        else:
+            cmp.mov(EAX, addr)
+        mem = addr.deref()
+
+    if self.op not in IN_PLACE:
+        if imm is not None:
+            cmp.mov(src, EBX)
+        cmp.load(mem, typ)
+        optype = arithmetic_type(self.op, typ, self.exp.rtype)
+        compile_operation(cmp, self.op, optype)
+        cmp.store(EAX, mem, typ)
+        if used:
+            cmp.convert(typ, optype)
+        return
+
+    if used and self.postfix:
+        cmp.load(mem, typ)
+    op = IN_PLACE[self.op]
+    if self.op == ">>" and typ.is_unsigned():
+        op = "shr"  # narrow unsigned values are never negative either
+    if self.op in {"+", "-"} and imm == 1:
+        cmp.emit(self.op == "+" and "inc" or "dec", mem, size=size)
+    else:
+        cmp.emit(op, src, mem, size=size)
+    if used and not self.postfix:
+        cmp.load(mem, typ)
 
 
 @monkeypatch(SizeofExp)
 def compile(self: SizeofExp, cmp: Compiler):
-    cmp.movl(S(self.type.sizeof()), EAX)
+    cmp.mov(S(self.type.sizeof()), EAX)
 
 
 @monkeypatch(CastExp)
 def compile(self: CastExp, cmp: Compiler):
-    cmp.compile(self.exp)
+    self.exp.compile(cmp)
+    cmp.convert(self.to, self.exp.rtype)
 
 
 # --- Statements --- #
 
 
+def compile_effect(cmp: Compiler, exp: Ast):
+    # compiles an expression whose value is not used
+    if isinstance(exp, AssignExp):
+        exp.assign(cmp)
+    else:
+        exp.compile(cmp)
+
+
 @monkeypatch(ExpStmt)
 def compile(self: ExpStmt, cmp: Compiler):
-    self.exp.compile(cmp)
+    compile_effect(cmp, self.exp)
 
 
 @monkeypatch(VarStmt)
 def compile(self: VarStmt, cmp: Compiler):
     for var in self.vars:
         if self.is_static:
-            cmp.add_global(var.resolved_as.name)
+            cmp.add_global(var.resolved_as.name, var.resolved_as.typ)
 
         if var.exp is None:
             continue
@@ -332,7 +570,7 @@ def compile(self: VarStmt, cmp: Compiler):
             compile_array(cmp, var.exp, var.resolved_as, var.resolved_as.typ)
         else:
             var.exp.compile(cmp)
-            cmp.movl(EAX, var.resolved_as.reg())
+            cmp.store(EAX, var.resolved_as.reg(), var.resolved_as.typ)
 
 
 def compile_array(cmp: Compiler, exp: ArrayExp, var, typ, idx=0):
@@ -342,7 +580,7 @@ def compile_array(cmp: Compiler, exp: ArrayExp, var, typ, idx=0):
             compile_array(cmp, exp.exps[off], var, typ.inner, idx + off * step)
     else:
         exp.compile(cmp)
-        cmp.movl(EAX, var.reg(off=-idx))
+        cmp.store(EAX, var.reg(off=-idx), typ)
 
 
 @monkeypatch(ReturnStmt)
@@ -358,45 +596,194 @@ def compile(self: BlockStmt, cmp: Compiler):
         stmt.compile(cmp)
 
 
+def compile_branch(cmp: Compiler, branch: Union[Ast, None]):
+    if branch is not None:
+        cmp.probe(branch)
+        branch.compile(cmp)
+
+
 @monkeypatch(IfStmt)
 def compile(self: IfStmt, cmp: Compiler):
+    cmp.probe(self)
     self.cond.compile(cmp)
-    cmp.cmpl(S(0), EAX)
+    cmp.cmp(S(0), EAX)
 
-    if self.else_ is None:
-        end = cmp.make_label(".J")
-        cmp.je(end)
-        self.then.compile(cmp)
+    # `first` falls through, `second` is jumped to
+    first, second, jump = self.then, self.else_, cmp.je
+    if self.swap:
+        first, second, jump = self.else_, self.then, cmp.jne
+
+    end = cmp.make_label(".J")
+    if second is None:
+        jump(end)
+        compile_branch(cmp, first)
+        cmp.label(end)
+    elif self.cold:
+        # the branch that never ran is moved out of the hot path
+        other = cmp.make_label(".J")
+        jump(other)
+        compile_branch(cmp, first)
         cmp.label(end)
+        cmp.add_line(".pushsection .text.unlikely")
+        cmp.label(other)
+        compile_branch(cmp, second)
+        cmp.jmp(end)
+        cmp.add_line(".popsection")
     else:
-        else_ = cmp.make_label(".J")
-        end = cmp.make_label(".J")
-        cmp.je(else_)  # ------------|
-        self.then.compile(cmp)  #     |
-        cmp.jmp(end)  # ----|  |
-        cmp.label(else_)  # -------|--|
-        self.else_.compile(cmp)  # |
+        other = cmp.make_label(".J")
+        jump(other)  # ----------------|
+        compile_branch(cmp, first)  #  |
+        cmp.jmp(end)  # -----------|   |
+        cmp.label(other)  # -------|---|
+        compile_branch(cmp, second)  #
         cmp.label(end)  # ---------|
 
 
+def compile_rotated(
+    cmp: Compiler,
+    loop: WhileStmt,
+    cond: Ast,
+    copies: int,
+    exit: str,
+    guard: bool = True,
+):
+    # bottom-tested loop: one conditional jump per iteration, plus a guard
+    # up front unless the loop is known to run at least once
+    THEN = cmp.make_label(".S")
+
+    if guard:
+        cond.compile(cmp)
+        cmp.cmp(S(0), EAX)
+        cmp.je(exit)
+
+    cmp.label(THEN)
+    for _ in range(copies):
+        NEXT = cmp.make_label(".C")
+        cmp.continue_stack.append(NEXT)
+        cmp.probe(loop.block)
+        loop.block.compile(cmp)
+        cmp.continue_stack.pop()
+        cmp.label(NEXT)
+        if loop.step is not None:
+            compile_effect(cmp, loop.step)
+
+    cond.compile(cmp)
+    cmp.cmp(S(0), EAX)
+    cmp.jne(THEN)
+
+
 @monkeypatch(WhileStmt)
 def compile(self: WhileStmt, cmp: Compiler):
-    THEN = cmp.make_label(".S")
     FINAL = cmp.make_label(".E")
-
     cmp.break_stack.append(FINAL)
-    cmp.continue_stack.append(THEN)
+    cmp.probe(self)
 
-    cmp.label(THEN)
-    self.cond.compile(cmp)
-    cmp.cmpl(S(0), EAX)
-    cmp.je(FINAL)
-    self.block.compile(cmp)
-    cmp.jmp(THEN)
-    cmp.label(FINAL)
+    factor = cmp.unroll_factor
+    if self.counted is None or factor <= 1:
+        compile_rotated(cmp, self, self.cond, 1, FINAL)
+    else:
+        # unrolled loop while there is room for `factor` iterations, then a
+        # remainder loop for whatever is left
+        main, rest = self.counted.split(factor)
+        if main != 0:
+            REST = cmp.make_label(".R")
+            cond = self.counted.unrolled_cond(factor)
+            compile_rotated(cmp, self, cond, factor, REST, guard=main is None)
+            cmp.label(REST)
+        if rest != 0:
+            compile_rotated(cmp, self, self.cond, 1, FINAL, guard=rest is None)
 
+    cmp.label(FINAL)
     cmp.break_stack.pop()
-    cmp.continue_stack.pop()
+
+
+# dispatch tables for at least this many cases, filling at least 1/3 of them
+MIN_TABLE_CASES = 4
+MAX_TABLE_SPAN = 3  # entries per case
+LINEAR_CASES = 3  # compared one by one, below a decision tree
+
+
+def compile_table(cmp: Compiler, cases: list[tuple[int, str]], default: str):
+    # the value minus the lowest case indexes a table of case labels; with
+    # unsigned compare anything out of range, below too, takes the default
+    low, high = cases[0][0], cases[-1][0]
+    if low != 0:
+        cmp.sub(S(low), EAX)
+    cmp.cmp(S(high - low), EAX)
+    cmp.ja(default)
+
+    table = "." + cmp.make_label("T")
+    entries = dict(cases)
+    # on x86-64 entries are relative to the table, so it needs no relocations
+    relative = cmp.target.word == 8 and f"-{table}" or ""
+    cmp.constants += ["    .align 4", f"{table}:"]
+    for value in range(low, high + 1):
+        cmp.constants.append(f"    .long {entries.get(value, default)}{relative}")
+
+    if not relative:
+        cmp.jmp(Indexed(EAX, 4, table=table))
+    else:
+        cmp.lea(Sym(table), EDX)
+        cmp.emit("movs", Indexed(EAX, 4, base=EDX), EAX, size=4)
+        cmp.add(EDX, EAX)
+        cmp.jmp(EAX)
+
+
+def compile_dispatch(cmp: Compiler, cases: list[tuple[int, str]], default: str):
+    # jumps to the label of the case equal to EAX, sorted by value: a table
+    # when dense enough, otherwise a balanced binary search, whose halves may
+    # in turn be dense
+    span = cases and cases[-1][0] - cases[0][0] + 1
+    if len(cases) >= MIN_TABLE_CASES and span <= MAX_TABLE_SPAN * len(cases):
+        compile_table(cmp, cases, default)
+    elif len(cases) <= LINEAR_CASES:
+        for value, label in cases:
+            cmp.cmp(S(value), EAX)
+            cmp.je(label)
+        cmp.jmp(default)
+    else:
+        mid = len(cases) // 2
+        value, label = cases[mid]
+        HIGH = cmp.make_label(".W")
+        cmp.cmp(S(value), EAX)
+        cmp.je(label)
+        cmp.jg(HIGH)
+        compile_dispatch(cmp, cases[:mid], default)
+        cmp.label(HIGH)
+        compile_dispatch(cmp, cases[mid + 1 :], default)
+
+
+@monkeypatch(SwitchStmt)
+def compile(self: SwitchStmt, cmp: Compiler):
+    cmp.probe(self)
+    self.cond.compile(cmp)
+    cmp.convert(TypeInt, self.cond.rtype)  # the values are signed, like the cases
+
+    END = cmp.make_label(".E")
+    labels = [cmp.make_label(".K") for _ in self.cases]
+    default = END
+    for case, label in zip(self.cases, labels):
+        if case.exp is None:
+            default = label
+    cases = sorted(
+        (case.value, label)
+        for case, label in zip(self.cases, labels)
+        if case.exp is not None
+    )
+    compile_dispatch(cmp, cases, default)
+
+    if not self.chain:
+        cmp.break_stack.append(END)
+    for case, label in zip(self.cases, labels):
+        cmp.label(label)
+        cmp.probe(case)
+        for stmt in case.stmts:
+            stmt.compile(cmp)
+        if self.chain and case.stmts and case is not self.cases[-1]:
+            cmp.jmp(END)
+    if not self.chain:
+        cmp.break_stack.pop()
+    cmp.label(END)
 
 
 @monkeypatch(BreakStmt)
@@ -422,15 +809,19 @@ def compile(self: FunDefTop, cmp: Compiler):
     name = self.head.name
     bytes_locals = self.max_stack_size
 
-    cmp.add_line(".text")
+    if self.section == ".text":
+        cmp.add_line(".text")
+    else:
+        cmp.add_line(f'.section  {self.section}, "ax", @progbits')
     cmp.add_line(f".globl {name}")
     cmp.add_line(f".type {name}, @function")
     cmp.label(name)
 
-    cmp.pushl(EBP)
-    cmp.movl(ESP, EBP)
-    if bytes_locals != 0:
-        cmp.addl(S(bytes_locals), ESP)
+    cmp.emit_prologue(bytes_locals)
+    regs = cmp.target.param_regs[: cmp.globals[name].regparm]
+    for local, reg in zip(self.param_locals, regs):
+        cmp.store(reg, local.reg(), local.typ)
+    cmp.probe(self)
     cmp.nl()
 
     for stmt in self.body:
@@ -438,7 +829,7 @@ def compile(self: FunDefTop, cmp: Compiler):
 
     cmp.nl()
     if self.head.sig.ret != TypeVoid:
-        cmp.movl(S(0), EAX)  # TODO: para cuando no seamos "monotipo"
+        cmp.mov(S(0), EAX)  # TODO: para cuando no seamos "monotipo"
     cmp.emit_return()
     cmp.nl()
 
@@ -446,7 +837,7 @@ def compile(self: FunDefTop, cmp: Compiler):
 @monkeypatch(VarTop)
 def compile(self: VarTop, cmp: Compiler):
     for var in self.vars:
-        cmp.add_global(var.resolved_as.name)
+        cmp.add_global(var.resolved_as.name, var.resolved_as.typ)
 
 
 @monkeypatch(Program)
@@ -0,0 +1,245 @@
+from astnodes import *
+from typenodes import *
+from commonitems import *
+from frame import address_taken
+from dataclasses import dataclass, field
+from typing import Union
+
+# Common subexpression elimination.
+#
+# Expressions are value-numbered by their structure, with variables compared
+# by identity. The first evaluation of a pure expression stores its value in a
+# temporary local (`cse.N = exp`) and later evaluations read the temporary
+# back, as long as nothing in between may have changed its inputs:
+#
+# - assigning a variable kills everything that reads it,
+# - stores through pointers and calls kill everything that reads memory
+#   (loads, globals and locals whose address is taken).
+#
+# Available values flow into the code they dominate: from an `if` condition
+# into both branches, and from before a loop into it when nothing in the loop
+# kills them. Temporaries that end up never reused are dropped again.
+
+PURE_OPS = {"+", "-", "*", "/", "%", "&", "|", "^", "<<", ">>"}
+PURE_OPS |= {"==", "!=", "<", ">", "<=", ">="}
+
+
+@dataclass
+class Value:
+    temp: Local
+    name: str
+    deps: set[int]
+    memory: bool  # may change through stores and calls
+    uses: int = 0
+
+
+@dataclass
+class CSE:
+    fun: FunDefTop
+    taken: set[int] = field(default_factory=set)
+    defs: dict[int, Value] = field(default_factory=dict)
+    num_temps: int = 0
+
+    def key(self, exp: Ast) -> Union[tuple, None]:
+        if isinstance(exp, NumExp):
+            return ("num", exp.lit)
+
+        if isinstance(exp, VarExp):
+            return ("var", id(exp.resolved_as))
+
+        if isinstance(exp, BinaryExp) and exp.op in PURE_OPS:
+            k1, k2 = self.key(exp.exp1), self.key(exp.exp2)
+            return k1 and k2 and ("bin", exp.op, k1, k2)
+
+        if isinstance(exp, UnaryExp) and exp.op in {"-", "~", "!"}:
+            k = self.key(exp.exp)
+            return k and ("un", exp.op, k)
+
+        if isinstance(exp, UnaryExp) and exp.op == "*":
+            if isinstance(exp.rtype, TypeArray):
+                return None  # rows of multidimensional arrays aren't values
+            k = self.key(exp.exp)
+            return k and ("load", k)
+
+        return None
+
+    def reads_memory(self, exp: Ast) -> bool:
+        for node in walk(exp):
+            if isinstance(node, UnaryExp) and node.op == "*":
+                return True
+            if isinstance(node, VarExp) and (
+                isinstance(node.resolved_as, Global)
+                or id(node.resolved_as) in self.taken
+            ):
+                return True
+        return False
+
+    def is_candidate(self, exp: Ast) -> bool:
+        return not isinstance(exp, (NumExp, VarExp)) and any(
+            isinstance(node, VarExp) for node in walk(exp)
+        )
+
+    # --- Temporaries --- #
+
+    def define(self, exp: Ast, key: tuple, table: dict) -> Ast:
+        typ = exp.rtype or TypeInt
+        if isinstance(typ, TypeArray):
+            typ = typ.inner.as_ptr()
+        typ = typ.dup_as_rvalue()
+
+        self.fun.max_stack_size = align_up(
+            self.fun.max_stack_size + typ.sizeof(), typ.alignof()
+        )
+        self.num_temps += 1
+        temp = Local(typ=typ, addr=self.fun.max_stack_size)
+        value = Value(
+            temp=temp,
+            name=f"cse.{self.num_temps}",
+            deps={
+                id(node.resolved_as) for node in walk(exp) if isinstance(node, VarExp)
+            },
+            memory=self.reads_memory(exp),
+        )
+        table[key] = value
+
+        var = VarExp(pos=exp.pos, lit=value.name, resolved_as=temp)
+        var.rtype = typ.dup_as_lvalue()
+        define = AssignExp(pos=exp.pos, var=var, exp=exp)
+        define.rtype = typ
+        self.defs[id(define)] = value
+        return define
+
+    def use(self, value: Value, pos: int) -> Ast:
+        value.uses += 1
+        var = VarExp(pos=pos, lit=value.name, resolved_as=value.temp)
+        var.rtype = value.temp.typ.dup_as_lvalue()
+        return var
+
+    def drop_unused(self, ast: Ast) -> Ast:
+        transform(ast, self.drop_unused)
+        value = self.defs.get(id(ast), None)
+        if value is not None and value.uses == 0:
+            return ast.exp
+        return ast
+
+    # --- Kills --- #
+
+    def kill(self, table: dict, memory: bool = False, local: Item = None):
+        for k, value in list(table.items()):
+            if memory and value.memory or local is not None and id(local) in value.deps:
+                del table[k]
+
+    def kill_var(self, table: dict, local: Item):
+        escapes = isinstance(local, Global) or id(local) in self.taken
+        self.kill(table, memory=escapes, local=local)
+
+    def kill_loop(self, table: dict, loop: Union[WhileStmt, SwitchStmt]):
+        for node in walk(loop):
+            if isinstance(node, AssignExp) and isinstance(node.var, VarExp):
+                self.kill_var(table, node.var.resolved_as)
+            elif isinstance(node, AssignExp) or isinstance(node, CallExp):
+                self.kill(table, memory=True)
+            elif isinstance(node, VarDecl):
+                self.kill_var(table, node.resolved_as)
+
+    # --- Traversal --- #
+
+    def exp(self, exp: Ast, table: dict) -> Ast:
+        if isinstance(exp, BinaryExp) and exp.op in {"&&", "||"}:
+            exp.exp1 = self.exp(exp.exp1, table)
+            exp.exp2 = self.exp(exp.exp2, dict(table))  # may not be evaluated
+            return exp
+
+        if isinstance(exp, CallExp):
+            # arguments are evaluated in an order that depends on the calling
+            # convention, so they only share what was available before
+            exp.args = [self.exp(arg, dict(table)) for arg in exp.args]
+            self.kill(table, memory=True)
+            return exp
+
+        if isinstance(exp, AssignExp):
+            if exp.op is not None and not isinstance(exp.var, VarExp):
+                # compound assignments compute the address first (see
+                # AssignExp.update in compiler.py)
+                exp.var.exp = self.exp(exp.var.exp, table)
+                exp.exp = self.exp(exp.exp, table)
+                self.kill(table, memory=True)
+                return exp
+            exp.exp = self.exp(exp.exp, table)
+            if isinstance(exp.var, VarExp):
+                self.kill_var(table, exp.var.resolved_as)
+            else:
+                exp.var.exp = self.exp(exp.var.exp, table)
+                self.kill(table, memory=True)
+            return exp
+
+        if isinstance(exp, UnaryExp) and exp.op == "&":
+            if isinstance(exp.exp, UnaryExp) and exp.exp.op == "*":
+                exp.exp.exp = self.exp(exp.exp.exp, table)
+            return exp
+
+        key = self.key(exp)
+        if key is not None and key in table:
+            return self.use(table[key], exp.pos)
+
+        transform(exp, lambda child: self.exp(child, table))
+        if key is not None and self.is_candidate(exp):
+            return self.define(exp, key, table)
+        return exp
+
+    def stmt(self, stmt: Ast, table: dict):
+        if isinstance(stmt, BlockStmt):
+            for s in stmt.stmts:
+                self.stmt(s, table)
+
+        elif isinstance(stmt, IfStmt):
+            stmt.cond = self.exp(stmt.cond, table)
+            then, else_ = dict(table), dict(table)
+            self.stmt(stmt.then, then)
+            if stmt.else_ is not None:
+                self.stmt(stmt.else_, else_)
+
+            for k, value in list(table.items()):
+                if then.get(k, None) is not value or else_.get(k, None) is not value:
+                    del table[k]
+
+        elif isinstance(stmt, WhileStmt):
+            self.kill_loop(table, stmt)
+            stmt.cond = self.exp(stmt.cond, dict(table))
+            self.stmt(stmt.block, dict(table))
+            if stmt.step is not None:
+                stmt.step = self.exp(stmt.step, dict(table))
+
+        elif isinstance(stmt, SwitchStmt):
+            # a case is entered from the dispatch and by falling through, so
+            # it only starts with what nothing in the switch kills
+            stmt.cond = self.exp(stmt.cond, table)
+            self.kill_loop(table, stmt)
+            for case in stmt.cases:
+                body = dict(table)
+                for s in case.stmts:
+                    self.stmt(s, body)
+
+        elif isinstance(stmt, VarStmt):
+            for var in stmt.vars:
+                if var.exp is not None:
+                    var.exp = self.exp(var.exp, table)
+                self.kill_var(table, var.resolved_as)
+
+        elif isinstance(stmt, (ExpStmt, ReturnStmt)):
+            if stmt.exp is not None:
+                stmt.exp = self.exp(stmt.exp, table)
+
+    def run(self) -> int:
+        self.taken = address_taken(self.fun.body)
+        table = {}
+        for stmt in self.fun.body:
+            self.stmt(stmt, table)
+        self.fun.body = [self.drop_unused(stmt) for stmt in self.fun.body]
+        return sum(value.uses for value in self.defs.values())
+
+
+def eliminate_common_subexps(prog: Program) -> int:
+    return sum(
+        CSE(fun=top).run() for top in prog.topdecls if isinstance(top, FunDefTop)
+    )
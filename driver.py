@@ -0,0 +1,370 @@
+import os
+import sys
+import time
+import shutil
+import hashlib
+import argparse
+import tempfile
+import subprocess
+from main import process_file
+from target import TARGETS, select_target
+from passes import LEVELS, PassManager
+from interface import InterfaceError, Project
+from lto import compile_lto
+from runtime import runtime_unit
+from allocator import ALLOCATORS, allocator_unit
+from objfile import AssemblerError, assemble
+from dataclasses import dataclass, field
+from concurrent.futures import ThreadPoolExecutor
+from typing import Union
+
+# Build driver.
+#
+# Compiles every source to assembly, assembles the units in parallel with the
+# system assembler and links them with `cc` (or `ld` plus the C runtime
+# files `cc` knows about). Object files are cached by the hash of their
+# assembly, so a unit whose generated code did not change is never assembled
+# again.
+#
+# With several sources each one is compiled as a unit of the same program,
+# and only the units that need it are compiled again (see interface.py).
+# With --lto they are compiled together as a single unit instead (see lto.py).
+#
+# With --nolibc the project's own runtime is assembled as one more unit and
+# the program is linked statically with `ld`, without libc or its startup
+# files (see runtime.py). An allocator other than libc's is one more unit as
+# well (see allocator.py).
+#
+# With --assembler pycc the objects are written by the compiler itself (see
+# objfile.py) instead of `as`, and only linking runs an external tool.
+
+AS_FLAGS = {"x86": ["--32"], "x86_64": ["--64"]}
+CC_FLAGS = {"x86": ["-m32"], "x86_64": []}
+LD_FLAGS = {
+    "x86": ["-m", "elf_i386", "-dynamic-linker", "/lib/ld-linux.so.2"],
+    "x86_64": ["-m", "elf_x86_64", "-dynamic-linker", "/lib64/ld-linux-x86-64.so.2"],
+}
+
+
+RUNTIME = "pycc-runtime"
+ALLOCATOR = "pycc-alloc"
+
+
+class BuildError(Exception):
+    pass
+
+
+@dataclass
+class Step:
+    name: str
+    seconds: float
+    note: str = ""
+
+
+@dataclass
+class Unit:
+    source: str
+    asm: str = None
+    obj: str = None
+    cached: bool = False
+
+
+def default_cache_dir() -> str:
+    base = os.environ.get("XDG_CACHE_HOME", os.path.expanduser("~/.cache"))
+    return os.path.join(base, "pycc")
+
+
+@dataclass
+class Driver:
+    target: str = "x86"
+    level: str = "2"
+    jobs: int = os.cpu_count() or 1
+    cache_dir: Union[str, None] = None
+    linker: str = "cc"
+    build_dir: str = ".pycc-build"
+    lto: bool = False
+    nolibc: bool = False
+    allocator: str = "libc"
+    assembler: str = "as"  # or "pycc", see objfile.py
+    steps: list[Step] = field(default_factory=list)
+
+    def timed(self, name: str, f, *args, note: str = ""):
+        start = time.perf_counter()
+        result = f(*args)
+        self.steps.append(Step(name, time.perf_counter() - start, note))
+        return result
+
+    def run(self, cmd: list[str]):
+        proc = subprocess.run(cmd, capture_output=True, text=True)
+        if proc.returncode != 0:
+            raise BuildError(f"{cmd[0]} falló:\n{proc.stderr.strip()}")
+
+    # --- Steps --- #
+
+    def compile(self, unit: Unit):
+        with open(unit.source, "r") as f:
+            unit.asm = process_file(
+                f.read(),
+                target=self.target,
+                level=self.level,
+                freestanding=self.nolibc,
+                allocator=self.allocator,
+            )
+        if unit.asm is None:
+            raise BuildError(f"no se pudo compilar '{unit.source}'")
+
+    def compile_lto(self, sources: list[str]) -> Unit:
+        pm = PassManager(level=self.level)
+        asm = compile_lto(
+            sources,
+            self.target,
+            self.level,
+            max(1, self.jobs),
+            pm,
+            self.nolibc,
+            self.allocator,
+        )
+        for s in pm.stats:
+            note = s.changes is not None and f"{s.changes} cambios" or ""
+            self.steps.append(Step(s.name, s.seconds, note))
+        return Unit(source="lto", asm=asm)
+
+    def cache_path(self, unit: Unit) -> Union[str, None]:
+        if self.cache_dir is None:
+            return None
+        text = f"{self.target}\n{self.assembler}\n{unit.asm}"
+        key = hashlib.sha256(text.encode()).hexdigest()
+        return os.path.join(self.cache_dir, key + ".o")
+
+    def assemble(self, unit: Unit, obj: str):
+        cached = self.cache_path(unit)
+        if cached is not None and os.path.exists(cached):
+            shutil.copyfile(cached, obj)
+            unit.obj, unit.cached = obj, True
+            return
+
+        if self.assembler == "pycc":
+            try:
+                data = assemble(unit.asm, select_target(self.target))
+            except AssemblerError as e:
+                raise BuildError(f"no se pudo ensamblar '{unit.source}': {e}")
+            with open(obj, "wb") as f:
+                f.write(data)
+        else:
+            asm = obj[: -len(".o")] + ".s"
+            with open(asm, "w") as f:
+                f.write(unit.asm + "\n")
+            self.run(["as", *AS_FLAGS[self.target], asm, "-o", obj])
+            os.remove(asm)
+        unit.obj = obj
+
+        if cached is not None:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            tmp = f"{cached}.{os.getpid()}"
+            shutil.copyfile(obj, tmp)
+            os.replace(tmp, cached)  # atomic, other builds may share the cache
+
+    def assemble_all(self, units: list[Unit], objs: list[str]):
+        def job(unit: Unit, obj: str):
+            start = time.perf_counter()
+            self.assemble(unit, obj)
+            return Step(
+                f"{self.assembler} {unit.source}",
+                time.perf_counter() - start,
+                unit.cached and "caché" or "",
+            )
+
+        with ThreadPoolExecutor(max_workers=max(1, self.jobs)) as pool:
+            futures = [pool.submit(job, u, o) for u, o in zip(units, objs)]
+            self.steps += [f.result() for f in futures]
+
+    def link(self, objs: list[str], out: str):
+        if self.nolibc:
+            emulation = LD_FLAGS[self.target][:2]
+            self.run(["ld", *emulation, "-static", "-o", out, *objs])
+            return
+
+        if self.linker == "cc":
+            self.run(["cc", *CC_FLAGS[self.target], *objs, "-o", out])
+            return
+
+        cc = ["cc", *CC_FLAGS[self.target]]
+
+        def runtime(name: str) -> str:
+            proc = subprocess.run(
+                [*cc, f"-print-file-name={name}"], capture_output=True, text=True
+            )
+            return proc.stdout.strip()
+
+        self.run(
+            [
+                "ld",
+                *LD_FLAGS[self.target],
+                "-o",
+                out,
+                runtime("crt1.o"),
+                runtime("crti.o"),
+                *objs,
+                "-lc",
+                runtime("crtn.o"),
+            ]
+        )
+
+    # --- Build --- #
+
+    def build(self, sources: list[str], out: str = None, mode: str = "link"):
+        units = [Unit(source=s) for s in sources]
+        if self.lto:
+            units = [self.compile_lto(sources)]
+            sources = ["lto"]  # -c and -S without -o write lto.o or lto.s
+        elif len(sources) == 1:
+            self.timed(f"compilar {sources[0]}", self.compile, units[0])
+        else:
+            project = Project(
+                self.build_dir,
+                self.target,
+                self.level,
+                self.timed,
+                self.nolibc,
+                self.allocator,
+            )
+            reasons = {}
+            for unit, built in zip(units, project.build(sources)):
+                unit.asm = built.asm
+                reasons[f"compilar {unit.source}"] = built.reason
+            for step in self.steps:
+                step.note = reasons.get(step.name, None) or step.note
+
+        target = select_target(self.target)
+        libs = []
+        if self.nolibc:
+            libs.append(Unit(source=RUNTIME, asm=runtime_unit(target)))
+        if self.allocator != "libc":
+            asm = allocator_unit(target, self.allocator)
+            libs.append(Unit(source=ALLOCATOR, asm=asm))
+        units += libs
+
+        if mode in ("asm", "object"):
+            ext = mode == "asm" and ".s" or ".o"
+            paths = outputs(sources, out, ext)
+            # next to the other outputs, which need them to link
+            for lib in libs:
+                paths.append(os.path.join(os.path.dirname(paths[0]), lib.source + ext))
+
+        if mode == "asm":
+            for unit, path in zip(units, paths):
+                with open(path, "w") as f:
+                    f.write(unit.asm + "\n")
+            return
+
+        if mode == "object":
+            self.assemble_all(units, paths)
+            return
+
+        with tempfile.TemporaryDirectory(prefix="pycc") as tmp:
+            objs = [os.path.join(tmp, f"{i}.o") for i in range(len(units))]
+            self.assemble_all(units, objs)
+            self.timed("enlazar", self.link, objs, out or "a.out")
+
+    def report(self) -> list[str]:
+        lines = [
+            f"{s.name:<40} {s.seconds * 1000:9.3f} ms {s.note}".rstrip()
+            for s in self.steps
+        ]
+        total = sum(s.seconds for s in self.steps)
+        lines.append(f"{'total':<40} {total * 1000:9.3f} ms")
+        return lines
+
+
+def outputs(sources: list[str], out: Union[str, None], ext: str) -> list[str]:
+    if out is not None:
+        if len(sources) != 1:
+            raise BuildError("-o con -c o -S necesita un único fichero de entrada")
+        return [out]
+    return [os.path.splitext(os.path.basename(s))[0] + ext for s in sources]
+
+
+def main():
+    args = argparse.ArgumentParser(prog="driver.py")
+    args.add_argument("ficheros", nargs="+")
+    args.add_argument("-o", dest="out", metavar="SALIDA")
+    args.add_argument(
+        "-c",
+        dest="mode",
+        action="store_const",
+        const="object",
+        default="link",
+        help="genera ficheros objeto sin enlazar",
+    )
+    args.add_argument(
+        "-S",
+        dest="mode",
+        action="store_const",
+        const="asm",
+        help="genera ficheros de ensamblador",
+    )
+    args.add_argument("-O", dest="level", choices=LEVELS, default="2")
+    args.add_argument("--target", choices=sorted(TARGETS), default="x86")
+    args.add_argument("-j", dest="jobs", type=int, default=os.cpu_count() or 1)
+    args.add_argument("--linker", choices=["cc", "ld"], default="cc")
+    args.add_argument(
+        "--assembler",
+        choices=["as", "pycc"],
+        default="as",
+        help="ensamblador de las unidades (pycc escribe los objetos sin as)",
+    )
+    args.add_argument("--cache-dir", default=default_cache_dir())
+    args.add_argument("--no-cache", action="store_true")
+    args.add_argument(
+        "--build-dir",
+        default=".pycc-build",
+        help="estado de la compilación incremental de varios ficheros",
+    )
+    args.add_argument(
+        "--lto",
+        action="store_true",
+        help="optimiza todos los ficheros juntos como un único programa",
+    )
+    args.add_argument(
+        "--nolibc",
+        action="store_true",
+        help="enlaza estáticamente con el runtime propio, sin libc",
+    )
+    args.add_argument(
+        "--malloc",
+        choices=ALLOCATORS,
+        help="asignador de memoria para malloc y free (por defecto libc, o "
+        "classes con --nolibc)",
+    )
+    args.add_argument(
+        "--timings",
+        action="store_true",
+        help="muestra cuánto tardó cada paso",
+    )
+    opts = args.parse_args()
+
+    driver = Driver(
+        target=opts.target,
+        level=opts.level,
+        jobs=opts.jobs,
+        cache_dir=None if opts.no_cache else opts.cache_dir,
+        linker=opts.linker,
+        build_dir=opts.build_dir,
+        lto=opts.lto,
+        nolibc=opts.nolibc,
+        allocator=opts.malloc or (opts.nolibc and "classes" or "libc"),
+        assembler=opts.assembler,
+    )
+    try:
+        driver.build(opts.ficheros, opts.out, opts.mode)
+    except (BuildError, InterfaceError, OSError) as e:
+        print(f"error: {e}", file=sys.stderr)
+        sys.exit(1)
+    finally:
+        if opts.timings:
+            for line in driver.report():
+                print(line, file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,696 @@
+import re
+import struct
+from dataclasses import dataclass, field
+from typing import Union
+
+# x86 instruction encoding.
+#
+# Turns the AT&T instructions emitted by the compiler, the runtime and the
+# allocators into machine code. The forms are the ones the GNU assembler
+# picks (the shortest immediate and displacement, the register to r/m
+# direction for operations between registers, the accumulator forms), so
+# that an object can be checked byte for byte against one built with `as`.
+#
+# What refers to a symbol is left as a fixup for objfile.py, which either
+# resolves it or turns it into a relocation. Direct jumps are not encoded
+# here: their size depends on the layout, which objfile.py relaxes.
+
+
+class EncodeError(Exception):
+    pass
+
+
+REGS: dict[str, tuple[int, int]] = {}  # name -> (number, size)
+for n, r in enumerate(("ax", "cx", "dx", "bx", "sp", "bp", "si", "di")):
+    REGS["r" + r], REGS["e" + r], REGS[r] = (n, 8), (n, 4), (n, 2)
+for n, r in enumerate(("al", "cl", "dl", "bl", "spl", "bpl", "sil", "dil")):
+    REGS[r] = (n, 1)
+for n, r in enumerate(("ah", "ch", "dh", "bh"), 4):
+    REGS[r] = (n, 1)
+for n in range(8, 16):
+    REGS[f"r{n}"], REGS[f"r{n}d"] = (n, 8), (n, 4)
+    REGS[f"r{n}w"], REGS[f"r{n}b"] = (n, 2), (n, 1)
+
+HIGH_BYTES = {"ah", "ch", "dh", "bh"}  # not addressable with a REX prefix
+REX_BYTES = {"spl", "bpl", "sil", "dil"}  # only addressable with one
+
+CONDITIONS = {
+    "o": 0, "no": 1, "b": 2, "c": 2, "nae": 2, "ae": 3, "nb": 3, "nc": 3,
+    "e": 4, "z": 4, "ne": 5, "nz": 5, "be": 6, "na": 6, "a": 7, "nbe": 7,
+    "s": 8, "ns": 9, "p": 10, "pe": 10, "np": 11, "po": 11, "l": 12, "nge": 12,
+    "ge": 13, "nl": 13, "le": 14, "ng": 14, "g": 15, "nle": 15,
+}  # fmt: skip
+
+SUFFIXES = {"b": 1, "w": 2, "l": 4, "q": 8}
+ALU = {"add": 0, "or": 1, "adc": 2, "sbb": 3, "and": 4, "sub": 5, "xor": 6, "cmp": 7}
+UNARY = {"not": 2, "neg": 3, "mul": 4, "imul": 5, "div": 6, "idiv": 7}
+SHIFTS = {"rol": 0, "ror": 1, "shl": 4, "sal": 4, "shr": 5, "sar": 7}
+EXTENDS = {"movzb": b"\x0f\xb6", "movzw": b"\x0f\xb7", "movsb": b"\x0f\xbe", "movsw": b"\x0f\xbf"}  # fmt: skip
+PLAIN = {
+    "ret": b"\xc3", "leave": b"\xc9", "cltd": b"\x99", "cwtl": b"\x98",
+    "cqto": b"\x48\x99", "cltq": b"\x48\x98", "syscall": b"\x0f\x05",
+    "nop": b"\x90", "hlt": b"\xf4", "ud2": b"\x0f\x0b",
+    "movsb": b"\xa4", "movsl": b"\xa5", "movsq": b"\x48\xa5",
+    "stosb": b"\xaa", "stosl": b"\xab", "stosq": b"\x48\xab",
+    "lodsb": b"\xac", "scasb": b"\xae", "cmpsb": b"\xa6",
+}  # fmt: skip
+PREFIXES = {"rep": b"\xf3", "repe": b"\xf3", "repz": b"\xf3", "repne": b"\xf2", "repnz": b"\xf2"}  # fmt: skip
+
+
+# --- Operands --- #
+
+
+@dataclass
+class Register:
+    name: str
+    num: int
+    size: int
+
+
+@dataclass
+class Expr:
+    value: int = 0
+    sym: Union[str, None] = None
+    modifier: Union[str, None] = None  # PLT, GOTPCREL
+    base: Union[str, None] = None  # subtracted symbol, as in `.L3-.L2`
+
+
+@dataclass
+class Imm:
+    expr: Expr
+
+
+@dataclass
+class Addr:
+    disp: Expr = field(default_factory=Expr)
+    base: Union[Register, None] = None
+    index: Union[Register, None] = None
+    scale: int = 1
+    rip: bool = False
+
+
+@dataclass
+class Indirect:
+    op: Union[Register, Addr]  # `*op`, for calls and jumps
+
+
+Operand = Union[Register, Imm, Addr, Indirect, Expr]
+
+TOKEN = re.compile(r"\s*(0[xX][0-9a-fA-F]+|\d+|[A-Za-z_.$][\w.$]*|[-+*()])")
+
+
+def tokens(text: str) -> list[str]:
+    out, pos = [], 0
+    text = text.rstrip()
+    while pos < len(text):
+        m = TOKEN.match(text, pos)
+        if m is None:
+            raise EncodeError(f"expresión no válida '{text}'")
+        out.append(m.group(1))
+        pos = m.end()
+    return out
+
+
+def parse_expr(text: str) -> Expr:
+    # number, symbol, symbol+number, products and sums of numbers, and the
+    # difference of two symbols
+    modifier, base = None, None
+    if "@" in text:
+        text, modifier = text.split("@", 1)
+    toks = tokens(text)
+    pos = 0
+
+    def peek():
+        return pos < len(toks) and toks[pos] or None
+
+    def factor() -> tuple[int, Union[str, None]]:
+        nonlocal pos
+        tok = peek()
+        pos += 1
+        if tok == "-":
+            value, sym = factor()
+            if sym is not None:
+                raise EncodeError(f"no se puede negar el símbolo en '{text}'")
+            return -value, None
+        if tok == "(":
+            value = expr()
+            if peek() != ")":
+                raise EncodeError(f"falta ')' en '{text}'")
+            pos += 1
+            return value
+        if tok is None or tok in "+*)":
+            raise EncodeError(f"expresión no válida '{text}'")
+        if tok[0].isdigit():
+            return int(tok, 0), None
+        return 0, tok
+
+    def term() -> tuple[int, Union[str, None]]:
+        nonlocal pos
+        value, sym = factor()
+        while peek() == "*":
+            pos += 1
+            other, sym2 = factor()
+            if sym is not None or sym2 is not None:
+                raise EncodeError(f"no se puede multiplicar un símbolo en '{text}'")
+            value *= other
+        return value, sym
+
+    def expr() -> tuple[int, Union[str, None]]:
+        nonlocal pos, base
+        value, sym = term()
+        while peek() in ("+", "-"):
+            op = toks[pos]
+            pos += 1
+            other, sym2 = term()
+            if sym2 is not None and op == "-" and sym is not None and base is None:
+                base, sym2 = sym2, None
+            if sym2 is not None and (op == "-" or sym is not None):
+                raise EncodeError(f"expresión con símbolos no admitida '{text}'")
+            value, sym = value + (op == "+" and other or -other), sym or sym2
+        return value, sym
+
+    value, sym = expr()
+    if pos != len(toks):
+        raise EncodeError(f"expresión no válida '{text}'")
+    return Expr(value, sym, modifier, base)
+
+
+def parse_register(text: str) -> Register:
+    name = text.strip()[1:]
+    if name not in REGS:
+        raise EncodeError(f"registro desconocido '{text.strip()}'")
+    return Register(name, *REGS[name])
+
+
+def parse_operand(text: str) -> Operand:
+    text = text.strip()
+    if text.startswith("*"):
+        return Indirect(parse_operand(text[1:]))
+    if text.startswith("%"):
+        return parse_register(text)
+    if text.startswith("$"):
+        return Imm(parse_expr(text[1:]))
+    if text.endswith(")"):
+        open_at = text.rfind("(")
+        disp = text[:open_at].strip()
+        parts = [p.strip() for p in text[open_at + 1 : -1].split(",")]
+        addr = Addr(disp=disp and parse_expr(disp) or Expr())
+        if parts[0] == "%rip":
+            addr.rip = True
+        elif parts[0]:
+            addr.base = parse_register(parts[0])
+        if len(parts) > 1 and parts[1]:
+            addr.index = parse_register(parts[1])
+        if len(parts) > 2:
+            addr.scale = int(parts[2], 0)
+        return addr
+    return parse_expr(text)  # an absolute address, or a branch target
+
+
+def split_operands(text: str) -> list[str]:
+    ops, depth, cur = [], 0, ""
+    for c in text:
+        depth += (c == "(") - (c == ")")
+        if c == "," and depth == 0:
+            ops.append(cur)
+            cur = ""
+        else:
+            cur += c
+    if cur.strip():
+        ops.append(cur)
+    return ops
+
+
+# --- Encoding --- #
+
+
+@dataclass
+class Fixup:
+    offset: int  # of the field within the instruction
+    size: int
+    expr: Expr
+    kind: str  # abs, abs32s (sign-extended), pc, branch, gotpcrel
+    addend: int = 0  # for pc: from the end of the field to the end of the insn
+
+
+@dataclass
+class Encoded:
+    data: bytes
+    fixups: list[Fixup] = field(default_factory=list)
+
+
+def fits8(value: int) -> bool:
+    return -128 <= value <= 127
+
+
+def signed(value: int, size: int) -> int:
+    # immediates are taken modulo the operand size, as `as` does
+    if size < 8 and 0 <= value < 1 << (8 * size):
+        return value - (value >> (8 * size - 1) << (8 * size))
+    return value
+
+
+def pack(value: int, size: int) -> bytes:
+    if size == 0:
+        return b""
+    fmt = {1: "<B", 2: "<H", 4: "<I", 8: "<Q"}[size]
+    return struct.pack(fmt, value & ((1 << (8 * size)) - 1))
+
+
+class Encoder:
+    def __init__(self, mode64: bool):
+        self.mode64 = mode64
+
+    # fields shared by every form with a ModR/M byte
+    def modrm(
+        self,
+        opcode: bytes,
+        reg: int,
+        rm: Union[Register, Addr],
+        size: int = 4,
+        imm: Union[Expr, None] = None,
+        imm_size: int = 0,
+        regs: tuple[Register, ...] = (),
+        wide: bool = None,
+    ) -> Encoded:
+        wide = size == 8 if wide is None else wide
+        rex = 0x48 if wide else 0
+        rex |= reg > 7 and 0x44 or 0
+        body, fixups = b"", []
+        if isinstance(rm, Register):
+            rex |= rm.num > 7 and 0x41 or 0
+            body = bytes([0xC0 | (reg & 7) << 3 | rm.num & 7])
+            regs = (*regs, rm)
+        else:
+            body, fixups, rex_xb = self.address(rm, reg)
+            rex |= rex_xb
+            regs = (*regs, *(r for r in (rm.base, rm.index) if r is not None))
+        if any(r.name in REX_BYTES for r in regs):
+            rex |= 0x40
+        if rex and any(r.name in HIGH_BYTES for r in regs):
+            raise EncodeError("%ah, %bh, %ch y %dh no admiten un prefijo REX")
+        if rex and not self.mode64:
+            raise EncodeError("registro de 64 bits en código de 32 bits")
+
+        prefix = (size == 2 and b"\x66" or b"") + (rex and bytes([rex]) or b"")
+        head = prefix + opcode
+        for f in fixups:
+            f.offset += len(head)
+        data = head + body
+        if imm is not None:
+            if imm.sym is not None:
+                kind = self.mode64 and size == 8 and "abs32s" or "abs"
+                fixups.append(Fixup(len(data), imm_size, imm, kind))
+            data += pack(imm.sym is None and imm.value or 0, imm_size)
+        for f in fixups:
+            if f.kind in ("pc", "gotpcrel"):
+                f.addend = len(data) - f.offset - f.size
+        return Encoded(data, fixups)
+
+    def address(self, a: Addr, reg: int) -> tuple[bytes, list[Fixup], int]:
+        disp, rex, fixups = a.disp, 0, []
+        reg = (reg & 7) << 3
+
+        def disp32(kind: str) -> bytes:
+            if disp.sym is not None or disp.modifier is not None:
+                fixups.append(Fixup(0, 4, disp, kind))
+                return pack(disp.sym is None and disp.value or 0, 4)
+            return pack(disp.value, 4)
+
+        if a.rip:
+            kind = disp.modifier == "GOTPCREL" and "gotpcrel" or "pc"
+            head = bytes([reg | 5])
+            data = disp32(kind)
+            for f in fixups:
+                f.offset = len(head)
+            return head + data, fixups, 0
+
+        symbolic = disp.sym is not None
+        if a.base is None and a.index is None:
+            if self.mode64:
+                head = bytes([reg | 4, 0x25])
+                data = disp32("abs32s")
+            else:
+                head = bytes([reg | 5])
+                data = disp32("abs")
+            for f in fixups:
+                f.offset = len(head)
+            return head + data, fixups, 0
+
+        base = a.base
+        if base is not None:
+            rex |= base.num > 7 and 0x41 or 0
+        if a.index is not None:
+            rex |= a.index.num > 7 and 0x42 or 0
+
+        if base is None:
+            mod, disp_size = 0, 4
+        elif symbolic or not fits8(disp.value):
+            mod, disp_size = 2, 4
+        elif disp.value != 0 or base.num & 7 == 5:
+            mod, disp_size = 1, 1
+        else:
+            mod, disp_size = 0, 0
+
+        if a.index is not None or base is None or base.num & 7 == 4:
+            scale = {1: 0, 2: 1, 4: 2, 8: 3}[a.scale]
+            index = 4 if a.index is None else a.index.num & 7
+            head = bytes(
+                [
+                    mod << 6 | reg | 4,
+                    scale << 6 | index << 3 | (5 if base is None else base.num & 7),
+                ]
+            )
+        else:
+            head = bytes([mod << 6 | reg | base.num & 7])
+
+        if disp_size == 4:
+            data = disp32(self.mode64 and "abs32s" or "abs")
+        else:
+            data = pack(disp.value, disp_size)
+        for f in fixups:
+            f.offset = len(head)
+        return head + data, fixups, rex
+
+    # --- Instructions --- #
+
+    def encode(self, mnemonic: str, ops: list[Operand]) -> Encoded:
+        if mnemonic in PLAIN and not ops:
+            return Encoded(PLAIN[mnemonic])
+        if mnemonic == "ret" and len(ops) == 1:
+            return Encoded(b"\xc2" + pack(self.imm(ops[0]).value, 2))
+        if mnemonic == "int":
+            n = self.imm(ops[0]).value
+            return Encoded(n == 3 and b"\xcc" or b"\xcd" + pack(n, 1))
+        if mnemonic in ("movabs", "movabsq"):
+            src, dst = self.two(ops)
+            e = self.imm(src)
+            rex = 0x48 | (dst.num > 7 and 0x41 or 0)
+            fixups = e.sym is not None and [Fixup(2, 8, e, "abs")] or []
+            data = bytes([rex, 0xB8 | dst.num & 7])
+            return Encoded(data + pack(e.sym is None and e.value or 0, 8), fixups)
+        if mnemonic == "call":
+            return self.call(ops)
+        if mnemonic == "jmp" and ops and isinstance(ops[0], Indirect):
+            return self.modrm(b"\xff", 4, ops[0].op, wide=False)
+
+        for prefix, opcode in EXTENDS.items():
+            rest = mnemonic[len(prefix) :]
+            if mnemonic.startswith(prefix) and len(rest) == 1 and rest in "wlq":
+                src, dst = self.two(ops)
+                size = SUFFIXES[rest]
+                return self.modrm(opcode, dst.num, self.memory(src), size, regs=(dst,))
+        if mnemonic in ("movslq", "movsxd"):
+            src, dst = self.two(ops)
+            return self.modrm(b"\x63", dst.num, self.memory(src), 8, regs=(dst,))
+        for prefix in ("cmov", "set"):
+            if mnemonic.startswith(prefix):
+                cc = self.condition(mnemonic[len(prefix) :])
+                if cc is not None:
+                    return getattr(self, prefix)(cc, ops)
+
+        base, size = self.split(mnemonic, ops)
+        for op in ops:
+            counter = base in SHIFTS and isinstance(op, Register) and op.name == "cl"
+            if isinstance(op, Register) and op.size != size and not counter:
+                raise EncodeError(f"registro %{op.name} con sufijo de otro tamaño")
+        if base in ALU:
+            return self.alu(ALU[base], ops, size)
+        if base in UNARY and (base != "imul" or len(ops) == 1):
+            (dst,) = ops
+            dst = self.memory(dst)
+            return self.modrm(size == 1 and b"\xf6" or b"\xf7", UNARY[base], dst, size)
+        if base in SHIFTS:
+            return self.shift(SHIFTS[base], ops, size)
+        if base in ("inc", "dec"):
+            return self.incdec(base == "dec", ops, size)
+        handler = getattr(self, "op_" + base, None)
+        if handler is None:
+            raise EncodeError(f"instrucción desconocida '{mnemonic}'")
+        return handler(ops, size)
+
+    def condition(self, name: str) -> Union[int, None]:
+        if name in CONDITIONS:
+            return CONDITIONS[name]
+        if name[-1:] in SUFFIXES and name[:-1] in CONDITIONS:
+            return CONDITIONS[name[:-1]]
+        return None
+
+    def split(self, mnemonic: str, ops: list[Operand]) -> tuple[str, int]:
+        # the operation and its operand size, from the suffix or the registers
+        base = mnemonic[:-1]
+        known = (*ALU, *UNARY, *SHIFTS, "inc", "dec", "mov", "lea", "test", "push", "pop", "bsr", "bsf", "xchg")  # fmt: skip
+        if mnemonic[-1] in SUFFIXES and base in known:
+            return base, SUFFIXES[mnemonic[-1]]
+        regs = [op.size for op in ops if isinstance(op, Register)]
+        if mnemonic in ("push", "pop"):
+            return mnemonic, self.mode64 and 8 or 4
+        if not regs:
+            raise EncodeError(f"falta el tamaño de operando en '{mnemonic}'")
+        return mnemonic, regs[-1]
+
+    def two(self, ops: list[Operand]) -> tuple[Operand, Operand]:
+        if len(ops) != 2:
+            raise EncodeError(f"se esperaban dos operandos, no {len(ops)}")
+        return ops[0], ops[1]
+
+    def imm(self, op: Operand) -> Expr:
+        if not isinstance(op, Imm):
+            raise EncodeError("se esperaba un inmediato")
+        return op.expr
+
+    def memory(self, op: Operand) -> Union[Register, Addr]:
+        if isinstance(op, Expr):
+            return Addr(disp=op)  # a bare symbol is its address
+        if not isinstance(op, (Register, Addr)):
+            raise EncodeError("se esperaba un registro o una dirección")
+        return op
+
+    def alu(self, n: int, ops: list[Operand], size: int) -> Encoded:
+        src, dst = self.two(ops)
+        dst = self.memory(dst)
+        byte = size == 1
+        if isinstance(src, Imm):
+            e = src.expr
+            e = Expr(signed(e.value, size), e.sym, e.modifier)
+            if byte:
+                if isinstance(dst, Register) and dst.num == 0:
+                    return self.accumulator(bytes([n << 3 | 4]), e, 1)
+                return self.modrm(b"\x80", n, dst, 1, e, 1)
+            if e.sym is None and fits8(e.value):
+                return self.modrm(b"\x83", n, dst, size, e, 1)
+            if isinstance(dst, Register) and dst.num == 0:
+                return self.accumulator(bytes([n << 3 | 5]), e, size)
+            return self.modrm(b"\x81", n, dst, size, e, min(size, 4))
+        src = self.memory(src)
+        if isinstance(src, Register):
+            return self.modrm(
+                bytes([n << 3 | (not byte)]), src.num, dst, size, regs=(src,)
+            )
+        return self.modrm(
+            bytes([n << 3 | 2 | (not byte)]), dst.num, src, size, regs=(dst,)
+        )
+
+    def accumulator(self, opcode: bytes, e: Expr, size: int) -> Encoded:
+        prefix = (size == 2 and b"\x66" or b"") + (size == 8 and b"\x48" or b"")
+        data = prefix + opcode
+        fixups = []
+        if e.sym is not None:
+            kind = self.mode64 and size == 8 and "abs32s" or "abs"
+            fixups.append(Fixup(len(data), min(size, 4), e, kind))
+        return Encoded(
+            data + pack(e.sym is None and e.value or 0, min(size, 4)), fixups
+        )
+
+    def op_mov(self, ops: list[Operand], size: int) -> Encoded:
+        src, dst = self.two(ops)
+        byte = size == 1
+        if isinstance(src, Imm):
+            e = src.expr
+            if isinstance(dst, Register):
+                if size == 8 and (e.sym is not None or -(1 << 31) <= e.value < 1 << 31):
+                    return self.modrm(b"\xc7", 0, dst, 8, e, 4)
+                rex = (size == 8 and 0x48 or 0) | (dst.num > 7 and 0x41 or 0)
+                if dst.name in REX_BYTES:
+                    rex |= 0x40
+                opcode = bytes([(byte and 0xB0 or 0xB8) | dst.num & 7])
+                prefix = (size == 2 and b"\x66" or b"") + (rex and bytes([rex]) or b"")
+                data = prefix + opcode
+                fixups = []
+                if e.sym is not None:
+                    fixups.append(Fixup(len(data), size, e, "abs"))
+                return Encoded(
+                    data + pack(e.sym is None and e.value or 0, size), fixups
+                )
+            dst = self.memory(dst)
+            return self.modrm(
+                byte and b"\xc6" or b"\xc7", 0, dst, size, e, min(size, 4)
+            )
+
+        src, dst = self.memory(src), self.memory(dst)
+        if isinstance(src, Register):
+            if self.moffs(dst, src):
+                return self.absolute(byte and b"\xa2" or b"\xa3", dst, size)
+            return self.modrm(
+                byte and b"\x88" or b"\x89", src.num, dst, size, regs=(src,)
+            )
+        if self.moffs(src, dst):
+            return self.absolute(byte and b"\xa0" or b"\xa1", src, size)
+        return self.modrm(byte and b"\x8a" or b"\x8b", dst.num, src, size, regs=(dst,))
+
+    def moffs(self, addr: Operand, reg: Register) -> bool:
+        # the short forms with the accumulator and an absolute address
+        return (
+            not self.mode64
+            and isinstance(addr, Addr)
+            and not addr.rip
+            and addr.base is None
+            and addr.index is None
+            and reg.num == 0
+        )
+
+    def absolute(self, opcode: bytes, addr: Addr, size: int) -> Encoded:
+        data = (size == 2 and b"\x66" or b"") + opcode
+        e = addr.disp
+        fixups = e.sym is not None and [Fixup(len(data), 4, e, "abs")] or []
+        return Encoded(data + pack(e.sym is None and e.value or 0, 4), fixups)
+
+    def op_lea(self, ops: list[Operand], size: int) -> Encoded:
+        src, dst = self.two(ops)
+        return self.modrm(b"\x8d", dst.num, self.memory(src), size, regs=(dst,))
+
+    def op_test(self, ops: list[Operand], size: int) -> Encoded:
+        src, dst = self.two(ops)
+        byte = size == 1
+        if isinstance(src, Imm):
+            if isinstance(dst, Register) and dst.num == 0:
+                return self.accumulator(byte and b"\xa8" or b"\xa9", src.expr, size)
+            return self.modrm(
+                byte and b"\xf6" or b"\xf7", 0, dst, size, src.expr, min(size, 4)
+            )
+        if isinstance(dst, Register) and isinstance(src, Addr):
+            src, dst = dst, src
+        return self.modrm(
+            byte and b"\x84" or b"\x85", src.num, self.memory(dst), size, regs=(src,)
+        )
+
+    def op_push(self, ops: list[Operand], size: int) -> Encoded:
+        (op,) = ops
+        if isinstance(op, Imm):
+            e = op.expr
+            if e.sym is None and fits8(signed(e.value, size)):
+                return Encoded(b"\x6a" + pack(e.value, 1))
+            fixups = (
+                e.sym is not None
+                and [Fixup(1, 4, e, self.mode64 and "abs32s" or "abs")]
+                or []
+            )
+            return Encoded(b"\x68" + pack(e.sym is None and e.value or 0, 4), fixups)
+        if isinstance(op, Register):
+            return Encoded((op.num > 7 and b"\x41" or b"") + bytes([0x50 | op.num & 7]))
+        return self.modrm(b"\xff", 6, self.memory(op), wide=False)
+
+    def op_pop(self, ops: list[Operand], size: int) -> Encoded:
+        (op,) = ops
+        if isinstance(op, Register):
+            return Encoded((op.num > 7 and b"\x41" or b"") + bytes([0x58 | op.num & 7]))
+        return self.modrm(b"\x8f", 0, self.memory(op), wide=False)
+
+    def incdec(self, dec: bool, ops: list[Operand], size: int) -> Encoded:
+        (dst,) = ops
+        dst = self.memory(dst)
+        if not self.mode64 and isinstance(dst, Register) and size in (2, 4):
+            prefix = size == 2 and b"\x66" or b""
+            return Encoded(prefix + bytes([(dec and 0x48 or 0x40) | dst.num]))
+        return self.modrm(size == 1 and b"\xfe" or b"\xff", dec, dst, size)
+
+    def op_imul(self, ops: list[Operand], size: int) -> Encoded:
+        if len(ops) == 2:
+            src, dst = ops
+            return self.modrm(b"\x0f\xaf", dst.num, self.memory(src), size, regs=(dst,))
+        imm, src, dst = ops
+        e = self.imm(imm)
+        if e.sym is None and fits8(signed(e.value, size)):
+            return self.modrm(
+                b"\x6b", dst.num, self.memory(src), size, e, 1, regs=(dst,)
+            )
+        return self.modrm(
+            b"\x69", dst.num, self.memory(src), size, e, min(size, 4), regs=(dst,)
+        )
+
+    def shift(self, n: int, ops: list[Operand], size: int) -> Encoded:
+        byte = size == 1
+        if len(ops) == 1:
+            return self.modrm(byte and b"\xd0" or b"\xd1", n, self.memory(ops[0]), size)
+        count, dst = self.two(ops)
+        dst = self.memory(dst)
+        if isinstance(count, Register):
+            if count.name != "cl":
+                raise EncodeError("el desplazamiento variable tiene que estar en %cl")
+            return self.modrm(byte and b"\xd2" or b"\xd3", n, dst, size)
+        e = self.imm(count)
+        if e.sym is None and e.value == 1:
+            return self.modrm(byte and b"\xd0" or b"\xd1", n, dst, size)
+        return self.modrm(byte and b"\xc0" or b"\xc1", n, dst, size, e, 1)
+
+    def op_bsr(self, ops: list[Operand], size: int) -> Encoded:
+        src, dst = self.two(ops)
+        return self.modrm(b"\x0f\xbd", dst.num, self.memory(src), size, regs=(dst,))
+
+    def op_bsf(self, ops: list[Operand], size: int) -> Encoded:
+        src, dst = self.two(ops)
+        return self.modrm(b"\x0f\xbc", dst.num, self.memory(src), size, regs=(dst,))
+
+    def op_xchg(self, ops: list[Operand], size: int) -> Encoded:
+        src, dst = self.two(ops)
+        regs = [op for op in ops if isinstance(op, Register)]
+        if len(regs) == 2 and size > 1 and 0 in (src.num, dst.num):
+            other = src.num or dst.num
+            rex = (size == 8 and 0x48 or 0) | (other > 7 and 0x41 or 0)
+            prefix = (size == 2 and b"\x66" or b"") + (rex and bytes([rex]) or b"")
+            return Encoded(prefix + bytes([0x90 | other & 7]))
+        if isinstance(src, Addr):
+            src, dst = dst, src
+        return self.modrm(
+            size == 1 and b"\x86" or b"\x87",
+            src.num,
+            self.memory(dst),
+            size,
+            regs=(src,),
+        )
+
+    def cmov(self, cc: int, ops: list[Operand]) -> Encoded:
+        src, dst = self.two(ops)
+        return self.modrm(
+            bytes([0x0F, 0x40 | cc]), dst.num, self.memory(src), dst.size, regs=(dst,)
+        )
+
+    def set(self, cc: int, ops: list[Operand]) -> Encoded:
+        (dst,) = ops
+        return self.modrm(bytes([0x0F, 0x90 | cc]), 0, self.memory(dst), 1)
+
+    def call(self, ops: list[Operand]) -> Encoded:
+        (op,) = ops
+        if isinstance(op, Indirect):
+            return self.modrm(b"\xff", 2, op.op, wide=False)
+        if not isinstance(op, Expr):
+            raise EncodeError("destino de llamada no válido")
+        return Encoded(b"\xe8" + pack(0, 4), [Fixup(1, 4, op, "branch")])
+
+
+def split_instruction(text: str) -> tuple[str, list[str]]:
+    mnemonic, _, rest = text.strip().partition(" ")
+    return mnemonic, split_operands(rest)
+
+
+def encode(text: str, mode64: bool) -> Encoded:
+    # one instruction, with its operands in AT&T syntax
+    mnemonic, ops = split_instruction(text)
+    prefix = b""
+    if mnemonic in PREFIXES:
+        prefix = PREFIXES[mnemonic]
+        mnemonic, ops = split_instruction(" ".join(ops))
+    e = Encoder(mode64).encode(mnemonic, [parse_operand(op) for op in ops])
+    for f in e.fixups:
+        f.offset += len(prefix)
+    return Encoded(prefix + e.data, e.fixups)
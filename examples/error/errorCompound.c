@@ -0,0 +1,7 @@
+int main() {
+  int x = 3;
+  int *p = &x;
+  p += 1;
+  p *= 2;
+  return x;
+}
@@ -0,0 +1,8 @@
+int main() {
+  int x = 3;
+  unsigned char c = x;
+  short s = c;
+  char *p = &c;
+  unsigned *q = &x;
+  return s;
+}
@@ -0,0 +1,20 @@
+int main() {
+  int x = 3;
+  int y = 1;
+  switch (x) {
+    case 1: y = 2;
+    case 1 + 1: break;
+    case 2: y = 3;
+    case y: y = 4;
+    default: y = 5;
+    default: y = 6;
+  }
+  switch (&x) {
+  }
+  switch (x) {
+    case -1: break;
+    case 4294967295: break;
+  }
+  break;
+  return y;
+}
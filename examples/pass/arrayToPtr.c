@@ -0,0 +1,19 @@
+int sum(int *p, int n) {
+  int s = 0;
+  for (int i = 0; i < n; i = i + 1) {
+    s = s + p[i];
+  }
+  return s;
+}
+
+int main() {
+  int b[5];
+  int *p;
+  for (int i = 0; i < 5; i = i + 1) {
+    b[i] = i * i;
+  }
+  p = b;
+  p[0] = 9;
+  printf("%i %i %i\n", b[0], p[2], sum(p, 5));
+  return 0;
+}
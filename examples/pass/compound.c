@@ -0,0 +1,100 @@
+int counter;
+int calls;
+
+int next(int x) {
+  calls++;
+  return x;
+}
+
+int sum(int *p, int n) {
+  int s = 0;
+  for (int i = 0; i < n; i++) {
+    s += *p++;
+  }
+  return s;
+}
+
+int main() {
+  int x = 10;
+  x += 5;
+  x -= 3;
+  x *= 4;
+  x /= 6;
+  x %= 5;
+  printf("%i\n", x);
+
+  x = 6;
+  x <<= 3;
+  x >>= 1;
+  x &= 29;
+  x |= 64;
+  x ^= 5;
+  printf("%i\n", x);
+
+  int y = 7;
+  int z = y++;
+  printf("%i %i\n", z, y);
+  z = ++y;
+  printf("%i %i\n", z, y);
+  z = y--;
+  z = z * 100 + --y;
+  printf("%i %i\n", z, y);
+  printf("%i\n", (y += 10) * 2);
+
+  counter++;
+  counter += 41;
+  --counter;
+  printf("%i\n", counter);
+
+  int a[5];
+  for (int i = 0; i < 5; i++) {
+    a[i] = i;
+  }
+  int k = 0;
+  a[k++] += 2;
+  a[k++] += 2;
+  a[next(4)] *= 10;
+  a[next(3)]++;
+  printf("%i %i %i %i %i %i %i\n", a[0], a[1], a[2], a[3], a[4], k, calls);
+  printf("%i\n", sum(&a[0], 5));
+
+  int b[10];
+  for (int i = 0; i < 10; i = i + 1) {
+    b[i] = i;
+  }
+  int two = 2;
+  int three = 3;
+  b[two] += b[two];
+  b[three * 3] += three * 3;
+  printf("%i %i\n", b[2], b[9]);
+
+  int *p = &a[0];
+  p += 2;
+  *p -= 7;
+  (*p)--;
+  p++;
+  printf("%i %i\n", a[2], *p);
+
+  char c = 127;
+  c++;
+  unsigned char uc = 250;
+  uc += 10;
+  short s = 32767;
+  s += 2;
+  unsigned u = 1;
+  u -= 2;
+  u >>= 28;
+  printf("%i %i %i %i\n", c, uc, s, u);
+  printf("%i\n", uc++ + ++c);
+
+  int n = 0;
+  for (int i = 10; i > 0; i--) {
+    n += i;
+  }
+  int m = 0;
+  while (m < 100) {
+    m += 7;
+  }
+  printf("%i %i\n", n, m);
+  return 0;
+}
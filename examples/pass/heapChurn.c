@@ -0,0 +1,25 @@
+int main() {
+  int total = 0;
+  int *keep = (int *) malloc(4);
+  int n = 1;
+  for (int r = 0; r < 2000; r = r + 1) {
+    int *p = (int *) malloc(4 * (r % 97 + 1));
+    for (int i = 0; i < r % 97 + 1; i = i + 1) {
+      p[i] = i + r;
+    }
+    n = n + 1;
+    keep = (int *) realloc((void *) keep, 4 * n);
+    keep[n - 1] = r;
+    total = total + p[r % 97] % 7 + keep[n / 2] % 5;
+    free((void *) p);
+  }
+  printf("%i %i\n", total, keep[1999]);
+  free((void *) keep);
+  int *big = (int *) malloc(1 << 21);
+  big[0] = 1;
+  free((void *) big);
+  big = (int *) malloc(1 << 21);
+  big[1] = 2;
+  printf("%i\n", big[1]);
+  return 0;
+}
@@ -0,0 +1,40 @@
+int trace(int *m, int n) {
+  int t = 0;
+  for (int i = 0; i < n; i = i + 1) {
+    t = t + m[i * n + i];
+  }
+  return t;
+}
+
+int main() {
+  int m[3][4];
+  for (int i = 0; i < 3; i = i + 1) {
+    for (int j = 0; j < 4; j = j + 1) {
+      m[i][j] = i * 10 + j;
+    }
+  }
+  m[1][2] = 5;
+  m[2][1] += 100;
+  printf("%i %i %i\n", m[1][2], m[2][1], m[2][3]);
+  printf("%i %i\n", sizeof(m), sizeof(m[1]));
+
+  int sq[3][3];
+  for (int i = 0; i < 3; i = i + 1) {
+    for (int j = 0; j < 3; j = j + 1) {
+      sq[i][j] = i == j;
+    }
+  }
+  sq[2][2] = 7;
+  printf("%i\n", trace(&sq[0][0], 3));
+
+  // the pointer keeps the matrix alive after its last use by name
+  int cell[2][3];
+  cell[1][2] = 42;
+  int *p = &cell[1][2];
+  int k = 7;
+  for (int i = 0; i < 3; i = i + 1) {
+    k = k + i;
+  }
+  printf("%i %i\n", *p, k);
+  return 0;
+}
@@ -0,0 +1,92 @@
+char gc;
+short gs;
+unsigned char guc;
+unsigned short gus;
+
+char low(int x) {
+  return x;
+}
+
+unsigned char ulow(int x) {
+  return x;
+}
+
+int sum_bytes(char *p, int n) {
+  int s = 0;
+  for (int i = 0; i < n; i = i + 1) {
+    s = s + p[i];
+  }
+  return s;
+}
+
+unsigned hash(unsigned char *p, int n) {
+  unsigned h = 2166136261;
+  for (int i = 0; i < n; i = i + 1) {
+    h = (h ^ p[i]) * 16777619;
+  }
+  return h;
+}
+
+int mix(char a, short b, unsigned char c, int d) {
+  return a + b + c + d;
+}
+
+int main() {
+  char c = 300;
+  unsigned char uc = 300;
+  short s = 70000;
+  unsigned short us = -1;
+  printf("%i %i %i %i\n", c, uc, s, us);
+  printf("%i %i\n", low(200), ulow(200));
+
+  char buf[6];
+  short halves[4];
+  int after = 12345;
+  for (int i = 0; i < 6; i = i + 1) {
+    buf[i] = 120 + i;
+  }
+  for (int i = 0; i < 4; i = i + 1) {
+    halves[i] = 30000 * i;
+  }
+  printf("%i %i\n", sum_bytes(&buf[0], 6), after);
+  printf("%i %i %i\n", halves[1], halves[2], halves[3]);
+  printf("%i %i %i\n", sizeof(buf), sizeof(halves), sizeof(unsigned short));
+
+  char *p = &buf[0];
+  short *q = &halves[0];
+  p = p + 2;
+  q = q + 2;
+  printf("%i %i\n", *p, *q == halves[2]);
+
+  unsigned u = -7;
+  unsigned two = 2;
+  int i = -7;
+  printf("%i %i\n", u / two, i / 2);
+  printf("%i %i\n", u % 10, i % 10);
+  printf("%i %i\n", u >> 28, i >> 28);
+  printf("%i %i\n", u > two, i > 2);
+  printf("%i\n", (1 << 31) < 0);
+
+  printf("%i %i\n", (char) 255, (unsigned char) -1);
+  printf("%i %i\n", (short) 65535, (unsigned short) 65535);
+  printf("%i\n", mix(-1, -2, 255, 4));
+  printf("%i\n", (c = 511) + 1);
+
+  unsigned char text[5];
+  text[0] = 104;
+  text[1] = 111;
+  text[2] = 108;
+  text[3] = 97;
+  text[4] = 0;
+  printf("%i\n", hash(&text[0], 4) % 1000);
+
+  gc = 200;
+  gs = -300;
+  guc = 300;
+  gus = 70000;
+  printf("%i %i %i %i\n", gc, gs, guc, gus);
+  guc += 250;
+  gs -= 40000;
+  printf("%i %i %i\n", guc, gs, gc + gus);
+  return 0;
+}
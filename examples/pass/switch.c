@@ -0,0 +1,117 @@
+int days(int month) {
+  int n = 0;
+  switch (month) {
+    case 2:
+      n = 28;
+      break;
+    case 4:
+    case 6:
+    case 9:
+    case 11:
+      n = 30;
+      break;
+    default:
+      n = -1;
+      break;
+    case 1: case 3: case 5: case 7: case 8: case 10: case 12:
+      n = 31;
+  }
+  return n;
+}
+
+int sparse(int x) {
+  switch (x) {
+    case -1000: return 1;
+    case -3: return 2;
+    case 0: return 3;
+    case 77: return 4;
+    case 4096: return 5;
+    case 100000: return 6;
+  }
+  return 0;
+}
+
+int falls(int x) {
+  int r = 0;
+  switch (x * 2) {
+    case 2: r = r + 1;
+    case 4: r = r + 10;
+    case 6: r = r + 100;
+  }
+  return r;
+}
+
+int opcode(int op, int a, int b) {
+  if (op == 0) {
+    return a + b;
+  } else if (op == 1) {
+    return a - b;
+  } else if (op == 2 || op == 3) {
+    return a * b;
+  } else if (op == 5) {
+    return a / b;
+  } else {
+    return -1;
+  }
+}
+
+int large(unsigned u) {
+  switch (u) {
+    case 3000000000: return 1;
+    case 5: return 2;
+    case 4294967295: return 3;
+    case 7: return 4;
+  }
+  return 0;
+}
+
+int large_chain(unsigned u) {
+  int r;
+  if (u == 3000000000) {
+    r = 1;
+  } else if (u == 5) {
+    r = 2;
+  } else if (u == 6) {
+    r = 3;
+  } else if (u == 7) {
+    r = 4;
+  } else {
+    r = 0;
+  }
+  return r;
+}
+
+int main() {
+  int i;
+  int total = 0;
+  for (i = 0; i < 14; i = i + 1) {
+    printf("%i\n", days(i));
+  }
+  printf("%i %i %i %i %i %i %i\n", sparse(-1000), sparse(-3), sparse(0), sparse(77), sparse(4096), sparse(100000), sparse(5));
+  printf("%i %i %i %i\n", falls(1), falls(2), falls(3), falls(4));
+  printf("%i %i %i %i\n", large(3000000000), large(-1), large(7), large(6));
+  printf("%i %i %i\n", large_chain(3000000000), large_chain(6), large_chain(8));
+  for (i = 0; i < 7; i = i + 1) {
+    printf("%i\n", opcode(i, 12, 4));
+  }
+
+  // break leaves the switch, continue and the chain's break the loop
+  for (i = 0; i < 100; i = i + 1) {
+    switch (i % 4) {
+      case 0: continue;
+      case 1: total = total + i; break;
+      default: total = total + 1000;
+    }
+    if (i == 61) {
+      break;
+    } else if (i == 30) {
+      total = 0;
+    } else if (i == 40) {
+      total = 0;
+    } else if (i == 50) {
+      total = 0;
+    }
+  }
+  printf("%i %i\n", i, total);
+  return 0;
+}
@@ -0,0 +1,208 @@
+from astnodes import *
+from typenodes import *
+from commonitems import *
+from runtime import RUNTIME_FUNS
+from compiler import argument_order, register_args
+from target import Target
+from typing import Union
+
+# printf/scanf specialization.
+#
+# The format of every printf and scanf call is a literal, so it can be
+# interpreted at compile time: a printf statement becomes a write of each
+# literal segment and a decimal write of each `%i` argument, and a scanf
+# statement a read for each `%i` and a skip for each run of whitespace.
+# Only statements are rewritten (the result of the call is not used).
+#
+# printf evaluates all its arguments before printing anything, so arguments
+# that could have an effect or trap are first evaluated into temporaries, in
+# the order the call would evaluate them on the target. A profile probe on
+# the call moves to the first routine called instead. Anything the routines do not cover
+# (other directives, `%%`, `\0`, literal characters in a scanf format) is
+# left to libc.
+
+ESCAPES = {
+    "n": 10,
+    "t": 9,
+    "r": 13,
+    "\\": 92,
+    '"': 34,
+    "'": 39,
+    "a": 7,
+    "b": 8,
+    "f": 12,
+    "v": 11,
+}
+
+
+def split_format(lit: str) -> Union[list[Union[str, None]], None]:
+    # literal segments (still escaped, as they appear in the source) and
+    # None for each %i; None if the format needs the real printf
+    parts, cur, i = [], "", 0
+    body = lit[1:-1]
+    while i < len(body):
+        c = body[i]
+        if c == "\\":
+            if i + 1 >= len(body) or body[i + 1] not in ESCAPES:
+                return None
+            cur += body[i : i + 2]
+            i += 2
+        elif c == "%":
+            if body[i + 1 : i + 2] != "i":
+                return None
+            if cur:
+                parts.append(cur)
+            parts.append(None)
+            cur = ""
+            i += 2
+        else:
+            cur += c
+            i += 1
+    if cur:
+        parts.append(cur)
+    return parts
+
+
+def unescape(seg: str) -> bytes:
+    out, i = bytearray(), 0
+    while i < len(seg):
+        if seg[i] == "\\":
+            out.append(ESCAPES[seg[i + 1]])
+            i += 2
+        else:
+            out += seg[i].encode()
+            i += 1
+    return bytes(out)
+
+
+def is_pure(exp: Ast) -> bool:
+    for node in walk(exp):
+        if isinstance(node, UnaryExp) and node.op == "*":
+            return False
+        if isinstance(node, BinaryExp) and node.op in {"/", "%"}:
+            return False
+        if not isinstance(
+            node, (NumExp, StrExp, VarExp, SizeofExp, CastExp, UnaryExp, BinaryExp)
+        ):
+            return False
+    return True
+
+
+def temporaries(
+    fun: FunDefTop, call: CallExp, target: Target
+) -> tuple[list[Ast], list[Ast]]:
+    # evaluates the arguments after the format up front, in the call's order
+    args = call.args[1:]
+    if all(is_pure(a) for a in args):
+        return [], args
+
+    stmts, temps = [], list(args)
+    regparm = register_args(call.callee.resolved_as, len(call.args), target)
+    for k in argument_order(call.args, regparm):
+        arg = call.args[k]
+        if k == 0 or isinstance(arg, NumExp):
+            continue
+        size, align = arg.rtype.sizeof(), arg.rtype.alignof()
+        fun.max_stack_size = align_up(fun.max_stack_size + size, align)
+        local = Local(typ=arg.rtype, addr=fun.max_stack_size)
+        var = VarExp(pos=arg.pos, lit="", resolved_as=local)
+        var.rtype = arg.rtype
+        assign = AssignExp(pos=arg.pos, var=var, exp=arg)
+        assign.rtype = arg.rtype
+        stmts.append(ExpStmt(pos=arg.pos, exp=assign))
+        temps[k - 1] = VarExp(pos=arg.pos, lit="", resolved_as=local)
+        temps[k - 1].rtype = arg.rtype
+    return stmts, temps
+
+
+def runtime_call(pos: int, name: str, args: list[Ast]) -> ExpStmt:
+    fun = RUNTIME_FUNS[name]
+    callee = VarExp(pos=pos, lit=name, resolved_as=fun)
+    call = CallExp(pos=pos, callee=callee, args=args)
+    call.rtype = fun.typ.ret
+    return ExpStmt(pos=pos, exp=call)
+
+
+def string(pos: int, seg: str) -> list[Ast]:
+    text = StrExp(pos=pos, lit=f'"{seg}"')
+    text.rtype = TypeChar.as_ptr()
+    size = NumExp(pos=pos, lit=len(unescape(seg)))
+    size.rtype = TypeInt
+    return [text, size]
+
+
+def lower_printf(
+    fun: FunDefTop, call: CallExp, target: Target
+) -> Union[list[Ast], None]:
+    parts = split_format(call.args[0].lit)
+    if parts is None:
+        return None
+
+    stmts, args = temporaries(fun, call, target)
+    rest = iter(args)
+    for part in parts:
+        if part is None:
+            stmts.append(runtime_call(call.pos, "__pycc_write_int", [next(rest)]))
+        else:
+            stmts.append(runtime_call(call.pos, "__pycc_write", string(call.pos, part)))
+    return stmts
+
+
+def lower_scanf(
+    fun: FunDefTop, call: CallExp, target: Target
+) -> Union[list[Ast], None]:
+    parts = split_format(call.args[0].lit)
+    if parts is None or any(p is not None and unescape(p).strip() for p in parts):
+        return None  # literal characters to match
+
+    stmts, args = temporaries(fun, call, target)
+    rest = iter(args)
+    for k, part in enumerate(parts):
+        if part is None:
+            stmts.append(runtime_call(call.pos, "__pycc_read_int", [next(rest)]))
+        elif k == len(parts) - 1:
+            # a %i skips leading whitespace itself, only a trailing run counts
+            stmts.append(runtime_call(call.pos, "__pycc_skip_space", []))
+    # a failed conversion leaves the offending character unread, so every
+    # later read fails on it as well, just like scanf stopping there
+    return stmts
+
+
+LOWERINGS = {"printf": lower_printf, "scanf": lower_scanf}
+
+
+def move_probe(sites: dict, call: CallExp, stmts: list[Ast]) -> bool:
+    # hands the call's profile site to the first routine called, in place so
+    # the counters keep their order
+    if id(call) not in sites:
+        return True
+    calls = [s.exp for s in stmts if isinstance(s.exp, CallExp)]
+    calls = [c for c in calls if c.callee.lit in RUNTIME_FUNS]
+    if not calls:
+        return False  # nothing left to count it on
+    items = list(sites.items())
+    sites.clear()
+    sites.update((id(calls[0]) if k == id(call) else k, v) for k, v in items)
+    return True
+
+
+def specialize_formats(prog: Program, target: Target, sites: dict) -> int:
+    changes, fun = 0, None
+
+    def visit(node: Ast) -> Ast:
+        nonlocal changes
+        call = isinstance(node, ExpStmt) and node.exp
+        if isinstance(call, CallExp) and call.callee.lit in LOWERINGS:
+            if isinstance(call.callee.resolved_as, Fun):
+                stmts = LOWERINGS[call.callee.lit](fun, call, target)
+                if stmts is not None and move_probe(sites, call, stmts):
+                    changes += 1
+                    return BlockStmt(pos=node.pos, stmts=stmts)
+        transform(node, visit)
+        return node
+
+    for top in prog.topdecls:
+        if isinstance(top, FunDefTop):
+            fun = top
+            top.body = [visit(stmt) for stmt in top.body]
+    return changes
@@ -0,0 +1,201 @@
+from astnodes import *
+from typenodes import *
+from commonitems import *
+from dataclasses import dataclass, field
+from typing import Union
+
+# Liveness-based stack frame layout.
+#
+# Every statement of a function body is numbered in program order, and each
+# local gets the interval [first statement, last statement] where it is
+# mentioned. Loops extend the interval of anything live on entry up to the
+# end of the loop, since its value is carried around the back edge. Locals
+# whose address escapes (`&x`, or an array used as a plain pointer) are pinned
+# for the whole function. Non-overlapping intervals then share frame slots.
+
+FOREVER = float("inf")
+
+
+def address_taken(body: list[Ast]) -> set[int]:
+    return {
+        id(node.exp.resolved_as)
+        for stmt in body
+        for node in walk(stmt)
+        if isinstance(node, UnaryExp)
+        and node.op == "&"
+        and isinstance(node.exp, VarExp)
+    }
+
+
+def address_path(exp: Ast):
+    # the derefs an address is computed through, `m[i]` and `m[i][j]` in
+    # `&m[i][j]`
+    while isinstance(exp, UnaryExp) and exp.op == "*":
+        yield exp
+        exp = exp.exp
+        if isinstance(exp, BinaryExp) and exp.op == "+":
+            exp = exp.exp1
+
+
+@dataclass
+class Interval:
+    local: Local
+    start: int
+    end: int
+
+    def overlaps(self, other: "Interval") -> bool:
+        return self.start <= other.end and other.start <= self.end
+
+
+@dataclass
+class Liveness:
+    point: int = 0
+    intervals: dict[int, Interval] = field(default_factory=dict)
+    loops: list[tuple[int, int]] = field(default_factory=list)
+    escaped: set[int] = field(default_factory=set)
+
+    def touch(self, local: Local):
+        if not isinstance(local, Local) or local.addr <= 0:
+            return  # statics, globals and caller-owned parameters
+
+        live = self.intervals.get(id(local), None)
+        if live is None:
+            self.intervals[id(local)] = Interval(local, self.point, self.point)
+        else:
+            live.end = self.point
+
+    def touch_all(self, ast: Ast):
+        self.point += 1
+        for node in walk(ast):
+            if isinstance(node, (VarExp, VarDecl)):
+                self.touch(node.resolved_as)
+
+    def stmt(self, ast: Ast):
+        if isinstance(ast, BlockStmt):
+            for stmt in ast.stmts:
+                self.stmt(stmt)
+
+        elif isinstance(ast, IfStmt):
+            self.touch_all(ast.cond)
+            self.stmt(ast.then)
+            if ast.else_ is not None:
+                self.stmt(ast.else_)
+
+        elif isinstance(ast, SwitchStmt):
+            # cases only run after the dispatch, in order when falling through
+            self.touch_all(ast.cond)
+            for case in ast.cases:
+                for stmt in case.stmts:
+                    self.stmt(stmt)
+
+        elif isinstance(ast, WhileStmt):
+            start = self.point + 1
+            self.touch_all(ast.cond)
+            self.stmt(ast.block)
+            if ast.step is not None:
+                self.touch_all(ast.step)
+            self.loops.append((start, self.point))
+
+        else:
+            self.touch_all(ast)
+
+    def find_escapes(self, body: list[Ast]):
+        self.escaped |= address_taken(body)
+
+        # `a[i]` only reads or writes the array, `&a[i]` and `&m[i][j]` let it
+        # escape
+        referenced = {
+            id(deref)
+            for stmt in body
+            for node in walk(stmt)
+            if isinstance(node, UnaryExp) and node.op == "&"
+            for deref in address_path(node.exp)
+        }
+        indexed = set()
+        for stmt in body:
+            for node in walk(stmt):
+                if (
+                    isinstance(node, UnaryExp)
+                    and node.op == "*"
+                    and id(node) not in referenced
+                    and isinstance(node.exp, BinaryExp)
+                    and node.exp.op == "+"
+                    and isinstance(node.exp.exp1, VarExp)
+                ):
+                    indexed.add(id(node.exp.exp1))
+
+        for stmt in body:
+            for node in walk(stmt):
+                if isinstance(node, VarExp) and id(node) not in indexed:
+                    if isinstance(node.resolved_as, Local) and isinstance(
+                        node.resolved_as.typ, TypeArray
+                    ):
+                        self.escaped.add(id(node.resolved_as))
+
+    def analyze(self, body: list[Ast]) -> list[Interval]:
+        self.find_escapes(body)
+        for stmt in body:
+            self.stmt(stmt)
+
+        for key, live in self.intervals.items():
+            if key in self.escaped:
+                live.start, live.end = 0, FOREVER
+
+        # loops are recorded innermost first; repeat until extending an outer
+        # loop no longer makes something live across an inner one
+        changed = True
+        while changed:
+            changed = False
+            for start, end in self.loops:
+                for live in self.intervals.values():
+                    if live.start < start <= live.end < end:
+                        live.end = end
+                        changed = True
+
+        return sorted(self.intervals.values(), key=lambda i: (i.start, i.end))
+
+
+def assign_slots(intervals: list[Interval]) -> int:
+    # A local at `addr` occupies the bytes [EBP - addr, EBP - addr + size), so
+    # it is aligned whenever `addr` is a multiple of its alignment.
+    placed: list[tuple[Interval, int, int]] = []  # interval, low, high
+    top = 0
+
+    for live in intervals:
+        size = live.local.typ.sizeof()
+        align = max(live.local.typ.alignof(), 1)
+        active = [(lo, hi) for other, lo, hi in placed if other.overlaps(live)]
+
+        addr = None
+        for lo in sorted({0, *(hi for _, hi in active)}):
+            cand = align_up(lo + size, align)
+            if all(cand - size >= hi or cand <= lo_ for lo_, hi in active):
+                addr = cand
+                break
+
+        live.local.addr = addr
+        placed.append((live, addr - size, addr))
+        top = max(top, addr)
+
+    return top
+
+
+@dataclass
+class FrameReport:
+    name: str
+    before: int
+    after: int
+
+
+def layout_frame(fun: FunDefTop) -> FrameReport:
+    live = Liveness()
+    for local in fun.param_locals:
+        live.touch(local)  # register parameters are stored on entry
+    intervals = live.analyze(fun.body)
+    before = fun.max_stack_size
+    fun.max_stack_size = align_up(assign_slots(intervals), 4)
+    return FrameReport(name=fun.head.name, before=before, after=fun.max_stack_size)
+
+
+def layout_frames(prog: Program) -> list[FrameReport]:
+    return [layout_frame(top) for top in prog.topdecls if isinstance(top, FunDefTop)]
@@ -0,0 +1,170 @@
+import os
+import re
+import json
+import hashlib
+from dataclasses import asdict, dataclass, fields
+from astnodes import *
+from commonitems import *
+from frame import FrameReport
+from parallel import Piece, Pipeline
+from insn import raw, render
+from target import select_target
+from typing import Union
+
+# Function-granular compilation cache.
+#
+# The code of a function body is stored under a hash of everything it
+# depends on: the body itself (without its line numbers), the signature and
+# kind of every global name it mentions together with whether it is visible
+# and defined at that point, the compiler options and the compiler's own
+# sources. Editing one function of a large file then only compiles that
+# function (and those whose callees changed signature) again.
+#
+# A body compiled at position k takes its labels from the `{k}_` namespace
+# and numbers its statics from where the bodies before it left off (see
+# parallel.py), so an entry reused at another position has both relocated.
+# Bodies that printed anything (errors or warnings) are never stored. Entries
+# keep the code as text, which comes back as RAW lines (see insn.py).
+
+SOURCES = os.path.dirname(os.path.abspath(__file__))
+
+
+def compiler_version() -> str:
+    h = hashlib.sha256()
+    for name in sorted(os.listdir(SOURCES)):
+        if name.endswith(".py"):
+            with open(os.path.join(SOURCES, name), "rb") as f:
+                h.update(name.encode() + b"\0" + f.read())
+    return h.hexdigest()
+
+
+def fingerprint(node, names: set[str]) -> str:
+    # the tree as text, leaving out positions and what resolving fills in;
+    # collects the names it mentions
+    if isinstance(node, Ast):
+        if isinstance(node, VarExp):
+            names.add(node.lit)
+        parts = (
+            fingerprint(getattr(node, f.name), names)
+            for f in fields(node)
+            if f.init and f.name not in ("pos", "resolved_as")
+        )
+        return f"{type(node).__name__}({','.join(parts)})"
+    elif isinstance(node, list):
+        return f"[{','.join(fingerprint(v, names) for v in node)}]"
+    return repr(node)
+
+
+def referenced(names: set[str], k: int, pipeline: Pipeline) -> list[str]:
+    # how every name a body mentions resolves at position k, as text
+    refs = []
+    for name in sorted(names):
+        item = pipeline.globals.get(name, None)
+        if item is None or pipeline.declared.get(name, -1) > k:
+            refs.append(f"{name}:-")
+            continue
+        defined = isinstance(item, Fun) and pipeline.defined.get(name, -1) <= k
+        refs.append(
+            f"{name}:{type(item).__name__}:{item.typ!r}:{defined and item.initialized}"
+        )
+    return refs
+
+
+def relocate(
+    piece: Piece, fun: str, old: tuple[int, int], new: tuple[int, int]
+) -> Piece:
+    # moves a piece compiled at (position, first static) `old` to `new`
+    (k, statics), (k2, statics2) = old, new
+    if (k, statics) == (k2, statics2):
+        return piece
+    label = re.compile(rf"(?<![\w.])(\.[A-Z]){k}_(\d)")
+    static = re.compile(rf"(?<![\w.])(\w+\.{re.escape(fun)}\.)(\d+)(?!\w)")
+
+    def move(lines: list[str]) -> list[str]:
+        text = label.sub(rf"\g<1>{k2}_\g<2>", "\n".join(lines))
+        text = static.sub(
+            lambda m: m.group(1) + str(int(m.group(2)) - statics + statics2), text
+        )
+        return lines and text.split("\n")
+
+    return Piece(
+        move(piece.header),
+        move(piece.constants),
+        move(piece.asm),
+        piece.runtime,
+        frame_reports=piece.frame_reports,
+    )
+
+
+@dataclass
+class FunCache:
+    directory: str
+    hits: int = 0
+    misses: int = 0
+
+    def __post_init__(self):
+        self.version = compiler_version()
+
+    def key(self, k: int, top: FunDefTop, pipeline: Pipeline) -> str:
+        h = hashlib.sha256()
+        options = (
+            pipeline.target,
+            pipeline.level,
+            sorted(pipeline.disabled),
+            pipeline.unroll_factor,
+            pipeline.allocator,
+        )
+        names = set()
+        tree = fingerprint(top, names)
+        for part in (
+            self.version,
+            repr(options),
+            tree,
+            *referenced(names, k, pipeline),
+        ):
+            h.update(part.encode() + b"\0")
+        return h.hexdigest()
+
+    def path(self, key: str) -> str:
+        return os.path.join(self.directory, key[:2], key + ".json")
+
+    def load(
+        self, key: str, k: int, top: FunDefTop, pipeline: Pipeline
+    ) -> Union[Piece, None]:
+        try:
+            with open(self.path(key), "r") as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            self.misses += 1
+            return None
+        self.hits += 1
+        piece = Piece(
+            entry["header"],
+            entry["constants"],
+            entry["asm"],
+            set(entry["runtime"]),
+            frame_reports=[FrameReport(**r) for r in entry["frame_reports"]],
+        )
+        old = (entry["position"], entry["statics"])
+        piece = relocate(piece, top.head.name, old, (k, pipeline.statics[k]))
+        piece.asm = raw(piece.asm)
+        return piece
+
+    def store(self, key: str, k: int, pipeline: Pipeline, piece: Piece):
+        if piece.errors:
+            return
+        entry = {
+            "position": k,
+            "statics": pipeline.statics[k],
+            "header": piece.header,
+            "constants": piece.constants,
+            "asm": render(piece.asm, select_target(pipeline.target)),
+            "runtime": sorted(piece.runtime),
+            "frame_reports": [asdict(r) for r in piece.frame_reports],
+        }
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.{os.getpid()}"
+        with open(tmp, "w") as f:
+            json.dump(entry, f)
+        os.replace(tmp, path)  # atomic, other compilations may share the cache
@@ -0,0 +1,92 @@
+import copy
+from astnodes import *
+from typenodes import *
+from commonitems import *
+from frame import address_taken
+from typing import Callable, Union
+
+# Inlining of expression functions.
+#
+# Only functions whose body is a single `return exp;` with no calls or
+# assignments in it are inlined: the call is replaced by a copy of the
+# expression with the arguments put in place of the parameters. Callers
+# decide which call sites are worth it.
+
+MAX_INLINE_NODES = 16
+
+
+def inline_body(fun: FunDefTop) -> Union[Ast, None]:
+    # only `return exp;` functions whose expression has no side effects
+    if len(fun.body) != 1 or not isinstance(fun.body[0], ReturnStmt):
+        return None
+
+    exp = fun.body[0].exp
+    if exp is None or exp.rtype != fun.head.sig.ret:
+        return None
+
+    nodes = list(walk(exp))
+    if len(nodes) > MAX_INLINE_NODES:
+        return None
+    if any(isinstance(node, (CallExp, AssignExp)) for node in nodes):
+        return None
+    if address_taken(fun.body):
+        return None
+
+    return exp
+
+
+def substitute(exp: Ast, args: dict[int, Ast]) -> Ast:
+    if isinstance(exp, VarExp) and id(exp.resolved_as) in args:
+        return substitute(args[id(exp.resolved_as)], {})
+
+    new = copy.copy(exp)
+    transform(new, lambda child: substitute(child, args))
+    return new
+
+
+def inline_calls(prog: Program, wanted: Callable[[CallExp], bool]) -> int:
+    bodies = {}
+    for top in prog.topdecls:
+        if isinstance(top, FunDefTop):
+            exp = inline_body(top)
+            if exp is not None:
+                bodies[top.head.name] = (top, exp)
+
+    inlined = 0
+
+    def visit(node: Ast) -> Ast:
+        nonlocal inlined
+        transform(node, visit)
+        if not isinstance(node, CallExp) or node.callee.lit not in bodies:
+            return node
+
+        if not wanted(node):
+            return node
+
+        fun, exp = bodies[node.callee.lit]
+        uses = {}
+        for var in walk(exp):
+            if isinstance(var, VarExp):
+                uses[id(var.resolved_as)] = uses.get(id(var.resolved_as), 0) + 1
+
+        # arguments are pure, so they may be evaluated in any order, but
+        # anything bigger than a leaf must not be duplicated
+        args = {}
+        for local, arg in zip(fun.param_locals, node.args):
+            nodes = list(walk(arg))
+            if any(isinstance(n, (CallExp, AssignExp)) for n in nodes):
+                return node
+            if len(nodes) > 1 and uses.get(id(local), 0) > 1:
+                return node
+            if arg.rtype != local.typ:
+                return node  # the conversion the call makes would be lost
+            args[id(local)] = arg
+
+        inlined += 1
+        return substitute(exp, args)
+
+    for top in prog.topdecls:
+        if isinstance(top, FunDefTop):
+            top.body = [visit(stmt) for stmt in top.body]
+
+    return inlined
@@ -0,0 +1,130 @@
+from target import Imm, Indexed, Mem, Reg, Sym, SUFFIXES, Target
+from typing import Union
+
+# Structured instructions.
+#
+# The compiler emits instructions as `Insn` objects: an opcode, the operand
+# size and up to two operands (registers, memory, symbols, immediates and
+# label names), all in slots. They are only turned into AT&T text when the program is
+# generated, so code that looks at the output (metrics, the instruction count
+# of stripped functions, objfile.py) reads opcodes and operands instead of
+# parsing lines, and rewriting an instruction in place is a matter of
+# assigning its fields.
+#
+# Labels and directives are items of the stream too. Code that only exists as
+# text (read back from the function cache, see funcache.py) is kept as RAW
+# lines, written out as they are.
+
+MNEMONICS = (
+    "mov", "movs", "movz", "lea", "add", "sub", "imul", "idiv", "div", "and",
+    "or", "xor", "shl", "sar", "shr", "cmp", "neg", "not", "inc", "dec", "push",
+    "pop",
+    "cltd", "cqto", "call", "ret",
+    "jmp", "je", "jne", "jge", "jg", "jle", "jl", "ja", "jae", "jbe", "jb",
+    "label", "directive", "raw",
+)  # fmt: skip
+OPCODES = {name: op for op, name in enumerate(MNEMONICS)}
+
+MOV, MOVS, MOVZ, LEA, PUSH, POP, CALL = (OPCODES[n] for n in ("mov", "movs", "movz", "lea", "push", "pop", "call"))  # fmt: skip
+LABEL, DIRECTIVE, RAW = (OPCODES[n] for n in ("label", "directive", "raw"))
+
+JUMPS = frozenset(
+    OPCODES[n]
+    for n in ("jmp", "je", "jne", "jge", "jg", "jle", "jl", "ja", "jae", "jbe", "jb")
+)
+SHIFTS = frozenset(OPCODES[n] for n in ("shl", "sar", "shr"))  # by %cl
+PSEUDO = frozenset((LABEL, DIRECTIVE, RAW))  # not instructions
+UNSIZED = JUMPS | PSEUDO | {OPCODES[n] for n in ("call", "ret", "cltd", "cqto")}
+
+
+class Insn:
+    __slots__ = ("op", "size", "a", "b")
+
+    def __init__(self, op: int, size: int = 0, a=None, b=None):
+        self.op = op
+        self.size = size  # of the operands, of the source for movs and movz
+        self.a = a  # operands in AT&T order, None if absent
+        self.b = b
+
+    @property
+    def args(self) -> tuple:
+        if self.a is None:
+            return ()
+        return self.b is None and (self.a,) or (self.a, self.b)
+
+    def __repr__(self) -> str:
+        return f"Insn({MNEMONICS[self.op]}, {self.size}, {self.args!r})"
+
+    def mnemonic(self, word: int) -> str:
+        if self.op in UNSIZED:
+            return MNEMONICS[self.op]
+        if self.op == MOVS:
+            return "movs" + SUFFIXES[self.size] + SUFFIXES[word]
+        if self.op == MOVZ:
+            return "movz" + SUFFIXES[self.size] + "l"  # clears the upper half too
+        return MNEMONICS[self.op] + SUFFIXES[self.size]
+
+    def sizes(self, word: int) -> tuple[int, int]:
+        # of each operand: movs and movz widen into a register, shifts take
+        # their count in %cl
+        if self.op == MOVS:
+            return self.size, word
+        if self.op == MOVZ:
+            return self.size, 4
+        if self.op in SHIFTS:
+            return 1, self.size
+        return self.size, self.size
+
+    def render(self, target: Target) -> str:
+        op = self.op
+        if op == LABEL:
+            return self.a + ":"
+        if op == DIRECTIVE:
+            return "    " + self.a
+        if op == RAW:
+            return self.a
+        if op == CALL:
+            return "    call " + target.call_symbol(self.a)
+        mnemonic = self.mnemonic(target.word)
+        if self.a is None:
+            return "    " + mnemonic
+        size_a, size_b = self.sizes(target.word)
+        a = operand(self.a, size_a, target)
+        if self.b is None:
+            if op in JUMPS and not isinstance(self.a, str):
+                return f"    {mnemonic} *{a}"  # through a register or a table
+            return f"    {mnemonic} {a}"
+        return f"    {mnemonic} {a}, {operand(self.b, size_b, target)}"
+
+
+def label(name: str) -> Insn:
+    return Insn(LABEL, 0, name)
+
+
+def directive(text: str) -> Insn:
+    return Insn(DIRECTIVE, 0, text)
+
+
+def raw(lines: list[str]) -> list[Insn]:
+    return [Insn(RAW, 0, line) for line in lines]
+
+
+def operand(arg, size: int, target: Target) -> str:
+    if isinstance(arg, Reg):
+        return "%" + arg.sized(size)
+    if isinstance(arg, Mem):
+        return f"{arg.off or ''}(%{arg.base.sized(target.word)})"
+    if isinstance(arg, Imm):
+        return f"${arg.value}"
+    if isinstance(arg, Indexed):
+        base = arg.base and "%" + arg.base.sized(target.word) or ""
+        index = arg.index.sized(target.word)
+        return f"{arg.table or ''}({base},%{index},{arg.scale})"
+    if isinstance(arg, Sym):
+        return target.symbol(arg.name)
+    return arg  # a label
+
+
+def render(asm: list[Union[str, Insn]], target: Target) -> list[str]:
+    # lines already text are left as they are
+    return [item if isinstance(item, str) else item.render(target) for item in asm]
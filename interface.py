@@ -0,0 +1,290 @@
+import os
+import json
+import hashlib
+from astnodes import *
+from typenodes import *
+from commonitems import *
+from parser import ParserError
+from dataclasses import dataclass, field
+from typing import Callable, Union
+
+# Separate compilation.
+#
+# Every unit exports an interface: the signatures of the functions it
+# defines and the types of its global variables. Units see what the others
+# export without declaring it, and interfaces are kept in the build state so
+# an unchanged unit is not even parsed to get them.
+#
+# A unit is compiled again when its source changed, or when a symbol it
+# imported from another unit changed its type or disappeared. The build
+# state remembers, for each unit, the exact type of every symbol it used.
+
+STATE_FILE = "state.json"
+
+BUILTINS = {
+    t.name: t
+    for t in (
+        TypeVoid,
+        TypeChar,
+        TypeShort,
+        TypeInt,
+        TypeUChar,
+        TypeUShort,
+        TypeUInt,
+        TypeFloat,
+    )
+}
+
+
+class InterfaceError(Exception):
+    pass
+
+
+def type_to_json(typ: Type):
+    if isinstance(typ, TypeBuiltin):
+        return typ.name
+    if isinstance(typ, TypePtr):
+        return {"ptr": type_to_json(typ.inner)}
+    if isinstance(typ, TypeArray):
+        return {"array": type_to_json(typ.inner), "size": typ.size}
+    if isinstance(typ, TypeFun):
+        return {
+            "fun": [type_to_json(p) for p in typ.params],
+            "ret": type_to_json(typ.ret),
+        }
+    raise InterfaceError(f"tipo {typ} no exportable")
+
+
+def type_from_json(data) -> Type:
+    if isinstance(data, str):
+        return BUILTINS[data]
+    if "ptr" in data:
+        return TypePtr(inner=type_from_json(data["ptr"]))
+    if "array" in data:
+        return TypeArray(inner=type_from_json(data["array"]), size=data["size"])
+    return TypeFun(
+        params=[type_from_json(p) for p in data["fun"]], ret=type_from_json(data["ret"])
+    )
+
+
+def declared_names(prog: Program) -> set[str]:
+    names = set()
+    for top in prog.topdecls:
+        if isinstance(top, FunDeclTop):
+            names.add(top.name)
+        elif isinstance(top, FunDefTop):
+            names.add(top.head.name)
+        elif isinstance(top, VarTop):
+            names.update(var.name for var in top.vars)
+    return names
+
+
+def interface_of(prog: Program) -> dict:
+    functions, globals = {}, {}
+    for top in prog.topdecls:
+        if isinstance(top, FunDefTop):
+            functions[top.head.name] = type_to_json(top.head.sig)
+        elif isinstance(top, VarTop):
+            for var in top.vars:
+                globals[var.name] = type_to_json(var.wrap_type(top.typ))
+    return {"functions": functions, "globals": globals}
+
+
+@dataclass
+class Export:
+    unit: str
+    name: str
+    typ: object  # type as json
+
+    def item(self) -> Item:
+        typ = type_from_json(self.typ)
+        if isinstance(typ, TypeFun):
+            return Fun(name=self.name, typ=typ)
+        return Global(name=self.name, typ=typ)
+
+
+@dataclass
+class Unit:
+    source: str
+    hash: str
+    interface: dict = None
+    prog: Program = None
+    imports: dict = field(default_factory=dict)  # name -> type as json
+    asm: str = None
+    reason: Union[str, None] = None  # why it was compiled again
+
+
+def parse_unit(source: str, text: str) -> Program:
+    from main import parse
+
+    try:
+        return parse(text)
+    except ParserError as e:
+        tkn = e.args[0]
+        raise InterfaceError(
+            f"{source}:{tkn.lineno}: error de gramática, en token '{tkn.value}'"
+        )
+
+
+def file_hash(text: str) -> str:
+    return hashlib.sha256(text.encode()).hexdigest()
+
+
+@dataclass
+class Project:
+    build_dir: str
+    target: str = "x86"
+    level: str = "2"
+    timed: Callable = lambda name, f, *args: f(*args)
+    freestanding: bool = False
+    allocator: str = "libc"
+    state: dict = field(default_factory=dict)
+
+    @property
+    def options(self) -> str:
+        options = f"{self.target} -O{self.level} {self.allocator}"
+        return options + (self.freestanding and " nolibc" or "")
+
+    def load_state(self):
+        try:
+            with open(os.path.join(self.build_dir, STATE_FILE), "r") as f:
+                self.state = json.load(f)
+        except (OSError, ValueError):
+            self.state = {}
+        if self.state.get("options", None) != self.options:
+            self.state = {"options": self.options, "units": {}}
+
+    def save_state(self, units: list[Unit]):
+        self.state["units"] = {
+            u.source: {
+                "hash": u.hash,
+                "interface": u.interface,
+                "imports": u.imports,
+                "asm": self.asm_path(u),
+            }
+            for u in units
+        }
+        os.makedirs(self.build_dir, exist_ok=True)
+        path = os.path.join(self.build_dir, STATE_FILE)
+        with open(path + ".tmp", "w") as f:
+            json.dump(self.state, f, indent=1, sort_keys=True)
+        os.replace(path + ".tmp", path)
+
+    def asm_path(self, unit: Unit) -> str:
+        name = hashlib.sha256(os.path.abspath(unit.source).encode()).hexdigest()
+        return os.path.join(self.build_dir, name[:16] + ".s")
+
+    # --- Interfaces --- #
+
+    def scan(self, source: str) -> Unit:
+        with open(source, "r") as f:
+            text = f.read()
+        unit = Unit(source=source, hash=file_hash(text))
+
+        old = self.state["units"].get(source, None)
+        if old is not None and old["hash"] == unit.hash:
+            unit.interface = old["interface"]
+            unit.imports = old["imports"]
+            return unit
+
+        unit.reason = old is None and "nuevo" or "fuente modificada"
+        unit.prog = parse_unit(source, text)
+        unit.interface = interface_of(unit.prog)
+        return unit
+
+    def exports(self, units: list[Unit]) -> dict[str, Export]:
+        exports = {}
+        for unit in units:
+            for kind in ("functions", "globals"):
+                for name, typ in unit.interface[kind].items():
+                    prev = exports.get(name, None)
+                    if prev is not None and (kind == "functions" or prev.typ != typ):
+                        raise InterfaceError(
+                            f"'{name}' definido en '{prev.unit}' y en '{unit.source}'"
+                        )
+                    exports[name] = Export(unit=unit.source, name=name, typ=typ)
+
+        if "main" not in exports:
+            raise InterfaceError("función 'main' no presente en ninguna unidad")
+        return exports
+
+    def stale(self, unit: Unit, exports: dict[str, Export]) -> Union[str, None]:
+        if unit.reason is not None:
+            return unit.reason
+        if not os.path.exists(self.asm_path(unit)):
+            return "sin código generado"
+        for name, typ in unit.imports.items():
+            export = exports.get(name, None)
+            if export is None or export.typ != typ:
+                return f"interfaz importada '{name}' cambiada"
+        return None
+
+    # --- Compilation --- #
+
+    def compile(self, unit: Unit, exports: dict[str, Export]):
+        from main import analyze, codegen
+        from passes import PassManager
+        from target import select_target
+
+        if unit.prog is None:
+            with open(unit.source, "r") as f:
+                unit.prog = parse_unit(unit.source, f.read())
+
+        for top in unit.prog.topdecls:
+            export = isinstance(top, FunDeclTop) and exports.get(top.name, None)
+            if export and type_to_json(top.sig) != export.typ:
+                raise InterfaceError(
+                    f"{unit.source}:{top.pos}: '{top.name}' declarada con un tipo "
+                    f"distinto al exportado por '{export.unit}'"
+                )
+
+        items = {
+            name: export.item()
+            for name, export in exports.items()
+            if export.unit != unit.source
+        }
+        target = select_target(self.target)
+        analyzed = analyze(
+            unit.prog,
+            PassManager(level=self.level),
+            target,
+            whole_program=False,
+            imports=items,
+            freestanding=self.freestanding,
+            allocator=self.allocator,
+        )
+        if analyzed is None:
+            raise InterfaceError(f"no se pudo compilar '{unit.source}'")
+
+        # whatever this unit uses from the others, imported or declared by
+        # itself (statics are globals named after their function)
+        ast, res, _ = analyzed
+        unit.imports = {
+            node.lit: exports[node.lit].typ
+            for node in walk(ast)
+            if isinstance(node, VarExp)
+            and isinstance(node.resolved_as, (Fun, Global))
+            and node.resolved_as.name == node.lit
+            and node.lit in exports
+            and exports[node.lit].unit != unit.source
+        }
+        unit.asm = codegen(ast, res, target, freestanding=self.freestanding)
+        os.makedirs(self.build_dir, exist_ok=True)
+        with open(self.asm_path(unit), "w") as f:
+            f.write(unit.asm)
+
+    def build(self, sources: list[str]) -> list[Unit]:
+        self.load_state()
+        units = [self.timed(f"interfaz {s}", self.scan, s) for s in sources]
+        exports = self.exports(units)
+
+        for unit in units:
+            unit.reason = self.stale(unit, exports)
+            if unit.reason is not None:
+                self.timed(f"compilar {unit.source}", self.compile, unit, exports)
+            else:
+                with open(self.asm_path(unit), "r") as f:
+                    unit.asm = f.read()
+
+        self.save_state(units)
+        return units
@@ -0,0 +1,186 @@
+from astnodes import *
+from typenodes import *
+from commonitems import *
+from frame import address_taken
+from dataclasses import dataclass
+from typing import Union
+
+# Counted loop recognition.
+#
+# A loop is counted when it has the shape
+#
+#     while (i OP n) { ... ; i = i +/- c }      OP in <, <=, >, >=
+#
+# (which is what a `for` desugars to), where `i` is an int local whose
+# address is never taken and which the body never assigns, `c` is a positive
+# constant moving `i` towards `n`, and `n` is either a constant or such a
+# local that the loop never assigns either. The compiler may then unroll it.
+
+MAX_UNROLL_NODES = 64  # loop bodies bigger than this are never duplicated
+
+LOWER_BOUNDED = {"<", "<="}
+UPPER_BOUNDED = {">", ">="}
+
+
+@dataclass
+class CountedLoop:
+    var: VarExp
+    op: str
+    bound: Ast
+    step: int  # signed increment applied to `var` every iteration
+    trips: Union[int, None] = None  # known when the initial value is constant
+
+    def unrolled_cond(self, factor: int) -> Ast:
+        # `i < n` becomes `i < n - (factor - 1) * c`: there is room left for
+        # `factor` more iterations
+        margin = (factor - 1) * self.step
+        if isinstance(self.bound, NumExp):
+            bound = NumExp(pos=self.bound.pos, lit=self.bound.lit - margin)
+            bound.rtype = TypeInt
+        else:
+            bound = BinaryExp(
+                pos=self.bound.pos,
+                exp1=self.bound,
+                op="-",
+                exp2=NumExp(pos=self.bound.pos, lit=margin),
+            )
+            bound.rtype = bound.exp2.rtype = TypeInt
+        cond = BinaryExp(pos=self.var.pos, exp1=self.var, op=self.op, exp2=bound)
+        cond.rtype = TypeInt
+        return cond
+
+    def split(self, factor: int) -> tuple[Union[int, None], Union[int, None]]:
+        if self.trips is None:
+            return None, None
+        return self.trips // factor, self.trips % factor
+
+
+def is_int_local(exp: Ast, taken: set[int]) -> bool:
+    return (
+        isinstance(exp, VarExp)
+        and isinstance(exp.resolved_as, Local)
+        and exp.resolved_as.typ == TypeInt
+        and id(exp.resolved_as) not in taken
+    )
+
+
+def assigned_in(ast: Ast) -> set[int]:
+    return {
+        id(node.var.resolved_as)
+        for node in walk(ast)
+        if isinstance(node, AssignExp) and isinstance(node.var, VarExp)
+    }
+
+
+def constant_init(stmt: Ast, local: Local) -> Union[int, None]:
+    if isinstance(stmt, VarStmt) and not stmt.is_static:
+        for var in stmt.vars:
+            if var.resolved_as is local and isinstance(var.exp, NumExp):
+                return var.exp.lit
+
+    if isinstance(stmt, ExpStmt):
+        stmt = stmt.exp
+    if (
+        isinstance(stmt, AssignExp)
+        and stmt.op is None
+        and isinstance(stmt.var, VarExp)
+        and stmt.var.resolved_as is local
+        and isinstance(stmt.exp, NumExp)
+    ):
+        return stmt.exp.lit
+
+    return None
+
+
+def increment(step: Ast, local: Local) -> Union[int, None]:
+    # what `i = i + c`, `i += c` or `i++` (and their decrements) add to `i`
+    if not (
+        isinstance(step, AssignExp)
+        and isinstance(step.var, VarExp)
+        and step.var.resolved_as is local
+    ):
+        return None
+
+    op, amount = step.op, step.exp
+    if op is None:
+        exp = step.exp
+        if not (
+            isinstance(exp, BinaryExp)
+            and isinstance(exp.exp1, VarExp)
+            and exp.exp1.resolved_as is local
+        ):
+            return None
+        op, amount = exp.op, exp.exp2
+
+    if op not in {"+", "-"} or not isinstance(amount, NumExp) or amount.lit <= 0:
+        return None
+    return op == "+" and amount.lit or -amount.lit
+
+
+def trip_count(start: int, op: str, bound: int, step: int) -> int:
+    dist = {"<": bound - start, "<=": bound - start + 1}.get(op, None)
+    if dist is None:
+        dist = {">": start - bound, ">=": start - bound + 1}[op]
+    return max(0, -(-dist // abs(step)))
+
+
+def counted_loop(
+    loop: WhileStmt, prev: Ast, taken: set[int]
+) -> Union[CountedLoop, None]:
+    cond, step = loop.cond, loop.step
+    if not (isinstance(cond, BinaryExp) and cond.op in LOWER_BOUNDED | UPPER_BOUNDED):
+        return None
+    if not is_int_local(cond.exp1, taken):
+        return None
+    local = cond.exp1.resolved_as
+
+    incr = increment(step, local)
+    if incr is None or (incr > 0) != (cond.op in LOWER_BOUNDED):
+        return None
+
+    assigned = assigned_in(loop.block) | assigned_in(cond)
+    if id(local) in assigned:
+        return None
+
+    bound = cond.exp2
+    if not (
+        isinstance(bound, NumExp)
+        or is_int_local(bound, taken)
+        and id(bound.resolved_as) not in assigned
+        and bound.resolved_as is not local
+    ):
+        return None
+
+    nodes = list(walk(loop.block))
+    if len(nodes) > MAX_UNROLL_NODES:
+        return None
+    if any(isinstance(node, VarStmt) and node.is_static for node in nodes):
+        return None  # each copy would define the static again
+
+    trips = None
+    start = None if prev is None else constant_init(prev, local)
+    if start is not None and isinstance(bound, NumExp):
+        trips = trip_count(start, cond.op, bound.lit, incr)
+
+    return CountedLoop(var=cond.exp1, op=cond.op, bound=bound, step=incr, trips=trips)
+
+
+def annotate_loops(prog: Program) -> int:
+    found = 0
+    for top in prog.topdecls:
+        if not isinstance(top, FunDefTop):
+            continue
+
+        taken = address_taken(top.body)
+        blocks = [top.body] + [
+            node.stmts
+            for node in walk(top)
+            if isinstance(node, (BlockStmt, SwitchCase))
+        ]
+        for stmts in blocks:
+            for prev, stmt in zip([None, *stmts], stmts):
+                if isinstance(stmt, WhileStmt):
+                    stmt.counted = counted_loop(stmt, prev, taken)
+                    found += stmt.counted is not None
+
+    return found
@@ -0,0 +1,254 @@
+from astnodes import *
+from typenodes import *
+from commonitems import *
+from resolver import Resolver, constant_value
+from compiler import Compiler
+from inline import inline_calls
+from runtime import libc_calls
+from interface import InterfaceError, parse_unit, type_to_json
+from passes import PassContext, PassManager
+from parallel import Piece, merge_pieces
+from target import Target, select_target
+from concurrent.futures import ProcessPoolExecutor
+
+# Link-time optimization.
+#
+# All units are merged into a single program before resolution: one
+# prototype per defined function and then the globals of every unit go
+# first, so every unit sees all of them, and the definitions follow in order.
+# Resolving the merged program gives one `Fun`/`Global` item per symbol, and
+# static locals get program-wide unique names on the way.
+#
+# Whole-program optimizations then run before the usual passes:
+#
+# - every call to a small expression function is inlined,
+# - int globals that are never written nor have their address taken are
+#   always 0, and their reads become constants,
+# - constant expressions are folded, and `if`s on constants pruned,
+#
+# and the strip pass of the pass manager then drops whatever is no longer
+# reachable from main (see callgraph.py).
+#
+# Code is generated per function, in parallel, each function with its own
+# label namespace; the pieces are then joined in program order.
+
+
+def merge_units(units: list[tuple[str, Program]]) -> Program:
+    sigs, globals = {}, {}
+    for source, prog in units:
+        for top in prog.topdecls:
+            if isinstance(top, FunDefTop):
+                name = top.head.name
+                if name in sigs:
+                    raise InterfaceError(
+                        f"'{name}' definido en '{sigs[name][0]}' y en '{source}'"
+                    )
+                sigs[name] = (source, top.head)
+
+    decls, vartops, tops = [], [], []
+    for source, prog in units:
+        for top in prog.topdecls:
+            if isinstance(top, FunDeclTop):
+                defined = sigs.get(top.name, None)
+                if defined is None:
+                    if top.name not in {d.name for d in decls}:
+                        decls.append(top)
+                elif type_to_json(top.sig) != type_to_json(defined[1].sig):
+                    raise InterfaceError(
+                        f"{source}:{top.pos}: '{top.name}' declarada con un tipo "
+                        f"distinto al definido en '{defined[0]}'"
+                    )
+            elif isinstance(top, VarTop):
+                # the same global in several units is a single variable
+                vars = []
+                for var in top.vars:
+                    typ = type_to_json(var.wrap_type(top.typ))
+                    if var.name not in globals:
+                        globals[var.name] = typ
+                        vars.append(var)
+                    elif globals[var.name] != typ:
+                        raise InterfaceError(
+                            f"{source}:{var.pos}: global '{var.name}' con tipos distintos"
+                        )
+                if vars:
+                    vartops.append(VarTop(pos=top.pos, typ=top.typ, vars=vars))
+            else:
+                tops.append(top)
+
+    protos = [
+        FunDeclTop(pos=head.pos, name=head.name, sig=head.sig, params=head.params)
+        for _, head in sigs.values()
+    ]
+    return Program(pos=0, topdecls=decls + protos + vartops + tops)
+
+
+# --- Whole-program optimizations --- #
+
+
+def propagate_zero_globals(prog: Program) -> int:
+    written = set()
+    for node in walk(prog):
+        if isinstance(node, AssignExp) and isinstance(node.var, VarExp):
+            written.add(id(node.var.resolved_as))
+        elif isinstance(node, UnaryExp) and node.op == "&":
+            if isinstance(node.exp, VarExp):
+                written.add(id(node.exp.resolved_as))
+        elif isinstance(node, VarDecl) and node.exp is not None:
+            written.add(id(node.resolved_as))
+
+    replaced = 0
+
+    def visit(node: Ast) -> Ast:
+        nonlocal replaced
+        item = isinstance(node, VarExp) and node.resolved_as
+        if isinstance(item, Global) and item.typ == TypeInt and id(item) not in written:
+            replaced += 1
+            return constant(node.pos, 0)
+        transform(node, visit)
+        return node
+
+    for top in prog.topdecls:
+        if isinstance(top, FunDefTop):
+            top.body = [visit(stmt) for stmt in top.body]
+    return replaced
+
+
+def constant(pos: int, lit: int) -> NumExp:
+    num = NumExp(pos=pos, lit=lit)
+    num.rtype = TypeInt
+    return num
+
+
+def fold(node: Ast) -> Ast:
+    transform(node, fold)
+
+    # the same rules as `case` labels (see constant_value), except for shifts
+    # by 32 or more, whose result differs between the targets
+    if isinstance(node, BinaryExp) and node.rtype == TypeInt:
+        a, b = node.exp1, node.exp2
+        if isinstance(a, NumExp) and isinstance(b, NumExp):
+            wide = node.op in {"<<", ">>"} and not 0 <= b.lit < 32
+            val = None if wide else constant_value(node)
+            if val is not None:
+                return constant(node.pos, val)
+
+    if isinstance(node, UnaryExp) and isinstance(node.exp, NumExp):
+        val = constant_value(node)
+        if val is not None:
+            return constant(node.pos, val)
+
+    if isinstance(node, IfStmt) and isinstance(node.cond, NumExp):
+        if node.cond.lit != 0:
+            return node.then
+        return node.else_ or BlockStmt(pos=node.pos, stmts=[])
+
+    return node
+
+
+def fold_constants(prog: Program) -> int:
+    before = sum(1 for _ in walk(prog))
+    for top in prog.topdecls:
+        if isinstance(top, FunDefTop):
+            top.body = [fold(stmt) for stmt in top.body]
+    return before - sum(1 for _ in walk(prog))
+
+
+LTO_PASSES = [
+    ("lto-inline", lambda prog: inline_calls(prog, lambda call: True)),
+    ("lto-consts", propagate_zero_globals),
+    ("lto-fold", fold_constants),
+]
+
+
+# --- Parallel code generation --- #
+
+
+def compile_piece(
+    target: str, globals: dict, k: int, top: Ast, freestanding: bool
+) -> Piece:
+    # runs in a worker: the frame layout and the calling convention are
+    # already settled, each function just needs labels of its own
+    cmp = Compiler(globals=globals, target=select_target(target))
+    cmp.label_prefix = f"{k}_"
+    cmp.freestanding = freestanding
+    top.compile(cmp)
+    return Piece(cmp.header, cmp.constants, cmp.asm, cmp.runtime)
+
+
+def codegen_parallel(
+    prog: Program, res: Resolver, target: Target, jobs: int, freestanding: bool
+) -> str:
+    args = [
+        (target.name, res.globals, k, top, freestanding)
+        for k, top in enumerate(prog.topdecls)
+    ]
+    if jobs > 1 and len(args) > 1:
+        with ProcessPoolExecutor(max_workers=jobs) as pool:
+            pieces = list(pool.map(compile_piece, *zip(*args)))
+    else:
+        pieces = [compile_piece(*a) for a in args]
+
+    cmp = Compiler(globals=res.globals, target=target, freestanding=freestanding)
+    return merge_pieces(cmp, pieces).generate()
+
+
+def compile_lto(
+    sources: list[str],
+    target: str = "x86",
+    level: str = "2",
+    jobs: int = 1,
+    pm=None,
+    freestanding: bool = False,
+    allocator: str = "libc",
+) -> str:
+    target = select_target(target)
+    pm = pm or PassManager(level=level)
+
+    units = []
+    for source in sources:
+        with open(source, "r") as f:
+            with pm.stage(f"parse {source}"):
+                units.append((source, parse_unit(source, f.read())))
+
+    with pm.stage("lto-merge"):
+        prog = merge_units(units)
+
+    with pm.stage("resolve"):
+        res = Resolver(globals={**native_functions}, whole_program=False)
+        res.resolve(prog)
+    if res.error_state:
+        raise InterfaceError("no se pudo resolver el programa enlazado")
+    check_program(prog, res)
+
+    if level != "0":
+        for name, run in LTO_PASSES:
+            with pm.stage(name) as stats:
+                stats.changes = run(prog)
+
+    pm.run(
+        PassContext(
+            prog=prog,
+            globals=res.globals,
+            target=target,
+            freestanding=freestanding,
+            allocator=allocator,
+        )
+    )
+    missing = libc_calls(prog) if freestanding else set()
+    if missing:
+        raise InterfaceError(f"'{min(missing)}' no disponible sin libc")
+    with pm.stage("codegen"):
+        return codegen_parallel(prog, res, target, jobs, freestanding)
+
+
+def check_program(prog: Program, res: Resolver):
+    main = res.globals.get("main", None)
+    if not isinstance(main, Fun) or not main.initialized:
+        raise InterfaceError("función 'main' no presente en ninguna unidad")
+
+    for node in walk(prog):
+        fun = isinstance(node, CallExp) and node.callee.resolved_as
+        if isinstance(fun, Fun) and not fun.initialized:
+            raise InterfaceError(
+                f"función '{fun.name}' declarada pero no definida en ninguna unidad"
+            )
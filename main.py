@@ -1,33 +1,390 @@
 import sys
+import argparse
+from itertools import chain
 from sly.lex import LexError
 from parser import CParser, CLexer, ParserError
 from resolver import Resolver, ResolverError
 from compiler import Compiler
 from commonitems import native_functions
+from target import TARGETS, select_target
+from passes import LEVELS, PASS_NAMES, PassContext, PassManager
+from pgo import Instrumentation, Profile, ProfileError, number_blocks
+from interface import declared_names
+from runtime import libc_calls, runtime_unit
+from allocator import ALLOCATORS, allocator_unit
+from stream import compile_stream
+from parallel import Pipeline, compile_parallel
+from funcache import FunCache
+from objfile import AssemblerError, assemble
+from insn import Insn
+from typing import Iterator, Union
+from astnodes import Program
 
 
-def process_file(inp):
+def analyze(
+    inp,
+    pm: PassManager,
+    target,
+    profile_generate=None,
+    profile_use=None,
+    whole_program=True,
+    imports=None,
+    measure_stripped=False,
+    freestanding=False,
+    allocator="libc",
+):
+    # parse (unless given a parsed program), resolve and optimize; returns
+    # None after reporting any error
     try:
-        ast = CParser().parse(CLexer().tokenize(inp))
+        with pm.stage("parse"):
+            ast = isinstance(inp, Program) and inp or parse(inp)
     except ParserError as e:
         tkn = e.args[0]
         print(f"error:{tkn.lineno}: error de gramática, en token '{tkn.value}'")
         return None
 
-    res = Resolver(globals={**native_functions}).resolve(ast)
+    # symbols exported by other units, unless this one declares them itself
+    own = declared_names(ast)
+    imported = {k: v for k, v in (imports or {}).items() if k not in own}
+
+    with pm.stage("resolve"):
+        res = Resolver(
+            globals={**native_functions, **imported}, whole_program=whole_program
+        )
+        res.resolve(ast)
     if res.error_state:
         return None
 
-    return Compiler.of_resolver(res).compile(ast).generate()
+    # probes are numbered before any pass changes the program, so the
+    # instrumented and the optimized build agree on them
+    ctx = PassContext(
+        prog=ast,
+        globals=res.globals,
+        target=target,
+        whole_program=whole_program,
+        measure_stripped=measure_stripped,
+        freestanding=freestanding,
+        allocator=allocator,
+    )
+    if profile_generate is not None or profile_use is not None:
+        ctx.sites = number_blocks(ast)
+    if profile_use is not None:
+        try:
+            ctx.profile = Profile.load(profile_use)
+        except (OSError, ProfileError) as e:
+            print(f"error: no se pudo leer el perfil: {e}")
+            return None
+    pm.run(ctx)
+
+    if freestanding:
+        for name in sorted(libc_calls(ast)):
+            print(f"error: '{name}' no disponible sin libc")
+        if libc_calls(ast):
+            return None
+    return ast, res, ctx
+
+
+def parse(inp: str) -> Program:
+    return CParser().parse(CLexer().tokenize(inp))
+
+
+def codegen(
+    ast, res, target, unroll_factor=4, instrument=None, freestanding=False, items=False
+) -> Union[str, Iterator[Union[str, Insn]]]:
+    cmp = Compiler.of_resolver(res)
+    cmp.unroll_factor = unroll_factor
+    cmp.target = target
+    cmp.instrument = instrument
+    cmp.freestanding = freestanding
+    cmp.compile(ast)
+    return cmp.items() if items else cmp.generate()
+
+
+def process_file(
+    inp,
+    frame_report=False,
+    unroll_factor=4,
+    target="x86",
+    level="2",
+    disabled=(),
+    time_passes=False,
+    profile_generate=None,
+    profile_use=None,
+    whole_program=True,
+    strip_report=False,
+    freestanding=False,
+    allocator="libc",
+    items=False,  # the stream of the compiler instead of text, see insn.py
+):
+    target = select_target(target)
+    pm = PassManager(level=level, disabled=set(disabled))
+    analyzed = analyze(
+        inp,
+        pm,
+        target,
+        profile_generate,
+        profile_use,
+        whole_program=whole_program,
+        measure_stripped=strip_report,
+        freestanding=freestanding,
+        allocator=allocator,
+    )
+    if analyzed is None:
+        return None
+
+    ast, res, ctx = analyzed
+    if frame_report:
+        for r in ctx.frame_reports:
+            print(
+                f"marco de '{r.name}': {r.before} -> {r.after} bytes", file=sys.stderr
+            )
+    if strip_report:
+        for line in ctx.strip_report.lines():
+            print(line, file=sys.stderr)
+
+    instrument = None
+    if profile_generate is not None:
+        instrument = Instrumentation(ctx.sites, path=profile_generate)
+    with pm.stage("codegen"):
+        out = codegen(ast, res, target, unroll_factor, instrument, freestanding, items)
+
+    if time_passes:
+        for line in pm.report():
+            print(line, file=sys.stderr)
+    return out
+
+
+def process_file_parallel(
+    inp,
+    jobs,
+    frame_report=False,
+    unroll_factor=4,
+    target="x86",
+    level="2",
+    disabled=(),
+    time_passes=False,
+    allocator="libc",
+    fun_cache=None,
+):
+    pm = PassManager(level=level, disabled=set(disabled))
+    try:
+        with pm.stage("parse"):
+            ast = parse(inp)
+    except ParserError as e:
+        tkn = e.args[0]
+        print(f"error:{tkn.lineno}: error de gramática, en token '{tkn.value}'")
+        return None
+
+    pipeline = Pipeline(
+        target=target,
+        level=level,
+        disabled=set(disabled),
+        unroll_factor=unroll_factor,
+        allocator=allocator,
+    )
+    cache = fun_cache is not None and FunCache(fun_cache) or None
+    out, pieces = compile_parallel(ast, pm, pipeline, jobs, cache)
+    if frame_report:
+        for r in (r for piece in pieces for r in piece.frame_reports):
+            print(
+                f"marco de '{r.name}': {r.before} -> {r.after} bytes", file=sys.stderr
+            )
+    if time_passes:
+        for line in pm.report():
+            print(line, file=sys.stderr)
+        if cache is not None:
+            print(
+                f"caché: {cache.hits} funciones reutilizadas, {cache.misses} compiladas",
+                file=sys.stderr,
+            )
+    return out
+
+
+def output(units: list, target: str, obj: str = None):
+    # prints the assembly, or writes the object built from it; units are
+    # text, or items of a stream
+    if obj is None:
+        for unit in units:
+            print(unit)
+        return
+    stream = chain.from_iterable(isinstance(u, str) and [u] or u for u in units)
+    try:
+        data = assemble(stream, select_target(target))
+    except AssemblerError as e:
+        print(f"error: {e}")
+        return
+    with open(obj, "wb") as f:
+        f.write(data)
 
 
 def main():
-    if len(sys.argv) == 2:
-        with open(sys.argv[1], "r") as f:
+    args = argparse.ArgumentParser(prog="main.py")
+    args.add_argument("fichero", nargs="?")
+    args.add_argument(
+        "--frame-report",
+        action="store_true",
+        help="muestra el tamaño de cada marco de pila antes y después de compactarlo",
+    )
+    args.add_argument(
+        "--strip-report",
+        action="store_true",
+        help="muestra las funciones y variables eliminadas por inalcanzables",
+    )
+    args.add_argument(
+        "--unroll",
+        type=int,
+        default=4,
+        metavar="N",
+        help="factor de desenrollado de bucles contados (1 lo desactiva)",
+    )
+    args.add_argument(
+        "--target",
+        choices=sorted(TARGETS),
+        default="x86",
+        help="arquitectura para la que se genera código",
+    )
+    args.add_argument(
+        "-O",
+        dest="level",
+        choices=LEVELS,
+        default="2",
+        help="nivel de optimización (-O0, -O1, -O2, -Os)",
+    )
+    args.add_argument(
+        "--disable-pass",
+        action="append",
+        default=[],
+        choices=PASS_NAMES,
+        metavar="PASE",
+        help=f"no ejecuta el pase indicado ({', '.join(PASS_NAMES)})",
+    )
+    args.add_argument(
+        "--time-passes",
+        action="store_true",
+        help="muestra el tiempo y los cambios de cada pase",
+    )
+    args.add_argument(
+        "--stream",
+        action="store_true",
+        help="compila cada declaración según se lee, sin cargar el fichero entero",
+    )
+    args.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        metavar="N",
+        help="resuelve y compila las funciones en N procesos (la salida no "
+        "depende de N)",
+    )
+    args.add_argument(
+        "--fun-cache",
+        metavar="DIR",
+        help="reutiliza el código de las funciones que no cambiaron desde la "
+        "última compilación (implica -j 1 si no se da -j)",
+    )
+    args.add_argument(
+        "--nolibc",
+        action="store_true",
+        help="incluye el runtime propio y no usa libc (enlazar con ld -static)",
+    )
+    args.add_argument(
+        "--malloc",
+        choices=ALLOCATORS,
+        help="asignador de memoria para malloc y free (por defecto libc, o "
+        "classes con --nolibc); se incluye tras el programa",
+    )
+    args.add_argument(
+        "--profile-generate",
+        metavar="PERFIL",
+        help="instrumenta el programa para que escriba su perfil al terminar",
+    )
+    args.add_argument(
+        "--profile-use",
+        metavar="PERFIL",
+        help="optimiza según un perfil escrito por un programa instrumentado",
+    )
+    args.add_argument(
+        "--obj",
+        metavar="FICHERO",
+        help="escribe un objeto ELF reubicable en vez del ensamblador",
+    )
+    opts = args.parse_args()
+    allocator = opts.malloc or (opts.nolibc and "classes" or "libc")
+
+    if opts.nolibc and (opts.stream or opts.profile_generate):
+        print("error: --nolibc no admite --stream ni --profile-generate")
+        return
+
+    whole = (
+        opts.stream or opts.strip_report or opts.profile_generate or opts.profile_use
+    )
+    if opts.fun_cache is not None and opts.jobs is None:
+        opts.jobs = 1
+    if opts.jobs is not None and (whole or opts.nolibc):
+        print(
+            "error: --jobs y --fun-cache no admiten --stream, --nolibc, "
+            "--strip-report ni perfiles"
+        )
+        return
+
+    if opts.fichero is not None and opts.stream:
+        if opts.profile_generate or opts.profile_use or opts.obj:
+            print("error: --stream no admite perfiles ni --obj")
+            return
+        pm = PassManager(level=opts.level, disabled=set(opts.disable_pass))
+        with open(opts.fichero, "r") as f:
+            done = compile_stream(
+                f, sys.stdout, select_target(opts.target), pm, opts.unroll, allocator
+            )
+        if done and allocator != "libc":
+            print(allocator_unit(select_target(opts.target), allocator))
+        if opts.time_passes:
+            for line in pm.report():
+                print(line, file=sys.stderr)
+    elif opts.fichero is not None and opts.jobs is not None:
+        with open(opts.fichero, "r") as f:
+            data = process_file_parallel(
+                f.read(),
+                max(1, opts.jobs),
+                frame_report=opts.frame_report,
+                unroll_factor=opts.unroll,
+                target=opts.target,
+                level=opts.level,
+                disabled=opts.disable_pass,
+                time_passes=opts.time_passes,
+                allocator=allocator,
+                fun_cache=opts.fun_cache,
+            )
+        if data is not None:
+            units = [data]
+            if allocator != "libc":
+                units.append(allocator_unit(select_target(opts.target), allocator))
+            output(units, opts.target, opts.obj)
+    elif opts.fichero is not None:
+        with open(opts.fichero, "r") as f:
             data = f.read()
-        data = process_file(data)
+        data = process_file(
+            data,
+            frame_report=opts.frame_report,
+            strip_report=opts.strip_report,
+            unroll_factor=opts.unroll,
+            target=opts.target,
+            level=opts.level,
+            disabled=opts.disable_pass,
+            time_passes=opts.time_passes,
+            profile_generate=opts.profile_generate,
+            profile_use=opts.profile_use,
+            freestanding=opts.nolibc,
+            allocator=allocator,
+            items=opts.obj is not None,
+        )
         if data is not None:
-            print(data)
+            units = [data]
+            if opts.nolibc:
+                units.append(runtime_unit(select_target(opts.target)))
+            if allocator != "libc":
+                units.append(allocator_unit(select_target(opts.target), allocator))
+            output(units, opts.target, opts.obj)
     else:
         print(
             """
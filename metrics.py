@@ -0,0 +1,212 @@
+import sys
+import json
+import codecs
+import argparse
+from astnodes import *
+from compiler import Compiler
+from passes import LEVELS, PassManager
+from target import TARGETS, Indexed, Mem, Sym, Target, select_target
+from insn import CALL, JUMPS, LABEL, LEA, POP, PSEUDO, PUSH, Insn
+from dataclasses import asdict, dataclass, field
+
+# Static code metrics.
+#
+# Every function is compiled after the passes, exactly as it would be
+# emitted, and measured from its assembly without running it: instructions
+# by mnemonic, how many touch memory (`lea` only computes an address), pushes
+# and pops, branches, labels, calls, its frame size and the .rodata bytes of
+# the strings and floats it adds.
+#
+# Reports are saved as JSON, so the report of one compiler version can be
+# diffed against another's to catch regressions in size or quality.
+
+METRICS = (
+    ("instructions", "instr"),
+    ("frame", "marco"),
+    ("memory", "mem"),
+    ("pushes", "push"),
+    ("pops", "pop"),
+    ("branches", "saltos"),
+    ("labels", "etiq"),
+    ("calls", "llamadas"),
+    ("rodata", "rodata"),
+)
+
+
+@dataclass
+class FunMetrics:
+    name: str
+    frame: int = 0
+    instructions: int = 0
+    memory: int = 0
+    pushes: int = 0
+    pops: int = 0
+    branches: int = 0
+    labels: int = 0
+    calls: int = 0
+    rodata: int = 0
+    mnemonics: dict[str, int] = field(default_factory=dict)
+
+
+def measure_asm(m: FunMetrics, asm: list[Insn], target: Target):
+    for insn in asm:
+        if insn.op == LABEL:
+            m.labels += insn.args[0] != m.name
+            continue
+        if insn.op in PSEUDO:
+            continue  # directives
+
+        mnemonic = insn.mnemonic(target.word)
+        m.instructions += 1
+        m.mnemonics[mnemonic] = m.mnemonics.get(mnemonic, 0) + 1
+        if insn.op in JUMPS:
+            m.branches += 1
+        elif insn.op == CALL:
+            m.calls += 1
+        elif insn.op != LEA:
+            m.memory += sum(isinstance(arg, (Mem, Indexed, Sym)) for arg in insn.args)
+        m.pushes += insn.op == PUSH
+        m.pops += insn.op == POP
+
+
+def rodata_size(constants: list[str]) -> int:
+    size = 0
+    for line in map(str.strip, constants):
+        if line.startswith(".string "):
+            lit = line[len(".string ") :].strip()[1:-1]
+            size += len(codecs.escape_decode(lit.encode())[0]) + 1
+        elif line.startswith(".float ") or line.startswith(".long "):
+            size += 4
+    return size
+
+
+def function_metrics(prog: Program, cmp: Compiler) -> list[FunMetrics]:
+    # compiles the whole program, keeping apart what each function emits
+    report = []
+    for top in prog.topdecls:
+        asm, constants = len(cmp.asm), len(cmp.constants)
+        top.compile(cmp)
+        if isinstance(top, FunDefTop):
+            m = FunMetrics(name=top.head.name, frame=top.max_stack_size)
+            measure_asm(m, cmp.asm[asm:], cmp.target)
+            m.rodata = rodata_size(cmp.constants[constants:])
+            report.append(m)
+    return report
+
+
+def program_metrics(
+    inp: str, target: Target, level: str = "2", unroll_factor: int = 4
+) -> list[FunMetrics]:
+    from main import analyze
+
+    analyzed = analyze(inp, PassManager(level=level), target)
+    if analyzed is None:
+        return None
+    ast, res, _ = analyzed
+    cmp = Compiler.of_resolver(res)
+    cmp.target, cmp.unroll_factor = target, unroll_factor
+    return function_metrics(ast, cmp)
+
+
+def total(report: list[FunMetrics]) -> FunMetrics:
+    t = FunMetrics(name="total")
+    for m in report:
+        for metric, _ in METRICS:
+            setattr(t, metric, getattr(t, metric) + getattr(m, metric))
+        for mnemonic, n in m.mnemonics.items():
+            t.mnemonics[mnemonic] = t.mnemonics.get(mnemonic, 0) + n
+    return t
+
+
+def by_count(mnemonics: dict[str, int]) -> list[tuple[str, int]]:
+    return sorted(mnemonics.items(), key=lambda mn: (-mn[1], mn[0]))
+
+
+def report_lines(report: list[FunMetrics]) -> list[str]:
+    lines = [f"{'función':<20}" + "".join(f"{h:>9}" for _, h in METRICS)]
+    for m in [*report, total(report)]:
+        lines.append(
+            f"{m.name:<20}" + "".join(f"{getattr(m, k):9}" for k, _ in METRICS)
+        )
+        mnemonics = ", ".join(f"{k} {n}" for k, n in by_count(m.mnemonics))
+        lines.append(f"{'':<4}{mnemonics}")
+    return lines
+
+
+def diff_lines(old: list[FunMetrics], new: list[FunMetrics]) -> list[str]:
+    # one line per changed metric of each function, old -> new
+    before = {m.name: m for m in old}
+    after = {m.name: m for m in new}
+    lines = []
+    for name in [m.name for m in old if m.name not in after]:
+        lines.append(f"- {name}: eliminada ({before[name].instructions} instr)")
+    for name in [m.name for m in new if m.name not in before]:
+        lines.append(f"+ {name}: nueva ({after[name].instructions} instr)")
+
+    pairs = [(before[m.name], m) for m in new if m.name in before]
+    for a, b in [*pairs, (total(old), total(new))]:
+        changes = [
+            f"{header} {getattr(a, k)} -> {getattr(b, k)}"
+            f" ({getattr(b, k) - getattr(a, k):+})"
+            for k, header in METRICS
+            if getattr(a, k) != getattr(b, k)
+        ]
+        mnemonics = [
+            f"{k} {b.mnemonics.get(k, 0) - a.mnemonics.get(k, 0):+}"
+            for k in sorted({*a.mnemonics, *b.mnemonics})
+            if a.mnemonics.get(k, 0) != b.mnemonics.get(k, 0)
+        ]
+        if changes or mnemonics:
+            lines.append(f"~ {a.name}: " + ", ".join(changes))
+            if mnemonics:
+                lines.append(f"{'':<4}" + ", ".join(mnemonics))
+    if not lines:
+        lines.append("sin cambios")
+    return lines
+
+
+def load_report(path: str) -> list[FunMetrics]:
+    with open(path, "r") as f:
+        return [FunMetrics(**m) for m in json.load(f)["functions"]]
+
+
+def main():
+    args = argparse.ArgumentParser(prog="metrics.py")
+    args.add_argument(
+        "entrada", help="fichero a compilar, o informe .json guardado antes"
+    )
+    args.add_argument("-O", dest="level", choices=LEVELS, default="2")
+    args.add_argument("--target", choices=sorted(TARGETS), default="x86")
+    args.add_argument("--unroll", type=int, default=4, metavar="N")
+    args.add_argument("-o", dest="out", metavar="JSON", help="guarda el informe")
+    args.add_argument(
+        "--diff",
+        metavar="JSON",
+        help="compara con el informe guardado de otra versión del compilador",
+    )
+    opts = args.parse_args()
+
+    if opts.entrada.endswith(".json"):
+        report = load_report(opts.entrada)
+    else:
+        with open(opts.entrada, "r") as f:
+            report = program_metrics(
+                f.read(), select_target(opts.target), opts.level, opts.unroll
+            )
+        if report is None:
+            sys.exit(1)
+
+    if opts.out is not None:
+        with open(opts.out, "w") as f:
+            json.dump({"functions": [asdict(m) for m in report]}, f, indent=2)
+            f.write("\n")
+    if opts.diff is not None:
+        lines = diff_lines(load_report(opts.diff), report)
+    else:
+        lines = report_lines(report)
+    for line in lines:
+        print(line)
+
+
+if __name__ == "__main__":
+    main()
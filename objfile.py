@@ -0,0 +1,869 @@
+import re
+import struct
+from encoder import (
+    CONDITIONS,
+    REGS,
+    Addr,
+    EncodeError,
+    Encoded,
+    Encoder,
+    Expr,
+    Fixup,
+    Imm,
+    Indirect,
+    Register,
+    encode,
+    fits8,
+    pack,
+    parse_expr,
+    split_instruction,
+    split_operands,
+)
+from insn import CALL, DIRECTIVE, JUMPS, LABEL, MNEMONICS, RAW, Insn
+from target import Imm as Immediate, Indexed, Mem, Reg, Sym, Target
+from dataclasses import dataclass, field
+from typing import Iterable, Union
+
+# Relocatable ELF objects.
+#
+# Assembles what the compiler emits (and the runtime and allocator units)
+# straight into an ELF object for the system linker, without going through
+# `as`: ELF32 with REL relocations on x86, ELF64 with RELA on x86-64.
+#
+# Instructions are encoded by encoder.py, from their text or, for a stream
+# of the compiler (see insn.py), from their opcode and operands. Direct jumps start in their short
+# form and the ones whose target ends up out of reach are made long until
+# the layout stops changing. As `as` does, references are resolved when they
+# are relative to a local symbol of the same section, and otherwise left as
+# relocations, against the symbol of the section for local symbols; calls to
+# global functions always get a relocation, so they can be interposed.
+#
+# `read_object` and `object_differences` read objects back, to check the
+# output against the one `as` builds from the same assembly.
+
+
+class AssemblerError(Exception):
+    pass
+
+
+SHT_PROGBITS, SHT_SYMTAB, SHT_STRTAB, SHT_RELA, SHT_NOTE = 1, 2, 3, 4, 7
+SHT_NOBITS, SHT_REL, SHT_INIT_ARRAY, SHT_FINI_ARRAY = 8, 9, 14, 15
+SHF_WRITE, SHF_ALLOC, SHF_EXECINSTR, SHF_MERGE, SHF_STRINGS = 1, 2, 4, 0x10, 0x20
+SHF_INFO_LINK = 0x40
+STT_NOTYPE, STT_OBJECT, STT_FUNC, STT_SECTION = 0, 1, 2, 3
+STB_LOCAL, STB_GLOBAL = 0, 1
+SHN_UNDEF, SHN_COMMON = 0, 0xFFF2
+
+SECTION_TYPES = {
+    "progbits": SHT_PROGBITS,
+    "nobits": SHT_NOBITS,
+    "note": SHT_NOTE,
+    "init_array": SHT_INIT_ARRAY,
+    "fini_array": SHT_FINI_ARRAY,
+}
+SECTION_FLAGS = {"a": SHF_ALLOC, "w": SHF_WRITE, "x": SHF_EXECINSTR, "M": SHF_MERGE, "S": SHF_STRINGS}  # fmt: skip
+DEFAULT_SECTIONS = {
+    "text": (SHT_PROGBITS, SHF_ALLOC | SHF_EXECINSTR),
+    "data": (SHT_PROGBITS, SHF_WRITE | SHF_ALLOC),
+    "bss": (SHT_NOBITS, SHF_WRITE | SHF_ALLOC),
+    "rodata": (SHT_PROGBITS, SHF_ALLOC),
+    "init_array": (SHT_INIT_ARRAY, SHF_WRITE | SHF_ALLOC),
+    "fini_array": (SHT_FINI_ARRAY, SHF_WRITE | SHF_ALLOC),
+    "note": (SHT_NOTE, 0),
+}
+
+# relocation types: (kind, size, PLT) -> type
+RELOCS_X86 = {("abs", 4): 1, ("pc", 4): 2, ("plt", 4): 4}
+RELOCS_X86_64 = {
+    ("abs", 8): 1,
+    ("pc", 4): 2,
+    ("plt", 4): 4,
+    ("abs", 4): 10,
+    ("abs32s", 4): 11,
+    ("gotpcrelx", 4): 41,
+    ("rex_gotpcrelx", 4): 42,
+}
+
+DEFINITION = re.compile(r"([A-Za-z_.$][\w.$]*|\d+):\s*(.*)$")
+NUMERIC_REF = re.compile(r"(?<![\w.$])(\d+)([bf])(?![\w.$])")
+DATA_SIZES = {".byte": 1, ".short": 2, ".value": 2, ".word": 2, ".long": 4, ".int": 4, ".quad": 8}  # fmt: skip
+ESCAPES = {"n": 10, "t": 9, "r": 13, "b": 8, "f": 12, "v": 11, "a": 7, "e": 27}
+
+
+def parse_string(text: str) -> bytes:
+    # a string literal with the escapes `as` understands
+    text = text.strip()
+    if len(text) < 2 or text[0] != '"' or text[-1] != '"':
+        raise AssemblerError(f"cadena no válida {text}")
+    out, i, body = bytearray(), 0, text[1:-1]
+    while i < len(body):
+        c = body[i]
+        i += 1
+        if c != "\\":
+            out += c.encode()
+            continue
+        c = body[i]
+        i += 1
+        if c in "01234567":
+            digits = c
+            while i < len(body) and len(digits) < 3 and body[i] in "01234567":
+                digits += body[i]
+                i += 1
+            out.append(int(digits, 8) & 0xFF)
+        elif c == "x":
+            digits = ""
+            while i < len(body) and body[i] in "0123456789abcdefABCDEF":
+                digits += body[i]
+                i += 1
+            out.append(int(digits, 16) & 0xFF)
+        else:
+            out.append(ESCAPES.get(c, ord(c)))
+    return bytes(out)
+
+
+# --- Items of a section --- #
+
+
+@dataclass
+class Chunk:
+    data: bytes
+    fixups: list[Fixup] = field(default_factory=list)
+    offset: int = 0
+
+    def size(self) -> int:
+        return len(self.data)
+
+
+@dataclass
+class Branch:
+    cc: Union[int, None]  # None for jmp
+    target: Expr
+    long: bool = False
+    offset: int = 0
+
+    def size(self) -> int:
+        return not self.long and 2 or self.cc is None and 5 or 6
+
+
+@dataclass
+class Align:
+    n: int
+    fill: int
+    offset: int = 0
+
+    def size(self) -> int:
+        return -self.offset % self.n
+
+
+@dataclass
+class Space:
+    n: int
+    offset: int = 0
+
+    def size(self) -> int:
+        return self.n
+
+
+@dataclass
+class Label:
+    name: str
+    offset: int = 0
+
+    def size(self) -> int:
+        return 0
+
+
+Item = Union[Chunk, Branch, Align, Space, Label]
+
+
+@dataclass
+class Reloc:
+    offset: int
+    type: int
+    sym: str  # a symbol, or a section for local symbols
+    addend: int
+
+
+@dataclass
+class Section:
+    name: str
+    type: int
+    flags: int
+    align: int = 1
+    entsize: int = 0
+    items: list[Item] = field(default_factory=list)
+    data: bytearray = field(default_factory=bytearray)
+    size: int = 0
+    relocs: list[Reloc] = field(default_factory=list)
+
+
+@dataclass
+class Symbol:
+    name: str
+    section: Union[str, None] = None  # None while undefined
+    value: int = 0
+    size: int = 0
+    bind: int = STB_LOCAL
+    type: int = STT_NOTYPE
+    common: int = 0  # alignment, for common symbols
+    local: bool = False  # named by .local
+
+
+# --- Assembler --- #
+
+
+class Assembler:
+    def __init__(self, target: Target):
+        self.target = target
+        self.mode64 = target.word == 8
+        self.word = target.word
+        self.relocs = self.mode64 and RELOCS_X86_64 or RELOCS_X86
+        self.sections: dict[str, Section] = {}
+        for name in (".text", ".data", ".bss"):
+            self.section(name)
+        self.cur = self.sections[".text"]
+        self.symbols: dict[str, Symbol] = {}
+        self.numeric: dict[str, int] = {}  # definitions of each numeric label
+        self.got = False  # _GLOBAL_OFFSET_TABLE_ is referenced
+        self.encoded: dict[str, Encoded] = {}  # instructions repeat a lot
+
+    def section(self, name: str, flags: str = None, typ: str = None) -> Section:
+        if name not in self.sections:
+            kind = name.split(".")[1] if name.count(".") else name
+            sht, shf = DEFAULT_SECTIONS.get(kind, (SHT_PROGBITS, 0))
+            if flags is not None:
+                shf = sum(SECTION_FLAGS.get(c, 0) for c in set(flags))
+            if typ is not None:
+                sht = SECTION_TYPES.get(typ, SHT_PROGBITS)
+            sec = Section(name, sht, shf)
+            if sht in (SHT_INIT_ARRAY, SHT_FINI_ARRAY):
+                sec.entsize = self.word
+            self.sections[name] = sec
+        return self.sections[name]
+
+    def symbol(self, name: str) -> Symbol:
+        if name not in self.symbols:
+            self.symbols[name] = Symbol(name)
+        return self.symbols[name]
+
+    # --- Parsing --- #
+
+    def assemble(self, text: Union[str, Iterable[Union[str, Insn]]]) -> bytes:
+        # the text of a unit, or the items of a stream (see Compiler.items)
+        if isinstance(text, str):
+            text = text.split("\n")
+        n = 0
+        for item in text:
+            lines = isinstance(item, str) and item.split("\n") or [item]
+            for line in lines:
+                n += 1
+                try:
+                    if isinstance(line, Insn):
+                        self.insn(line)
+                    else:
+                        self.line(line)
+                except (AssemblerError, EncodeError, ValueError, IndexError) as e:
+                    if isinstance(line, Insn):
+                        line = line.render(self.target)
+                    raise AssemblerError(f"línea {n}: {e} en '{line.strip()}'")
+        self.layout()
+        for sec in self.sections.values():
+            self.emit(sec)
+        return self.write()
+
+    def line(self, line: str):
+        line = line.strip()
+        while (m := DEFINITION.match(line)) is not None:
+            self.define(m.group(1))
+            line = m.group(2).strip()
+        if not line or line.startswith("#"):
+            return
+        if line.startswith("."):
+            self.directive(line)
+        else:
+            self.instruction(line)
+
+    def define(self, name: str):
+        if name.isdigit():
+            self.numeric[name] = self.numeric.get(name, 0) + 1
+            name = f".L{name}${self.numeric[name]}"
+        sym = self.symbol(name)
+        if sym.section is not None:
+            raise AssemblerError(f"símbolo '{name}' ya definido")
+        sym.section = self.cur.name
+        self.cur.items.append(Label(name))
+
+    def numeric_refs(self, text: str) -> str:
+        def ref(m: re.Match) -> str:
+            n = self.numeric.get(m.group(1), 0) + (m.group(2) == "f")
+            return f".L{m.group(1)}${n}"
+
+        return NUMERIC_REF.sub(ref, text)
+
+    def instruction(self, line: str):
+        e = self.encoded.get(line, None)
+        if e is not None:
+            self.cur.items.append(Chunk(e.data, e.fixups))
+            return
+        mnemonic, ops = split_instruction(line)
+        if mnemonic in ("jmp", "call") or mnemonic[0] == "j":
+            line = self.numeric_refs(line)
+            mnemonic, ops = split_instruction(line)
+        cc = CONDITIONS.get(mnemonic[1:], None) if mnemonic[0] == "j" else None
+        direct = len(ops) == 1 and not ops[0].strip().startswith("*")
+        if direct and (mnemonic == "jmp" or cc is not None):
+            self.cur.items.append(Branch(cc, parse_expr(ops[0].strip())))
+            return
+        e = encode(line, self.mode64)
+        if mnemonic != "call" and mnemonic[0] != "j":  # may name numeric labels
+            self.encoded[line] = e
+        self.cur.items.append(Chunk(e.data, e.fixups))
+
+    def insn(self, insn: Insn):
+        op = insn.op
+        if op == LABEL:
+            self.define(insn.a)
+            return
+        if op == DIRECTIVE or op == RAW:
+            self.line(insn.a)
+            return
+        if op in JUMPS and isinstance(insn.a, str):
+            cc = CONDITIONS.get(MNEMONICS[op][1:], None)
+            self.cur.items.append(Branch(cc, Expr(sym=insn.a)))
+            return
+        key = (op, insn.size, insn.a, insn.b)
+        e = self.encoded.get(key, None)
+        if e is None:
+            if op == CALL:
+                ops = [Expr(sym=insn.a, modifier=self.target.sysv and "PLT" or None)]
+            else:
+                sizes = insn.sizes(self.word)
+                ops = [self.operand(arg, n) for arg, n in zip(insn.args, sizes)]
+                if op in JUMPS:
+                    ops = [Indirect(ops[0])]
+            e = self.encoded[key] = Encoder(self.mode64).encode(
+                insn.mnemonic(self.word), ops
+            )
+        self.cur.items.append(Chunk(e.data, e.fixups))
+
+    def operand(self, arg, size: int):
+        if isinstance(arg, Reg):
+            return Register(arg.sized(size), *REGS[arg.sized(size)])
+        if isinstance(arg, Mem):
+            base = arg.base.sized(self.word)
+            return Addr(Expr(arg.off), Register(base, *REGS[base]))
+        if isinstance(arg, Immediate):
+            return Imm(Expr(arg.value))
+        if isinstance(arg, Indexed):
+            regs = [r and r.sized(self.word) for r in (arg.base, arg.index)]
+            base, index = (r and Register(r, *REGS[r]) for r in regs)
+            return Addr(Expr(sym=arg.table), base, index, arg.scale)
+        if isinstance(arg, Sym):
+            expr = parse_expr(arg.name)  # may be a symbol plus an offset
+            return self.mode64 and Addr(expr, rip=True) or expr
+        return Expr(sym=arg)  # a label
+
+    def directive(self, line: str):
+        name, _, rest = line.partition(" ")
+        rest = rest.strip()
+        args = [a.strip() for a in split_operands(rest)]
+        if name in (".text", ".data", ".bss"):
+            self.cur = self.section(name)
+        elif name == ".section":
+            flags = len(args) > 1 and args[1].strip('"') or None
+            typ = len(args) > 2 and args[2].lstrip("@%") or None
+            self.cur = self.section(args[0], flags, typ)
+        elif name in (".globl", ".global"):
+            for arg in args:
+                self.symbol(arg).bind = STB_GLOBAL
+        elif name == ".local":
+            for arg in args:
+                self.symbol(arg).local = True
+        elif name == ".type":
+            kind = args[1].lstrip("@%")
+            self.symbol(args[0]).type = {"function": STT_FUNC, "object": STT_OBJECT}[
+                kind
+            ]
+        elif name == ".comm":
+            self.comm(args[0], int(args[1], 0), len(args) > 2 and int(args[2], 0) or 1)
+        elif name in (".align", ".balign", ".p2align"):
+            n = int(args[0], 0)
+            n = name == ".p2align" and 1 << n or n
+            fill = self.cur.flags & SHF_EXECINSTR and 0x90 or 0
+            self.cur.items.append(Align(n, fill))
+            self.cur.align = max(self.cur.align, n)
+        elif name in (".string", ".asciz", ".ascii"):
+            data = parse_string(rest) + (name != ".ascii" and b"\0" or b"")
+            self.cur.items.append(Chunk(data))
+        elif name in DATA_SIZES:
+            self.data(args, DATA_SIZES[name])
+        elif name in (".float", ".single", ".double"):
+            fmt = name == ".double" and "<d" or "<f"
+            for arg in args:
+                self.cur.items.append(Chunk(struct.pack(fmt, float(arg.strip('"')))))
+        elif name in (".zero", ".skip", ".space"):
+            self.cur.items.append(Space(int(args[0], 0)))
+        elif name not in (".file", ".ident", ".size"):
+            raise AssemblerError(f"directiva desconocida '{name}'")
+
+    def comm(self, name: str, size: int, align: int):
+        sym = self.symbol(name)
+        sym.size, sym.type = size, STT_OBJECT
+        if sym.local:
+            # a local common symbol is allocated in .bss, as `as` does
+            bss = self.section(".bss")
+            bss.items += [Align(align, 0), Label(name), Space(size)]
+            bss.align = max(bss.align, align)
+            sym.section = ".bss"
+        else:
+            sym.bind, sym.common = STB_GLOBAL, align
+
+    def data(self, args: list[str], size: int):
+        for arg in args:
+            e = parse_expr(arg)
+            fixups = e.sym is not None and [Fixup(0, size, e, "abs")] or []
+            self.cur.items.append(
+                Chunk(pack(e.sym is None and e.value or 0, size), fixups)
+            )
+
+    # --- Layout --- #
+
+    def place(self, sec: Section):
+        offset = 0
+        for item in sec.items:
+            item.offset = offset
+            if isinstance(item, Label):
+                self.symbols[item.name].value = offset
+            offset += item.size()
+        sec.size = offset
+
+    def reaches(self, sec: Section, b: Branch) -> bool:
+        sym = self.symbols.get(b.target.sym, None)
+        if sym is None or sym.section != sec.name or b.target.modifier is not None:
+            return False
+        return fits8(sym.value + b.target.value - (b.offset + 2))
+
+    def layout(self):
+        changed = True
+        while changed:
+            changed = False
+            for sec in self.sections.values():
+                self.place(sec)
+            for sec in self.sections.values():
+                for item in sec.items:
+                    if isinstance(item, Branch) and not item.long:
+                        if not self.reaches(sec, item):
+                            item.long = changed = True
+
+    # --- Code --- #
+
+    def emit(self, sec: Section):
+        for item in sec.items:
+            if isinstance(item, Chunk):
+                sec.data += item.data
+                for f in item.fixups:
+                    self.fixup(sec, item, f)
+            elif isinstance(item, Branch):
+                self.branch(sec, item)
+            elif isinstance(item, Align):
+                sec.data += bytes([item.fill]) * item.size()
+            elif isinstance(item, Space):
+                sec.data += bytes(item.n)
+        if sec.type == SHT_NOBITS:
+            sec.data = bytearray()
+
+    def branch(self, sec: Section, b: Branch):
+        if not b.long:
+            sym = self.symbols[b.target.sym]
+            disp = sym.value + b.target.value - (b.offset + 2)
+            opcode = b.cc is None and 0xEB or 0x70 | b.cc
+            sec.data += bytes([opcode]) + pack(disp, 1)
+            return
+        head = b.cc is None and b"\xe9" or bytes([0x0F, 0x80 | b.cc])
+        chunk = Chunk(
+            head + bytes(4), [Fixup(len(head), 4, b.target, "jump")], b.offset
+        )
+        sec.data += chunk.data
+        self.fixup(sec, chunk, chunk.fixups[0])
+
+    def fixup(self, sec: Section, chunk: Chunk, f: Fixup):
+        at = chunk.offset + f.offset
+        e = f.expr
+        sym = self.symbol(e.sym)
+        if e.base is not None:
+            return self.difference(sec, at, f.size, e, sym)
+        relative = f.kind in ("pc", "branch", "jump", "gotpcrel")
+        addend = e.value - (relative and f.size + f.addend or 0)
+
+        if f.kind == "gotpcrel":
+            rex = f.offset >= 3 and chunk.data[f.offset - 3] & 0xF0 == 0x40
+            self.got = True
+            return self.reloc(
+                sec, at, (rex and "rex_" or "") + "gotpcrelx", f.size, sym.name, addend
+            )
+
+        # jumps resolve to any symbol of the section, calls only to local ones
+        same = sym.section == sec.name and e.modifier in (None, "PLT")
+        if relative and same and (f.kind == "jump" or sym.bind == STB_LOCAL):
+            sec.data[at : at + f.size] = pack(sym.value + addend - at, f.size)
+            return
+
+        kind = f.kind
+        if kind in ("branch", "jump"):
+            kind = (self.mode64 or e.modifier == "PLT") and "plt" or "pc"
+        elif kind == "pc" and e.modifier == "PLT":
+            kind = "plt"
+        elif kind == "abs32s" and not self.mode64:
+            kind = "abs"
+        target = sym.name
+        if sym.section is not None and sym.bind == STB_LOCAL:
+            target, addend = sym.section, addend + sym.value
+        self.reloc(sec, at, kind, f.size, target, addend)
+
+    def difference(self, sec: Section, at: int, size: int, e: Expr, sym: Symbol):
+        # `sym - base` with base in this section, like the entries of a
+        # relative jump table: resolved within the section, and otherwise
+        # relative to the field, which is at `at - base` past base
+        base = self.symbols.get(e.base, None)
+        if base is None or base.section != sec.name:
+            raise AssemblerError(f"diferencia de símbolos no admitida {e.sym}-{e.base}")
+        addend = e.value + at - base.value
+        if sym.section == sec.name:
+            sec.data[at : at + size] = pack(sym.value + addend - at, size)
+            return
+        target = sym.name
+        if sym.section is not None and sym.bind == STB_LOCAL:
+            target, addend = sym.section, addend + sym.value
+        self.reloc(sec, at, "pc", size, target, addend)
+
+    def reloc(
+        self, sec: Section, at: int, kind: str, size: int, target: str, addend: int
+    ):
+        typ = self.relocs.get((kind, size), None)
+        if typ is None:
+            raise AssemblerError(f"reubicación {kind} de {size} bytes no admitida")
+        if not self.mode64:
+            sec.data[at : at + size] = pack(addend, size)  # REL: in the section
+        sec.relocs.append(Reloc(at, typ, target, addend))
+
+    # --- ELF --- #
+
+    def symbol_table(self) -> tuple[list[tuple[str, str, Symbol]], int]:
+        # (name, section of a section symbol, symbol), the locals first, and
+        # the index of the first global
+        used = {r.sym for sec in self.sections.values() for r in sec.relocs}
+        local = [("", name, None) for name in self.sections if name in used]
+        glob = []
+        if self.got:
+            self.symbol("_GLOBAL_OFFSET_TABLE_").bind = STB_GLOBAL
+        for name in used - self.sections.keys():
+            sym = self.symbols[name]
+            if sym.section is None and not sym.common:
+                sym.bind = STB_GLOBAL  # undefined
+        for sym in self.symbols.values():
+            if sym.name.startswith(".L"):
+                continue
+            if sym.bind == STB_LOCAL and sym.section is not None:
+                local.append((sym.name, None, sym))
+            elif sym.bind == STB_GLOBAL:
+                glob.append((sym.name, None, sym))
+        return [("", None, None), *local, *glob], 1 + len(local)
+
+    def write(self) -> bytes:
+        elf64 = self.mode64
+        word = elf64 and 8 or 4
+        contents = list(self.sections.values())
+        entries, first_global = self.symbol_table()
+
+        # section headers: contents each followed by its relocations
+        headers: list[dict] = [{}]
+        index = {}
+        for sec in contents:
+            index[sec.name] = len(headers)
+            headers.append({"sec": sec})
+            if sec.relocs:
+                headers.append({"rel": sec})
+        symtab, strtab, shstrtab = len(headers), len(headers) + 1, len(headers) + 2
+        headers += [{"name": ".symtab"}, {"name": ".strtab"}, {"name": ".shstrtab"}]
+        sym_index = {}
+
+        strings = bytearray(b"\0")
+        symbols = bytearray()
+        for i, (name, section, sym) in enumerate(entries):
+            name_off = 0
+            if name:
+                name_off = len(strings)
+                strings += name.encode() + b"\0"
+                sym_index[name] = i
+            if section is not None:
+                sym_index[section] = i
+                fields = (0, 0, 0, STT_SECTION, index[section])
+            elif sym is None:
+                fields = (0, 0, 0, 0, SHN_UNDEF)
+            else:
+                shndx = sym.common and SHN_COMMON or index.get(sym.section, SHN_UNDEF)
+                value = sym.common or sym.value
+                fields = (value, sym.size, sym.bind << 4 | sym.type, 0, shndx)
+            value, size, info, stype, shndx = fields
+            info = info | stype
+            if elf64:
+                symbols += struct.pack("<IBBHQQ", name_off, info, 0, shndx, value, size)
+            else:
+                symbols += struct.pack("<IIIBBH", name_off, value, size, info, 0, shndx)
+
+        names = bytearray(b"\0")
+
+        def name_of(name: str) -> int:
+            off = len(names)
+            names.extend(name.encode() + b"\0")
+            return off
+
+        out = bytearray(elf64 and 64 or 52)
+
+        def place(data: bytes, align: int) -> int:
+            out.extend(bytes(-len(out) % align))
+            off = len(out)
+            out.extend(data)
+            return off
+
+        shdrs = []
+        for h in headers[1:]:
+            if "sec" in h:
+                sec = h["sec"]
+                off = place(sec.data, sec.align)
+                shdrs.append(
+                    (
+                        name_of(sec.name),
+                        sec.type,
+                        sec.flags,
+                        off,
+                        sec.size,
+                        0,
+                        0,
+                        sec.align,
+                        sec.entsize,
+                    )
+                )
+            elif "rel" in h:
+                sec = h["rel"]
+                data = bytearray()
+                for r in sec.relocs:
+                    if elf64:
+                        data += struct.pack(
+                            "<QQq", r.offset, sym_index[r.sym] << 32 | r.type, r.addend
+                        )
+                    else:
+                        data += struct.pack(
+                            "<II", r.offset, sym_index[r.sym] << 8 | r.type
+                        )
+                off = place(data, word)
+                rel = elf64 and (".rela", SHT_RELA, 24) or (".rel", SHT_REL, 8)
+                shdrs.append(
+                    (
+                        name_of(rel[0] + sec.name),
+                        rel[1],
+                        SHF_INFO_LINK,
+                        off,
+                        len(data),
+                        symtab,
+                        index[sec.name],
+                        word,
+                        rel[2],
+                    )
+                )
+            elif h["name"] == ".symtab":
+                off = place(symbols, word)
+                shdrs.append(
+                    (
+                        name_of(".symtab"),
+                        SHT_SYMTAB,
+                        0,
+                        off,
+                        len(symbols),
+                        strtab,
+                        first_global,
+                        word,
+                        elf64 and 24 or 16,
+                    )
+                )
+            elif h["name"] == ".strtab":
+                off = place(strings, 1)
+                shdrs.append(
+                    (name_of(".strtab"), SHT_STRTAB, 0, off, len(strings), 0, 0, 1, 0)
+                )
+            else:
+                name = name_of(".shstrtab")
+                off = place(names, 1)
+                shdrs.append((name, SHT_STRTAB, 0, off, len(names), 0, 0, 1, 0))
+
+        shoff = place(b"", word)
+        fmt = elf64 and "<IIQQQQIIQQ" or "<IIIIIIIIII"
+        out += bytes(elf64 and 64 or 40)
+        for name, typ, flags, off, size, link, info, align, entsize in shdrs:
+            out += struct.pack(
+                fmt, name, typ, flags, 0, off, size, link, info, align, entsize
+            )
+
+        ident = b"\x7fELF" + bytes([elf64 and 2 or 1, 1, 1]) + bytes(9)
+        machine = elf64 and 62 or 3
+        if elf64:
+            header = struct.pack(
+                "<HHIQQQIHHHHHH",
+                1,
+                machine,
+                1,
+                0,
+                0,
+                shoff,
+                0,
+                64,
+                0,
+                0,
+                64,
+                len(headers),
+                shstrtab,
+            )
+        else:
+            header = struct.pack(
+                "<HHIIIIIHHHHHH",
+                1,
+                machine,
+                1,
+                0,
+                0,
+                shoff,
+                0,
+                52,
+                0,
+                0,
+                40,
+                len(headers),
+                shstrtab,
+            )
+        out[: len(ident) + len(header)] = ident + header
+        return bytes(out)
+
+
+def assemble(text: Union[str, Iterable[Union[str, Insn]]], target: Target) -> bytes:
+    return Assembler(target).assemble(text)
+
+
+# --- Reading objects back --- #
+
+
+@dataclass
+class ObjectInfo:
+    sections: dict[str, tuple[int, int, int, bytes]]  # type, flags, align, data
+    relocs: dict[str, list[tuple[int, int, str, int]]]  # offset, type, symbol, addend
+    symbols: set[
+        tuple[str, int, int, str, int, int]
+    ]  # bind, type, section, value, size
+
+
+def read_object(data: bytes) -> ObjectInfo:
+    elf64 = data[4] == 2
+    if elf64:
+        shoff, shentsize, shnum, shstrndx = (
+            *struct.unpack_from("<Q", data, 40),
+            64,
+            *struct.unpack_from("<HH", data, 60),
+        )
+        shfmt = "<IIQQQQIIQQ"
+    else:
+        shoff, shentsize, shnum, shstrndx = (
+            *struct.unpack_from("<I", data, 32),
+            40,
+            *struct.unpack_from("<HH", data, 48),
+        )
+        shfmt = "<IIIIIIIIII"
+    shdrs = [
+        struct.unpack_from(shfmt, data, shoff + i * shentsize) for i in range(shnum)
+    ]
+
+    def cstr(table_off: int, off: int) -> str:
+        end = data.index(b"\0", table_off + off)
+        return data[table_off + off : end].decode()
+
+    names = [cstr(shdrs[shstrndx][4], h[0]) for h in shdrs]
+    info = ObjectInfo({}, {}, set())
+    symbols = []
+    for i, (_, typ, _, _, off, size, link, _, _, entsize) in enumerate(shdrs):
+        if typ != SHT_SYMTAB:
+            continue
+        strtab = shdrs[link][4]
+        for k in range(size // entsize):
+            at = off + k * entsize
+            if elf64:
+                name, st_info, _, shndx, value, sym_size = struct.unpack_from(
+                    "<IBBHQQ", data, at
+                )
+            else:
+                name, value, sym_size, st_info, _, shndx = struct.unpack_from(
+                    "<IIIBBH", data, at
+                )
+            section = (
+                shndx == SHN_COMMON
+                and "COM"
+                or 0 < shndx < len(names)
+                and names[shndx]
+                or "UND"
+            )
+            if st_info & 0xF == STT_SECTION:
+                symbols.append(section)
+                continue
+            symbols.append(cstr(strtab, name))
+            if k > 0:
+                info.symbols.add(
+                    (
+                        cstr(strtab, name),
+                        st_info >> 4,
+                        st_info & 0xF,
+                        section,
+                        value,
+                        sym_size,
+                    )
+                )
+
+    for i, (_, typ, flags, _, off, size, link, target, align, entsize) in enumerate(
+        shdrs
+    ):
+        if typ in (SHT_REL, SHT_RELA):
+            relocs = []
+            for k in range(size // entsize):
+                at = off + k * entsize
+                if elf64:
+                    r_off, r_info, addend = struct.unpack_from("<QQq", data, at)
+                    sym, rtype = r_info >> 32, r_info & 0xFFFFFFFF
+                else:
+                    (r_off, r_info), addend = struct.unpack_from("<II", data, at), 0
+                    sym, rtype = r_info >> 8, r_info & 0xFF
+                relocs.append((r_off, rtype, symbols[sym], addend))
+            info.relocs[names[target]] = sorted(relocs)
+        elif i > 0 and typ not in (SHT_SYMTAB, SHT_STRTAB):
+            contents = typ != SHT_NOBITS and data[off : off + size] or bytes(size)
+            info.sections[names[i]] = (typ, flags, align, contents)
+    return info
+
+
+def object_differences(a: ObjectInfo, b: ObjectInfo) -> list[str]:
+    # what differs between two objects, with empty sections left out
+    diffs = []
+    sa, sb = a.sections, b.sections
+    for name in sorted(sa.keys() | sb.keys()):
+        if name not in sa or name not in sb:
+            diffs.append(f"sección {name} sólo en uno de los objetos")
+            continue
+        (ta, fa, aa, da), (tb, fb, ab, db) = sa[name], sb[name]
+        if (ta, fa, aa) != (tb, fb, ab):
+            diffs.append(f"sección {name}: tipo, flags o alineamiento distintos")
+        elif da != db:
+            at = next(
+                (i for i, (x, y) in enumerate(zip(da, db)) if x != y),
+                min(len(da), len(db)),
+            )
+            diffs.append(f"sección {name}: contenido distinto desde el byte {at:#x}")
+        if a.relocs.get(name, []) != b.relocs.get(name, []):
+            diffs.append(f"sección {name}: reubicaciones distintas")
+    for sym in sorted(a.symbols ^ b.symbols):
+        diffs.append(f"símbolo {sym[0]} distinto o sólo en uno de los objetos")
+    return diffs
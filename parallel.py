@@ -0,0 +1,241 @@
+import io
+from astnodes import *
+from commonitems import *
+from resolver import Resolver, ResolverError
+from compiler import Compiler
+from passes import PassContext, PassManager, PassStats
+from stream import merge_stats
+from frame import FrameReport
+from target import Target, select_target
+from contextlib import redirect_stdout
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+from typing import Union
+
+# Parallel compilation of function bodies.
+#
+# Once the signatures of the functions and the globals are known, every body
+# can be resolved, optimized and compiled on its own. The pipeline has two
+# phases:
+#
+# 1. every top-level declaration is resolved in program order, function
+#    definitions only as far as their head, recording where each name was
+#    declared and defined;
+# 2. the bodies are resolved, optimized and compiled in a pool of processes,
+#    and their code, globals and constants merged back in program order.
+#
+# A body only sees the globals declared (and the functions defined) before
+# it, so it gets the same errors as when resolved in sequence; it numbers its
+# statics from where the bodies before it left off, and takes its labels from
+# a namespace of its own named after its position. Nothing a worker produces
+# depends on which worker ran it or on what it ran before, so the output is
+# the same byte for byte with any number of workers. Like streaming
+# compilation, passes that need the whole program (stripping, profile-guided
+# ones) do not run here.
+
+
+@dataclass
+class Piece:
+    header: list[str] = field(default_factory=list)
+    constants: list[str] = field(default_factory=list)
+    asm: list[str] = field(default_factory=list)
+    runtime: set[str] = field(default_factory=set)
+    errors: str = ""  # messages, printed in program order
+    stats: list[PassStats] = field(default_factory=list)
+    frame_reports: list[FrameReport] = field(default_factory=list)
+
+
+def merge_pieces(cmp: Compiler, pieces: list[Piece]) -> Compiler:
+    for piece in pieces:
+        cmp.header += piece.header
+        cmp.constants += piece.constants
+        cmp.asm += piece.asm
+        cmp.runtime |= piece.runtime
+    return cmp
+
+
+@dataclass
+class BodyResolver(Resolver):
+    # resolves a body at its place in the program
+    declared: dict[str, int] = field(default_factory=dict)  # name -> position
+    defined: dict[str, int] = field(default_factory=dict)
+    at: int = 0
+
+    def find_var(self, name: str) -> Union[Local, Global, None]:
+        var = self.scope is not None and self.scope.find(name) or None
+        if var is None and self.declared.get(name, -1) <= self.at:
+            var = self.globals.get(name, None)
+        return var
+
+    def is_defined(self, fun: Fun) -> bool:
+        return fun.initialized and self.defined.get(fun.name, -1) <= self.at
+
+
+@dataclass
+class Pipeline:
+    globals: dict[str, Item] = field(default_factory=dict)
+    declared: dict[str, int] = field(default_factory=dict)
+    defined: dict[str, int] = field(default_factory=dict)
+    statics: dict[int, int] = field(default_factory=dict)  # numbered before
+    target: str = "x86"
+    level: str = "2"
+    disabled: set[str] = field(default_factory=set)
+    unroll_factor: int = 4
+    allocator: str = "libc"
+
+
+def declare(prog: Program, res: Resolver, pipeline: Pipeline) -> list[Piece]:
+    # the first phase, in program order; returns a piece per declaration with
+    # its messages (and, for all but functions, its code)
+    cmp = Compiler(globals=res.globals, target=select_target(pipeline.target))
+    pieces, statics = [], 0
+    for k, top in enumerate(prog.topdecls):
+        known = set(res.globals)
+        out = io.StringIO()
+        with redirect_stdout(out):
+            try:
+                if isinstance(top, FunDefTop):
+                    top.resolve_head(res)
+                else:
+                    top.resolve(res)
+            except ResolverError:
+                top = None  # as in Program.resolve, the body is skipped
+        for name in res.globals.keys() - known:
+            pipeline.declared[name] = k
+
+        piece = Piece(errors=out.getvalue())
+        if isinstance(top, FunDefTop):
+            pipeline.defined[top.head.name] = k
+            pipeline.statics[k] = statics
+            statics += sum(
+                len(node.vars)
+                for node in walk(top)
+                if isinstance(node, VarStmt) and node.is_static
+            )
+        elif top is not None and not res.error_state:
+            cmp.header, cmp.asm = [], []
+            top.compile(cmp)
+            piece.header, piece.asm = cmp.header, cmp.asm
+        pieces.append(piece)
+    return pieces
+
+
+WORKER: Pipeline = None
+
+
+def start_worker(pipeline: Pipeline):
+    global WORKER
+    WORKER = pipeline
+
+
+def compile_body(k: int, top: FunDefTop) -> Piece:
+    # the second phase, for one body; runs in a worker
+    p = WORKER
+    target = select_target(p.target)
+    res = BodyResolver(
+        globals=p.globals,
+        declared=p.declared,
+        defined=p.defined,
+        at=k,
+        static_var_count=p.statics[k],
+    )
+    pm = PassManager(level=p.level, disabled=p.disabled)
+    out = io.StringIO()
+    with pm.stage("resolve"), redirect_stdout(out):
+        try:
+            top.resolve_body(res)
+        except ResolverError:
+            pass
+    if res.error_state:
+        return Piece(errors=out.getvalue(), stats=pm.stats)
+
+    ctx = PassContext(
+        prog=Program(pos=top.pos, topdecls=[top]),
+        globals=p.globals,
+        target=target,
+        level=p.level,
+        whole_program=False,
+        allocator=p.allocator,
+    )
+    pm.run(ctx)
+    with pm.stage("codegen"):
+        cmp = Compiler(globals=p.globals, target=target)
+        cmp.unroll_factor = p.unroll_factor
+        cmp.label_prefix = f"{k}_"
+        top.compile(cmp)
+    return Piece(
+        cmp.header,
+        cmp.constants,
+        cmp.asm,
+        cmp.runtime,
+        stats=pm.stats,
+        frame_reports=ctx.frame_reports,
+    )
+
+
+def compile_parallel(
+    prog: Program,
+    pm: PassManager,
+    pipeline: Pipeline,
+    jobs: int,
+    cache: "FunCache" = None,
+) -> tuple[Union[str, None], list[Piece]]:
+    # returns the assembly (None after reporting any error) and the pieces;
+    # bodies found in the cache (see funcache.py) are not compiled again
+    res = Resolver(globals={**native_functions})
+    pipeline.globals = res.globals
+    with pm.stage("declare"):
+        pieces = declare(prog, res, pipeline)
+
+    bodies = [
+        (k, top)
+        for k, top in enumerate(prog.topdecls)
+        if isinstance(top, FunDefTop) and k in pipeline.statics
+    ]
+    found, keys = {}, {}
+    if cache is not None:
+        with pm.stage("cache"):
+            for k, top in bodies:
+                keys[k] = cache.key(k, top, pipeline)
+                piece = cache.load(keys[k], k, top, pipeline)
+                if piece is not None:
+                    found[k] = piece
+        bodies = [(k, top) for k, top in bodies if k not in found]
+
+    if jobs > 1 and len(bodies) > 1:
+        chunk = max(1, len(bodies) // (4 * jobs))
+        with ProcessPoolExecutor(
+            max_workers=jobs, initializer=start_worker, initargs=(pipeline,)
+        ) as pool:
+            done = pool.map(compile_body, *zip(*bodies), chunksize=chunk)
+            done = list(done)
+    else:
+        start_worker(pipeline)
+        done = [compile_body(k, top) for k, top in bodies]
+
+    totals: dict[str, PassStats] = {}
+    merge_stats(pm, totals)
+    for (k, _), piece in zip(bodies, done):
+        if cache is not None:
+            cache.store(keys[k], k, pipeline, piece)
+        piece.errors = pieces[k].errors + piece.errors
+        pieces[k] = piece
+        pm.stats = piece.stats
+        merge_stats(pm, totals)
+    pm.stats = list(totals.values())
+    for k, piece in found.items():
+        piece.errors = pieces[k].errors
+        pieces[k] = piece
+    errors = "".join(piece.errors for piece in pieces)
+    print(errors, end="")
+    error_state = res.error_state or bool(errors)
+
+    # main is checked once everything has been seen
+    res.error_state = False
+    Program(pos=1, topdecls=[]).resolve(res)
+    if error_state or res.error_state:
+        return None, pieces
+
+    with pm.stage("merge"):
+        cmp = Compiler(globals=res.globals, target=select_target(pipeline.target))
+        return merge_pieces(cmp, pieces).generate(), pieces
@@ -0,0 +1,110 @@
+import sys
+import time
+import argparse
+from main import process_file, process_file_parallel
+from passes import LEVELS
+from target import TARGETS
+
+# Scaling benchmark of parallel compilation.
+#
+# Generates programs with thousands of functions (each with its own locals,
+# loops, statics, strings and calls to the function before it) and compiles
+# every one sequentially and then with each number of workers given, reporting
+# the best wall time of each and its speedup over one worker. The assembly has
+# to be the same byte for byte with any number of workers.
+
+FUNCTION = """\
+int f{k}(int n) {{
+    static int calls = 0;
+    int i;
+    int acc;
+    acc = n + {k};
+    calls = calls + 1;
+    for (i = 0; i < n; i = i + 1) {{
+        if (i % {m} == 0) {{
+            acc = acc + f{prev}(i / 2);
+        }} else {{
+            acc = acc * 3 - i;
+        }}
+    }}
+    while (acc > {k} + 1000) {{
+        acc = acc / 2;
+    }}
+    if (n == 0) {{
+        printf("f{k}: %i\\n", calls);
+    }}
+    return acc;
+}}
+"""
+
+
+def generate(functions: int) -> str:
+    src = ["int f0(int n) { return n; }\n"]
+    for k in range(1, functions):
+        src.append(FUNCTION.format(k=k, prev=k - 1, m=k % 7 + 2))
+    src.append(f'int main() {{ printf("%i\\n", f{functions - 1}(10)); return 0; }}\n')
+    return "\n".join(src)
+
+
+def best_time(compile, runs: int) -> tuple[float, str]:
+    times, outs = [], set()
+    for _ in range(runs):
+        start = time.perf_counter()
+        out = compile()
+        times.append(time.perf_counter() - start)
+        outs.add(out)
+    if None in outs or len(outs) > 1:
+        raise RuntimeError("la compilación falla o no es determinista")
+    return min(times), outs.pop()
+
+
+def main():
+    args = argparse.ArgumentParser(prog="parbench.py")
+    args.add_argument(
+        "funciones",
+        nargs="*",
+        type=int,
+        default=[1000, 3000],
+        help="funciones de cada programa generado",
+    )
+    args.add_argument(
+        "-j",
+        dest="jobs",
+        type=int,
+        action="append",
+        help="número de procesos a medir (por defecto, 1, 2 y 4)",
+    )
+    args.add_argument("-O", dest="level", choices=LEVELS, default="2")
+    args.add_argument("--target", choices=sorted(TARGETS), default="x86")
+    args.add_argument(
+        "--runs", type=int, default=1, help="compilaciones de cada programa"
+    )
+    opts = args.parse_args()
+    jobs = opts.jobs or [1, 2, 4]
+    runs = max(1, opts.runs)
+
+    for functions in opts.funciones:
+        inp = generate(functions)
+        seconds, _ = best_time(
+            lambda: process_file(inp, target=opts.target, level=opts.level), runs
+        )
+        print(f"{functions:6} funciones  secuencial {seconds:8.2f} s")
+
+        base = None
+        for n in jobs:
+            seconds, out = best_time(
+                lambda: process_file_parallel(
+                    inp, n, target=opts.target, level=opts.level
+                ),
+                runs,
+            )
+            if base is None:
+                base, first = seconds, out
+            elif out != first:
+                print(f"error: -j {n} no produce el mismo código", file=sys.stderr)
+                sys.exit(1)
+            print(f"{'':17}-j {n:<3} {seconds:10.2f} s  x{base / seconds:.2f}")
+
+
+if __name__ == "__main__":
+    main()
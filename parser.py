@@ -24,12 +24,18 @@ class CLexer(Lexer):
         MINUS_EQ,
         STAR_EQ,
         SLASH_EQ,
+        PERCENT_EQ,
         SHIFTL_EQ,
         SHIFTR_EQ,
         LOGAND_EQ,
         LOGOR_EQ,
         XOR_EQ,
+        PLUS_PLUS,
+        MINUS_MINUS,
         KW_INT,
+        KW_CHAR,
+        KW_SHORT,
+        KW_UNSIGNED,
         KW_VOID,
         KW_RETURN,
         KW_IF,
@@ -40,13 +46,16 @@ class CLexer(Lexer):
         KW_BREAK,
         KW_CONTINUE,
         KW_SIZEOF,
+        KW_SWITCH,
+        KW_CASE,
+        KW_DEFAULT,
     }
 
     # fmt: off
     literals = {
         "(", ")", "=", ";", ",", ">", "<", "+", "-",
         "*", "/", "{", "}", "!", "[", "]", "&",
-        "|", "^", "~", "%",
+        "|", "^", "~", "%", ":",
     }
     # fmt: on
 
@@ -72,6 +81,9 @@ class CLexer(Lexer):
 
     ID = r"[a-zA-Z_][a-zA-Z0-9_]*"
     ID[r"int"] = KW_INT
+    ID[r"char"] = KW_CHAR
+    ID[r"short"] = KW_SHORT
+    ID[r"unsigned"] = KW_UNSIGNED
     ID[r"void"] = KW_VOID
     ID[r"return"] = KW_RETURN
     ID[r"if"] = KW_IF
@@ -82,6 +94,9 @@ class CLexer(Lexer):
     ID[r"break"] = KW_BREAK
     ID[r"continue"] = KW_CONTINUE
     ID[r"sizeof"] = KW_SIZEOF
+    ID[r"switch"] = KW_SWITCH
+    ID[r"case"] = KW_CASE
+    ID[r"default"] = KW_DEFAULT
     STR = r'"([^"]|\\")*"'
 
     EQ_EQ = r"=="
@@ -90,18 +105,21 @@ class CLexer(Lexer):
     NOT_EQ = r"!="
     GREATER_EQ = r">="
     LESSER_EQ = r"<="
+    SHIFTL_EQ = r"<<="
+    SHIFTR_EQ = r">>="
     SHIFT_L = r"<<"
     SHIFT_R = r">>"
 
-    PLUS_EQ = r"+="
+    PLUS_PLUS = r"\+\+"
+    MINUS_MINUS = r"--"
+    PLUS_EQ = r"\+="
     MINUS_EQ = r"-="
-    STAR_EQ = r"*="
+    STAR_EQ = r"\*="
     SLASH_EQ = r"/="
-    SHIFTL_EQ = r"<<="
-    SHIFTR_EQ = r">>="
+    PERCENT_EQ = r"%="
     LOGAND_EQ = r"&="
-    LOGOR_EQ = r"|="
-    XOR_EQ = r"^="
+    LOGOR_EQ = r"\|="
+    XOR_EQ = r"\^="
 
     def error(self, t):
         tkn = Token()
@@ -227,6 +245,7 @@ class CParser(Parser):
         r"break_stmt",
         r"continue_stmt",
         r"for_stmt",
+        r"switch_stmt",
     )
     def stmt(self, p):
         return p[0]
@@ -254,10 +273,7 @@ class CParser(Parser):
         exp = p[4]
         body = p[6]
 
-        if exp is not None:
-            body.stmts.append(exp)
-
-        ret = WhileStmt(pos=p.lineno, cond=cond, block=body)
+        ret = WhileStmt(pos=p.lineno, cond=cond, block=body, step=exp)
         if decl is not None:
             ret = BlockStmt(pos=p.lineno, stmts=[decl, ret])
 
@@ -295,6 +311,29 @@ class CParser(Parser):
     def else_stmt(self, p):
         return None
 
+    # --- Switch Statement --- #
+
+    @_(r'KW_SWITCH "(" exp ")" "{" cases "}"')
+    def switch_stmt(self, p):
+        return SwitchStmt(pos=p.lineno, cond=p[2], cases=p[5])
+
+    @_(r"cases case")
+    def cases(self, p):
+        p[0].append(p[1])
+        return p[0]
+
+    @_(r"")
+    def cases(self, p):
+        return []
+
+    @_(r'KW_CASE exp ":" body')
+    def case(self, p):
+        return SwitchCase(pos=p.lineno, exp=p[1], stmts=p[3])
+
+    @_(r'KW_DEFAULT ":" body')
+    def case(self, p):
+        return SwitchCase(pos=p.lineno, exp=None, stmts=p[2])
+
     # --- Expr. Statement --- #
 
     @_(r'exp ";"')
@@ -420,6 +459,7 @@ class CParser(Parser):
         "unary MINUS_EQ assign",
         "unary STAR_EQ assign",
         "unary SLASH_EQ assign",
+        "unary PERCENT_EQ assign",
         "unary SHIFTL_EQ assign",
         "unary SHIFTR_EQ assign",
         "unary LOGAND_EQ assign",
@@ -427,18 +467,8 @@ class CParser(Parser):
         "unary XOR_EQ assign",
     )
     def assign(self, p):
-        lval = p[0]
-        if p[1] != "=":
-            rval = BinaryExp(
-                pos=p.lineno,
-                exp1=VarExp(pos=p.lineno),
-                op=p[1][:-1],
-                exp2=p[2],
-            )
-        else:
-            rval = p[2]
-
-        return AssignExp(pos=p[0].pos, var=lval, exp=rval)
+        op = p[1] != "=" and p[1][:-1] or None
+        return AssignExp(pos=p[0].pos, var=p[0], exp=p[2], op=op)
 
     @_("or_exp")
     def assign(self, p):
@@ -553,6 +583,11 @@ class CParser(Parser):
     def unary(self, p):
         return UnaryExp(pos=p.lineno, op=p[0], exp=p[1])
 
+    @_("PLUS_PLUS unary", "MINUS_MINUS unary")
+    def unary(self, p):
+        one = NumExp(pos=p.lineno, lit=1)
+        return AssignExp(pos=p.lineno, var=p[1], exp=one, op=p[0][0])
+
     @_(r'"(" type_lit ")" unary')
     def unary(self, p):
         return CastExp(pos=p.lineno, to=p[1], exp=p[3])
@@ -596,6 +631,11 @@ class CParser(Parser):
             exp=BinaryExp(pos=p[0].pos, exp1=p[0], op="+", exp2=p[2]),
         )
 
+    @_("call PLUS_PLUS", "call MINUS_MINUS")
+    def call(self, p):
+        one = NumExp(pos=p[0].pos, lit=1)
+        return AssignExp(pos=p[0].pos, var=p[0], exp=one, op=p[1][0], postfix=True)
+
     @_(r"atom")
     def call(self, p):
         return p[0]
@@ -659,6 +699,26 @@ class CParser(Parser):
     def type(self, p):
         return TypeInt, p.lineno
 
+    @_(r"KW_CHAR")
+    def type(self, p):
+        return TypeChar, p.lineno
+
+    @_(r"KW_SHORT", r"KW_SHORT KW_INT")
+    def type(self, p):
+        return TypeShort, p.lineno
+
+    @_(r"KW_UNSIGNED", r"KW_UNSIGNED KW_INT")
+    def type(self, p):
+        return TypeUInt, p.lineno
+
+    @_(r"KW_UNSIGNED KW_CHAR")
+    def type(self, p):
+        return TypeUChar, p.lineno
+
+    @_(r"KW_UNSIGNED KW_SHORT", r"KW_UNSIGNED KW_SHORT KW_INT")
+    def type(self, p):
+        return TypeUShort, p.lineno
+
     @_(r"KW_VOID")
     def type(self, p):
         return TypeVoid, p.lineno
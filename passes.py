@@ -0,0 +1,165 @@
+import time
+from astnodes import *
+from commonitems import *
+from target import Target, X86
+from frame import FrameReport, layout_frames
+from callconv import assign_calling_conventions
+from loops import annotate_loops
+from cse import eliminate_common_subexps
+from switch import recognize_switches
+from pgo import *
+from inline import inline_calls
+from formats import specialize_formats
+from allocator import redirect_allocations
+from callgraph import StripReport, code_size, strip_unreachable
+from dataclasses import dataclass, field
+from contextlib import contextmanager
+from typing import Callable, Union
+
+# Pass manager.
+#
+# Passes run over the resolved program in the order they are registered in
+# PASSES, and each one returns how many changes it made. An optimization
+# level is just the set of passes it enables; single passes can be turned off
+# on top of that. Passes marked as required for a target are part of its ABI
+# and always run there (and the same goes for passes an option depends on,
+# like the allocator); profile-guided passes only run when there is a
+# profile to guide them.
+
+LEVELS = ("0", "1", "2", "s")
+
+
+@dataclass
+class PassContext:
+    prog: Program
+    globals: dict[str, Item]
+    target: Target = X86
+    level: str = "2"
+    frame_reports: list[FrameReport] = field(default_factory=list)
+    sites: dict[int, Site] = field(default_factory=dict)
+    profile: Profile = None
+    whole_program: bool = True  # units compiled apart keep all their symbols
+    strip_report: StripReport = field(default_factory=StripReport)
+    measure_stripped: bool = False  # compile stripped functions to size them
+    freestanding: bool = False  # no libc to fall back on
+    allocator: str = "libc"  # heap allocator linked with the program
+
+
+@dataclass
+class Pass:
+    name: str
+    run: Callable[[PassContext], int]
+    levels: set[str]
+    required: Callable[[PassContext], bool] = lambda ctx: False
+    needs_profile: bool = False
+
+
+@dataclass
+class PassStats:
+    name: str
+    seconds: float
+    changes: Union[int, None] = None  # None for the fixed pipeline stages
+
+
+def run_callconv(ctx: PassContext) -> int:
+    assign_calling_conventions(ctx.prog, ctx.globals, ctx.target)
+    return sum(
+        isinstance(item, Fun) and item.regparm > 0 for item in ctx.globals.values()
+    )
+
+
+def run_frame(ctx: PassContext) -> int:
+    ctx.frame_reports = layout_frames(ctx.prog)
+    return sum(r.after < r.before for r in ctx.frame_reports)
+
+
+def run_inline(ctx: PassContext) -> int:
+    return inline_calls(ctx.prog, hot_calls(ctx.sites, ctx.profile))
+
+
+def run_strip(ctx: PassContext) -> int:
+    if not ctx.whole_program:
+        return 0
+    measure = None
+    if ctx.measure_stripped:
+        measure = lambda fun: code_size(fun, ctx.globals, ctx.target)
+    return strip_unreachable(ctx.prog, ctx.strip_report, measure)
+
+
+def run_layout(ctx: PassContext) -> int:
+    return (
+        layout_branches(ctx.prog, ctx.sites, ctx.profile)
+        + limit_unrolling(ctx.prog, ctx.sites, ctx.profile)
+        + place_functions(ctx.prog, ctx.sites, ctx.profile)
+    )
+
+
+PASSES = [
+    # on System V the parameters only get their frame slots here
+    Pass("callconv", run_callconv, {"1", "2", "s"}, lambda ctx: ctx.target.sysv),
+    Pass("inline", run_inline, {"2", "s"}, needs_profile=True),
+    Pass("strip", run_strip, {"1", "2", "s"}),
+    Pass(
+        "formats",
+        lambda ctx: specialize_formats(ctx.prog, ctx.target, ctx.sites),
+        {"1", "2", "s"},
+        lambda ctx: ctx.freestanding,
+    ),
+    Pass(
+        "alloc",
+        lambda ctx: redirect_allocations(ctx.prog),
+        set(),
+        lambda ctx: ctx.allocator != "libc",
+    ),
+    Pass(
+        "switch", lambda ctx: recognize_switches(ctx.prog, ctx.sites), {"1", "2", "s"}
+    ),
+    Pass("cse", lambda ctx: eliminate_common_subexps(ctx.prog), {"2", "s"}),
+    Pass("loops", lambda ctx: annotate_loops(ctx.prog), {"2"}),
+    Pass("layout", run_layout, {"1", "2", "s"}, needs_profile=True),
+    Pass("frame", run_frame, {"1", "2", "s"}),
+]
+
+PASS_NAMES = [p.name for p in PASSES]
+
+
+@dataclass
+class PassManager:
+    level: str = "2"
+    disabled: set[str] = field(default_factory=set)
+    stats: list[PassStats] = field(default_factory=list)
+
+    def enabled(self, p: Pass, ctx: PassContext) -> bool:
+        if p.required(ctx):
+            return True
+        if p.needs_profile and ctx.profile is None:
+            return False
+        return self.level in p.levels and p.name not in self.disabled
+
+    @contextmanager
+    def stage(self, name: str):
+        start = time.perf_counter()
+        stats = PassStats(name=name, seconds=0)
+        yield stats
+        stats.seconds = time.perf_counter() - start
+        self.stats.append(stats)
+
+    def run(self, ctx: PassContext) -> PassContext:
+        ctx.level = self.level
+        for p in PASSES:
+            if not self.enabled(p, ctx):
+                continue
+            with self.stage(p.name) as stats:
+                stats.changes = p.run(ctx)
+        return ctx
+
+    def report(self) -> list[str]:
+        lines = []
+        for s in self.stats:
+            line = f"{s.name:<10} {s.seconds * 1000:8.3f} ms"
+            if s.changes is not None:
+                line += f"  {s.changes} cambios"
+            lines.append(line)
+        total = sum(s.seconds for s in self.stats)
+        lines.append(f"{'total':<10} {total * 1000:8.3f} ms")
+        return lines
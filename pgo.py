@@ -0,0 +1,299 @@
+from astnodes import *
+from typenodes import *
+from commonitems import *
+from target import Target
+from dataclasses import dataclass, field
+from typing import Union
+
+# Profile-guided optimization.
+#
+# An instrumented build counts how many times every probe runs: function
+# entries, `if` statements and their `then`/`else` branches, loops and their
+# bodies, `switch` statements and their cases, and call sites. The counters
+# are dumped as text when the program exits, one line per probe:
+#
+#     <function> <block id> <count>
+#
+# Block ids are numbered per function and per kind in source order (`if2`,
+# `if2.then`, `loop0.body`, `call1.fib`), so edits to other functions never
+# move them. A later build reads the profile back to lay out branches, to
+# decide what to unroll and inline and to split hot from cold code.
+
+COUNTERS = "__pycc_prof_counts"
+SITES = "__pycc_prof_sites"
+
+MIN_INLINE_CALLS = 100  # call sites executed fewer times are left alone
+MIN_UNROLL_TRIPS = 4  # average iterations per entry worth unrolling
+HOT_FRACTION = 10  # functions entered at least 1/10 as often as the hottest
+
+Site = tuple[str, str]
+
+
+def number_blocks(prog: Program) -> dict[int, Site]:
+    sites = {}
+    for top in prog.topdecls:
+        if not isinstance(top, FunDefTop):
+            continue
+
+        name = top.head.name
+        kinds = {"if": 0, "loop": 0, "switch": 0, "call": 0}
+
+        def site(node: Ast, kind: str, suffix: str = ""):
+            sites[id(node)] = (name, f"{kind}{kinds[kind]}{suffix}")
+
+        sites[id(top)] = (name, "entry")
+        for node in (n for stmt in top.body for n in walk(stmt)):
+            if isinstance(node, IfStmt):
+                site(node, "if")
+                site(node.then, "if", ".then")
+                if node.else_ is not None:
+                    site(node.else_, "if", ".else")
+                kinds["if"] += 1
+            elif isinstance(node, WhileStmt):
+                site(node, "loop")
+                site(node.block, "loop", ".body")
+                kinds["loop"] += 1
+            elif isinstance(node, SwitchStmt):
+                site(node, "switch")
+                for k, case in enumerate(node.cases):
+                    site(case, "switch", f".case{k}")
+                kinds["switch"] += 1
+            elif isinstance(node, CallExp):
+                site(node, "call", f".{node.callee.lit}")
+                kinds["call"] += 1
+
+    return sites
+
+
+# --- Instrumentation --- #
+
+
+@dataclass
+class Instrumentation:
+    sites: dict[int, Site]
+    path: str
+    index: dict[int, int] = field(default_factory=dict)
+    order: list[Site] = field(default_factory=list)
+
+    def __post_init__(self):
+        for k, (key, site) in enumerate(self.sites.items()):
+            self.index[key] = k
+            self.order.append(site)
+
+    def counter(self, node: Ast) -> Union[str, None]:
+        k = self.index.get(id(node), None)
+        return k is not None and f"{COUNTERS}+{4 * k}" or None
+
+    def runtime(self, target: Target) -> list[str]:
+        # counter table, probe names and an exit handler writing them out,
+        # registered from .init_array so main is left untouched
+        n = len(self.order)
+        word = target.word == 8 and ".quad" or ".long"
+        lines = [
+            f"    .local {COUNTERS}",
+            f"    .comm {COUNTERS}, {4 * n}, 4",
+            "    .section  .rodata",
+            ".Lprof_path:",
+            f'    .string "{self.path}"',
+            ".Lprof_mode:",
+            '    .string "w"',
+            ".Lprof_fmt:",
+            '    .string "%s %s %u\\n"',
+        ]
+        for k, (fun, block) in enumerate(self.order):
+            lines += [f".Lprof_f{k}:", f'    .string "{fun}"']
+            lines += [f".Lprof_b{k}:", f'    .string "{block}"']
+
+        lines += ["    .data", f"    .align {target.word}", f"{SITES}:"]
+        lines += [f"    {word} .Lprof_f{k}, .Lprof_b{k}" for k in range(n)]
+
+        dump = target.sysv and DUMP_X86_64 or DUMP_X86
+        lines += dump.format(n=n, counters=COUNTERS, sites=SITES).splitlines()
+        return lines
+
+
+DUMP_X86 = """\
+    .text
+__pycc_prof_dump:
+    pushl %ebp
+    movl %esp, %ebp
+    pushl %ebx
+    pushl %esi
+    pushl $.Lprof_mode
+    pushl $.Lprof_path
+    call fopen
+    addl $8, %esp
+    testl %eax, %eax
+    je .Lprof_done
+    movl %eax, %esi
+    xorl %ebx, %ebx
+.Lprof_loop:
+    pushl {counters}(,%ebx,4)
+    pushl {sites}+4(,%ebx,8)
+    pushl {sites}(,%ebx,8)
+    pushl $.Lprof_fmt
+    pushl %esi
+    call fprintf
+    addl $20, %esp
+    incl %ebx
+    cmpl ${n}, %ebx
+    jl .Lprof_loop
+    pushl %esi
+    call fclose
+    addl $4, %esp
+.Lprof_done:
+    popl %esi
+    popl %ebx
+    popl %ebp
+    ret
+__pycc_prof_init:
+    pushl $__pycc_prof_dump
+    call atexit
+    addl $4, %esp
+    ret
+    .section  .init_array, "aw"
+    .align 4
+    .long __pycc_prof_init"""
+
+DUMP_X86_64 = """\
+    .text
+__pycc_prof_dump:
+    pushq %rbp
+    movq %rsp, %rbp
+    pushq %rbx
+    pushq %r12
+    leaq .Lprof_path(%rip), %rdi
+    leaq .Lprof_mode(%rip), %rsi
+    call fopen@PLT
+    testq %rax, %rax
+    je .Lprof_done
+    movq %rax, %r12
+    xorl %ebx, %ebx
+.Lprof_loop:
+    movq %r12, %rdi
+    leaq .Lprof_fmt(%rip), %rsi
+    leaq {sites}(%rip), %rax
+    movq %rbx, %rcx
+    shlq $4, %rcx
+    movq (%rax,%rcx), %rdx
+    movq 8(%rax,%rcx), %rcx
+    leaq {counters}(%rip), %rax
+    movl (%rax,%rbx,4), %r8d
+    xorl %eax, %eax
+    call fprintf@PLT
+    incq %rbx
+    cmpq ${n}, %rbx
+    jl .Lprof_loop
+    movq %r12, %rdi
+    call fclose@PLT
+.Lprof_done:
+    popq %r12
+    popq %rbx
+    popq %rbp
+    ret
+__pycc_prof_init:
+    subq $8, %rsp
+    leaq __pycc_prof_dump(%rip), %rdi
+    call atexit@PLT
+    addq $8, %rsp
+    ret
+    .section  .init_array, "aw"
+    .align 8
+    .quad __pycc_prof_init"""
+
+
+# --- Profile use --- #
+
+
+class ProfileError(Exception):
+    pass
+
+
+@dataclass
+class Profile:
+    counts: dict[Site, int] = field(default_factory=dict)
+
+    @staticmethod
+    def load(path: str) -> "Profile":
+        prof = Profile()
+        with open(path, "r") as f:
+            for lineno, line in enumerate(f, 1):
+                parts = line.split()
+                if not parts:
+                    continue
+                if len(parts) != 3 or not parts[2].isdigit():
+                    raise ProfileError(f"{path}:{lineno}: línea de perfil inválida")
+                site = (parts[0], parts[1])
+                prof.counts[site] = prof.counts.get(site, 0) + int(parts[2])
+        return prof
+
+    def count(self, sites: dict[int, Site], node: Ast) -> Union[int, None]:
+        site = sites.get(id(node), None)
+        return site and self.counts.get(site, None)
+
+
+def layout_branches(prog: Program, sites: dict[int, Site], prof: Profile) -> int:
+    changes = 0
+    for node in walk(prog):
+        if not isinstance(node, IfStmt):
+            continue
+
+        total = prof.count(sites, node)
+        then = prof.count(sites, node.then)
+        if not total or then is None:
+            continue
+
+        # the hotter branch falls through, a branch that never ran is moved
+        # out of the way
+        else_ = total - then
+        node.swap = else_ > then and (node.else_ is not None or then == 0)
+        node.cold = min(then, else_) == 0 and (node.else_ is not None or node.swap)
+        changes += node.swap or node.cold
+
+    return changes
+
+
+def limit_unrolling(prog: Program, sites: dict[int, Site], prof: Profile) -> int:
+    changes = 0
+    for node in walk(prog):
+        if not isinstance(node, WhileStmt) or node.counted is None:
+            continue
+
+        entries = prof.count(sites, node)
+        trips = prof.count(sites, node.block)
+        if entries is None or trips is None:
+            continue
+        if trips < MIN_UNROLL_TRIPS * entries or trips == 0:
+            node.counted = None
+            changes += 1
+
+    return changes
+
+
+def place_functions(prog: Program, sites: dict[int, Site], prof: Profile) -> int:
+    funs = [top for top in prog.topdecls if isinstance(top, FunDefTop)]
+    counts = {id(fun): prof.count(sites, fun) for fun in funs}
+    hottest = max((c for c in counts.values() if c), default=0)
+
+    changes = 0
+    for fun in funs:
+        count = counts[id(fun)]
+        if count is None or fun.head.name == "main":
+            continue
+        if count == 0:
+            fun.section = ".text.unlikely"
+        elif count * HOT_FRACTION >= hottest:
+            fun.section = ".text.hot"
+        else:
+            continue
+        changes += 1
+
+    return changes
+
+
+def hot_calls(sites: dict[int, Site], prof: Profile):
+    def hot(call: CallExp) -> bool:
+        count = prof.count(sites, call)
+        return count is not None and count >= MIN_INLINE_CALLS
+
+    return hot
@@ -3,6 +3,7 @@ from typenodes import *
 from commonitems import *
 from dataclasses import dataclass, field
 from typing import Union
+from functools import wraps
 
 
 @dataclass
@@ -27,7 +28,7 @@ class Scope:
             )
             res.static_var_count += 1
         else:
-            self.top += typ.sizeof()
+            self.top = align_up(self.top + typ.sizeof(), typ.alignof())
             local = Local(
                 addr=self.top,
                 typ=typ,
@@ -36,12 +37,68 @@ class Scope:
         return local
 
 
+def typed(f):
+    # remembers the type of each resolved expression for the later passes
+    @wraps(f)
+    def resolve(self, res):
+        self.rtype = f(self, res)
+        return self.rtype
+
+    return resolve
+
+
+def scaled(exp: Ast, size: int) -> Ast:
+    if size == 1:
+        return exp
+    scale = BinaryExp(pos=exp.pos, exp1=exp, exp2=NumExp(pos=exp.pos, lit=size), op="*")
+    scale.rtype = scale.exp2.rtype = TypeInt
+    return scale
+
+
 class ResolverError(Exception):
     ...
 
 
 SYM = "."
 
+CONSTANT_OPS = {
+    "+": lambda a, b: a + b,
+    "-": lambda a, b: a - b,
+    "*": lambda a, b: a * b,
+    "&": lambda a, b: a & b,
+    "|": lambda a, b: a | b,
+    "^": lambda a, b: a ^ b,
+    "<<": lambda a, b: a << (b & 31),
+    ">>": lambda a, b: a >> (b & 31),
+    "==": lambda a, b: int(a == b),
+    "!=": lambda a, b: int(a != b),
+    "<": lambda a, b: int(a < b),
+    ">": lambda a, b: int(a > b),
+    "<=": lambda a, b: int(a <= b),
+    ">=": lambda a, b: int(a >= b),
+}
+
+
+def constant_value(exp: Ast) -> Union[int, None]:
+    # value of an integer constant expression, like the label of a `case`
+    if isinstance(exp, NumExp):
+        if not isinstance(exp.lit, int):
+            return None
+        val = exp.lit
+    elif isinstance(exp, UnaryExp) and exp.op in {"-", "~", "!"}:
+        a = constant_value(exp.exp)
+        if a is None:
+            return None
+        val = {"-": -a, "~": ~a, "!": int(a == 0)}[exp.op]
+    elif isinstance(exp, BinaryExp) and exp.op in CONSTANT_OPS:
+        a, b = constant_value(exp.exp1), constant_value(exp.exp2)
+        if a is None or b is None:
+            return None
+        val = CONSTANT_OPS[exp.op](a, b)
+    else:
+        return None
+    return wrap(val)
+
 
 @dataclass
 class Resolver:
@@ -51,6 +108,8 @@ class Resolver:
     error_state: bool = False
     static_var_count: int = 0
     nested_loops: int = 0
+    nested_switches: int = 0
+    whole_program: bool = True  # False for units linked with others
 
     def error(self, ast: Ast, msg: str) -> None:
         self.error_state = True
@@ -87,6 +146,9 @@ class Resolver:
         var = self.scope is not None and self.scope.find(name) or None
         return var or self.globals.get(name, None)
 
+    def is_defined(self, fun: Fun) -> bool:
+        return fun.initialized
+
     def is_declared_in_scope(self, name: str) -> bool:
         if self.scope is None:
             return name in self.globals
@@ -105,6 +167,7 @@ class Resolver:
 
 
 @monkeypatch(NumExp)
+@typed
 def resolve(self: NumExp, res: Resolver):
     if isinstance(self.lit, float):
         return TypeFloat
@@ -113,21 +176,24 @@ def resolve(self: NumExp, res: Resolver):
 
 
 @monkeypatch(StrExp)
+@typed
 def resolve(self, _):
     return TypePtr(inner=TypeChar)
 
 
 @monkeypatch(ArrayExp)
+@typed
 def resolve(self: ArrayExp, res: Resolver):
     texps = [exp.resolve(res) for exp in self.exps]
 
-    if not all(a == b for a, b in zip(texps, texps[1:])):
+    if not all(assignable(a, b) for a, b in zip(texps, texps[1:])):
         res.throw(self, "elementos del vector literal no tienen los mismos tipos")
 
     return TypeArray(inner=texps[0], size=len(texps))
 
 
 @monkeypatch(VarExp)
+@typed
 def resolve(self: VarExp, res: Resolver):
     var = res.find_var(self.lit)
     if var is None:
@@ -141,6 +207,7 @@ def resolve(self: VarExp, res: Resolver):
 
 
 @monkeypatch(UnaryExp)
+@typed
 def resolve(self: UnaryExp, res: Resolver):
     t = self.exp.resolve(res)
 
@@ -157,35 +224,38 @@ def resolve(self: UnaryExp, res: Resolver):
         return t.inner.dup_as_lvalue()
 
     if self.op in {"-", "!", "~"}:
-        if t != TypeInt:
+        if not t.is_integer():
             res.throw(
                 self,
                 f"se espera un entero para el operador unario {self.op}, pero se encontró {t}",
             )
-        return t.dup_as_rvalue()
+        return self.op == "!" and TypeInt or promote(t)
 
 
 @monkeypatch(BinaryExp)
+@typed
 def resolve(self: BinaryExp, res: Resolver):
     t1 = self.exp1.resolve(res)
     t2 = self.exp2.resolve(res)
 
     if self.op in {"*", "/", "%", "||", "&&", "|", "&", "^", "<<", ">>"}:
-        if t1 != TypeInt or t2 != TypeInt:
+        if not (t1.is_integer() and t2.is_integer()):
             res.throw(
                 self,
                 f"se esperan tipos enteros para el operador {self.op}, pero se obtuvo {t1} y {t2}",
             )
-        return t1.dup_as_rvalue()
+        if self.op in {"||", "&&"}:
+            return TypeInt
+        return arithmetic_type(self.op, t1, t2)
 
     if self.op in {"==", "!=", "<=", ">=", "<", ">"}:
-        if t1 != t2:
+        if t1 != t2 and not (t1.is_integer() and t2.is_integer()):
             res.throw(self, f"no se pueden comparar tipos {t1} y {t2}")
         return TypeInt.dup_as_rvalue()
 
     if self.op in {"+", "-"}:
-        is_ptr_incr = t1.is_ptr() and t2 == TypeInt or t2.is_ptr() and t1 == TypeInt
-        is_num_add = t1 == TypeInt and t2 == TypeInt
+        is_ptr_incr = t1.is_ptr() and t2.is_integer() or t2.is_ptr() and t1.is_integer()
+        is_num_add = t1.is_integer() and t2.is_integer()
 
         if not (is_ptr_incr or is_num_add):
             res.throw(
@@ -196,29 +266,20 @@ def resolve(self: BinaryExp, res: Resolver):
         if is_ptr_incr:
             if t1.is_ptr():
                 t = t1
-                self.exp2 = BinaryExp(
-                    pos=self.pos,
-                    exp1=self.exp2,
-                    exp2=NumExp(pos=self.pos, lit=t.inner.sizeof()),
-                    op="*",
-                )
+                self.exp2 = scaled(self.exp2, t.inner.sizeof())
 
             else:
                 t = t2
-                self.exp1 = BinaryExp(
-                    pos=self.pos,
-                    exp1=self.exp1,
-                    exp2=NumExp(pos=self.pos, lit=t.inner.sizeof()),
-                    op="*",
-                )
+                self.exp1 = scaled(self.exp1, t.inner.sizeof())
 
             return t.dup_as_rvalue()
 
         else:
-            return TypeInt.dup_as_rvalue()
+            return promote(t1, t2)
 
 
 @monkeypatch(CallExp)
+@typed
 def resolve(self: CallExp, res: Resolver):
     name_fun = self.callee.lit
     fun = res.find_var(name_fun)
@@ -233,7 +294,7 @@ def resolve(self: CallExp, res: Resolver):
 
     self.callee.resolved_as = fun
     if isinstance(fun, Fun):
-        if not fun.initialized:
+        if not res.is_defined(fun) and res.whole_program:
             res.throw(self, "llamando a función aún no definida, sólo declarada")
 
         if len(fun.typ.params) != len(self.args):
@@ -245,7 +306,7 @@ def resolve(self: CallExp, res: Resolver):
         for tparam, arg in zip(fun.typ.params, self.args):
             targ = arg.resolve(res)
 
-            if targ != tparam:
+            if not assignable(tparam, targ):
                 res.throw(
                     self,
                     f"función tomó argumento de tipo {targ}, pero se necesita tipo {tparam}",
@@ -255,6 +316,7 @@ def resolve(self: CallExp, res: Resolver):
 
 
 @monkeypatch(AssignExp)
+@typed
 def resolve(self: AssignExp, res: Resolver):
     tassign = self.var.resolve(res)
     tval = self.exp.resolve(res)
@@ -265,15 +327,26 @@ def resolve(self: AssignExp, res: Resolver):
     if isinstance(tassign, TypeArray):
         raise ResolverError("valor al que se asigna no puede ser un vector")
 
-    if tval != tassign:
+    if self.op is not None:
+        if self.op in {"+", "-"} and isinstance(tassign, TypePtr) and tval.is_integer():
+            self.exp = scaled(self.exp, tassign.inner.sizeof())
+        elif not (tassign.is_integer() and tval.is_integer()):
+            res.throw(
+                self,
+                f"se esperan tipos enteros para el operador {self.op}=, pero se obtuvo {tassign} y {tval}",
+            )
+        return tassign.dup_as_rvalue()
+
+    if not assignable(tassign, tval):
         raise ResolverError(
             f"valor al que se asigna ({tassign}) no tiene el mismo tipo que la expresión {tval}"
         )
 
-    return tval.dup_as_rvalue()
+    return tassign.dup_as_rvalue()
 
 
 @monkeypatch(SizeofExp)
+@typed
 def resolve(self: SizeofExp, res: Resolver):
     if isinstance(self.type, Ast):
         self.type = res.resolve_exp(self.type)
@@ -297,7 +370,7 @@ def resolve(self, res: Resolver):
             raise ResolverError("no se puede devolver valores desde funciones void")
 
         t = res.resolve_exp(self.exp)
-        if t is not None and t != tret:
+        if t is not None and not assignable(tret, t):
             res.error(
                 self,
                 f"se quiere devolver una expresión de tipo {t} en una función que devuelve {tret}",
@@ -322,7 +395,7 @@ def resolve(self: VarStmt, res: Resolver):
             if texp is None:
                 continue
 
-            if typ != texp:
+            if not assignable(typ, texp):
                 res.error(
                     var,
                     f"se pretende asignar a variable '{var.name}' con expresión de tipo {texp}, se espera tipo {typ}",
@@ -364,12 +437,48 @@ def resolve(self: WhileStmt, res: Resolver):
     res.nested_loops += 1
     self.block.resolve(res)
     res.nested_loops -= 1
+    if self.step is not None:
+        res.resolve_exp(self.step)
+
+
+@monkeypatch(SwitchStmt)
+def resolve(self: SwitchStmt, res: Resolver):
+    typ = res.resolve_exp(self.cond)
+    if typ is not None and not typ.is_integer():
+        res.error(
+            self, f"la expresión de un 'switch' debe ser entera, es de tipo {typ}"
+        )
+
+    values, default = set(), None
+    for case in self.cases:
+        if case.exp is None:
+            if default is not None:
+                res.error(case, "'default' repetido en el mismo 'switch'")
+            default = case
+            continue
+        if res.resolve_exp(case.exp) is None:
+            continue
+        case.value = constant_value(case.exp)
+        if case.value is None:
+            res.error(case, "la etiqueta de un 'case' debe ser una constante entera")
+        elif case.value in values:
+            res.error(case, f"valor de 'case' repetido: {case.value}")
+        values.add(case.value)
+
+    # the cases share one scope, and may fall through into each other
+    res.nested_switches += 1
+    res.open_scope()
+    for case in self.cases:
+        for stmt in case.stmts:
+            stmt.resolve(res)
+    res.close_scope()
+    res.nested_switches -= 1
 
 
 @monkeypatch(BreakStmt)
 def resolve(self, res: Resolver):
-    if res.nested_loops == 0:
-        res.error(self, "se intenta hacer un 'break' fuera de un bucle")
+    if res.nested_loops == 0 and res.nested_switches == 0:
+        res.error(self, "se intenta hacer un 'break' fuera de un bucle o 'switch'")
 
 
 @monkeypatch(ContinueStmt)
@@ -379,6 +488,7 @@ def resolve(self, res: Resolver):
 
 
 @monkeypatch(CastExp)
+@typed
 def resolve(self: CastExp, res: Resolver):
     # trivialmente, todo es convertible a todo
     res.resolve_exp(self.exp)
@@ -430,6 +540,12 @@ def resolve(self: FunDeclTop, res: Resolver):
 
 @monkeypatch(FunDefTop)
 def resolve(self: FunDefTop, res: Resolver):
+    self.resolve_head(res)
+    self.resolve_body(res)
+
+
+@monkeypatch(FunDefTop)
+def resolve_head(self: FunDefTop, res: Resolver):
     name = self.head.name
     fun = res.globals.get(name, None)
 
@@ -448,6 +564,10 @@ def resolve(self: FunDefTop, res: Resolver):
             )
 
     res.globals[self.head.name].initialized = True
+
+
+@monkeypatch(FunDefTop)
+def resolve_body(self: FunDefTop, res: Resolver):
     res.cur_fun = self
 
     vars = {}
@@ -461,7 +581,8 @@ def resolve(self: FunDefTop, res: Resolver):
             typ=typ,
             addr=-off,
         )
-        off += typ.sizeof()
+        self.param_locals.append(vars[param])
+        off += typ.arg_size()
     res.scope = Scope(variables=vars)
 
     for stmt in self.body:
@@ -482,9 +603,9 @@ def resolve(self: Program, res: Resolver):
     main = res.globals.get("main", None)
 
     if main is None:
-        res.error(self, "función 'main' no presente")
-
-    if main.typ != TypeFun(params=[], ret=TypeInt):
+        if res.whole_program:
+            res.error(self, "función 'main' no presente")
+    elif main.typ != TypeFun(params=[], ret=TypeInt):
         res.error(
             self, "función 'main' debe de devolver un entero y no tener parámetros"
         )
@@ -0,0 +1,580 @@
+from astnodes import *
+from typenodes import *
+from commonitems import Fun
+from target import Target
+from callconv import REGPARM
+
+# Runtime library.
+#
+# The routines printf and scanf are specialized into (see formats.py). They
+# take their arguments the way the internal convention passes them (ECX and
+# EDX on x86, System V registers on x86-64), and come in two flavours:
+#
+# - on top of libc: each routine goes through stdio, so its output
+#   interleaves correctly with any printf call that could not be
+#   specialized, and is emitted as a local symbol into every unit that
+#   calls it, so units never clash over them;
+# - freestanding (--nolibc): a unit of its own with buffered input and
+#   output over raw read/write syscalls and a `_start` that calls main,
+#   flushes the output and exits, so programs link statically without libc.
+#   Output is flushed when the buffer fills up, at exit, and before reading
+#   more input.
+
+BUFSIZE = 65536
+
+LIBC = {"printf", "scanf", "malloc", "calloc", "realloc", "free"}
+
+RUNTIME_FUNS = {
+    f.name: f
+    for f in (
+        # write(bytes, length)
+        Fun(
+            name="__pycc_write",
+            typ=TypeFun(params=[TypeChar.as_ptr(), TypeInt], ret=TypeVoid),
+        ),
+        # write_int(value), in decimal
+        Fun(name="__pycc_write_int", typ=TypeFun(params=[TypeInt], ret=TypeVoid)),
+        # read_int(pointer), like a %i conversion; returns 1 if it read one
+        Fun(
+            name="__pycc_read_int",
+            typ=TypeFun(params=[TypeInt.as_ptr()], ret=TypeInt),
+        ),
+        # skip_space(), like whitespace in a scanf format
+        Fun(name="__pycc_skip_space", typ=TypeFun(params=[], ret=TypeVoid)),
+    )
+}
+
+for fun in RUNTIME_FUNS.values():
+    fun.initialized = True
+    fun.regparm = min(REGPARM, len(fun.typ.params))
+
+
+def libc_calls(prog: Program) -> set[str]:
+    return {
+        node.callee.lit
+        for node in walk(prog)
+        if isinstance(node, CallExp) and node.callee.lit in LIBC
+    }
+
+
+def routines(target: Target, freestanding: bool) -> dict[str, str]:
+    if target.sysv:
+        io, code = freestanding and IO_X86_64 or LIBC_X86_64, RUNTIME_X86_64
+    else:
+        io, code = freestanding and IO_X86 or LIBC_X86, RUNTIME_X86
+    return {name: asm.format(**io) for name, asm in code.items()}
+
+
+def runtime_asm(names: set[str], target: Target) -> list[str]:
+    # the libc flavour, local to the unit calling it
+    code = routines(target, freestanding=False)
+    lines = ["    .text"]
+    for name in sorted(names):
+        lines += code[name].splitlines()
+    return lines
+
+
+def runtime_unit(target: Target) -> str:
+    # the freestanding flavour, as a unit of its own
+    code = routines(target, freestanding=True)
+    lines = [
+        f"    .local {buf}\n    .comm {buf}, {size}, 32"
+        for buf, size in (
+            ("__pycc_obuf", BUFSIZE),
+            ("__pycc_ibuf", BUFSIZE),
+            ("__pycc_olen", target.word),
+            ("__pycc_ipos", target.word),
+            ("__pycc_ilen", target.word),
+        )
+    ]
+    lines.append("    .text")
+    for name in sorted(RUNTIME_FUNS):
+        lines.append(f"    .globl {name}")
+        lines.append(code[name])
+    start = target.sysv and START_X86_64 or START_X86
+    lines.append(start.format(bufsize=BUFSIZE))
+    lines.append('    .section  .note.GNU-stack, "", @progbits')
+    return "\n".join(lines)
+
+
+# --- x86 --- #
+
+LIBC_X86 = {
+    "write": """\
+    pushl stdout
+    pushl %edx
+    pushl $1
+    pushl %ecx
+    call fwrite
+    addl $16, %esp""",
+    "getc": """\
+    pushl stdin
+    call getc
+    addl $4, %esp""",
+    "ungetc": """\
+    pushl stdin
+    pushl %eax
+    call ungetc
+    addl $8, %esp""",
+}
+
+IO_X86 = {
+    "write": """\
+    call __pycc_put""",
+    "getc": """\
+    call __pycc_getc""",
+    "ungetc": """\
+    cmpl $-1, %eax
+    je 11f
+    decl __pycc_ipos
+11:""",
+}
+
+RUNTIME_X86 = {
+    "__pycc_write": """\
+__pycc_write:
+{write}
+    ret""",
+    "__pycc_write_int": """\
+__pycc_write_int:
+    pushl %ebp
+    movl %esp, %ebp
+    pushl %ebx
+    pushl %esi
+    pushl %edi
+    pushl %ecx
+    subl $16, %esp
+    movl %ecx, %eax
+    testl %eax, %eax
+    jns 1f
+    negl %eax
+1:  leal -16(%ebp), %esi
+    movl $0xcccccccd, %ebx
+2:  movl %eax, %edi
+    mull %ebx
+    shrl $3, %edx
+    leal (%edx,%edx,4), %eax
+    addl %eax, %eax
+    subl %eax, %edi
+    movl %edi, %ecx
+    addb $48, %cl
+    decl %esi
+    movb %cl, (%esi)
+    movl %edx, %eax
+    testl %eax, %eax
+    jnz 2b
+    cmpl $0, -16(%ebp)
+    jge 3f
+    decl %esi
+    movb $45, (%esi)
+3:  leal -16(%ebp), %edx
+    subl %esi, %edx
+    movl %esi, %ecx
+{write}
+    movl -4(%ebp), %ebx
+    movl -8(%ebp), %esi
+    movl -12(%ebp), %edi
+    movl %ebp, %esp
+    popl %ebp
+    ret""",
+    "__pycc_read_int": """\
+__pycc_read_int:
+    pushl %ebp
+    movl %esp, %ebp
+    pushl %ebx
+    pushl %esi
+    pushl %edi
+    pushl %ecx
+    pushl $0
+1:
+{getc}
+    cmpl $32, %eax
+    je 1b
+    leal -9(%eax), %ecx
+    cmpl $4, %ecx
+    jbe 1b
+    cmpl $45, %eax
+    jne 2f
+    movl $1, -20(%ebp)
+    jmp 3f
+2:  cmpl $43, %eax
+    jne 4f
+3:
+{getc}
+4:  movl $10, %esi
+    xorl %ebx, %ebx
+    xorl %edi, %edi
+    cmpl $48, %eax
+    jne 5f
+    movl $1, %edi
+    movl $8, %esi
+{getc}
+    movl %eax, %ecx
+    orl $32, %ecx
+    cmpl $120, %ecx
+    jne 5f
+    movl $16, %esi
+6:
+{getc}
+5:  leal -48(%eax), %ecx
+    cmpl $9, %ecx
+    jbe 7f
+    movl %eax, %ecx
+    orl $32, %ecx
+    subl $87, %ecx
+    cmpl $10, %ecx
+    jb 8f
+7:  cmpl %esi, %ecx
+    jae 8f
+    imull %esi, %ebx
+    addl %ecx, %ebx
+    incl %edi
+    jmp 6b
+8:
+{ungetc}
+    xorl %eax, %eax
+    testl %edi, %edi
+    jz 9f
+    movl %ebx, %eax
+    cmpl $0, -20(%ebp)
+    je 10f
+    negl %eax
+10: movl -16(%ebp), %ecx
+    movl %eax, (%ecx)
+    movl $1, %eax
+9:  movl -4(%ebp), %ebx
+    movl -8(%ebp), %esi
+    movl -12(%ebp), %edi
+    movl %ebp, %esp
+    popl %ebp
+    ret""",
+    "__pycc_skip_space": """\
+__pycc_skip_space:
+1:
+{getc}
+    cmpl $32, %eax
+    je 1b
+    leal -9(%eax), %ecx
+    cmpl $4, %ecx
+    jbe 1b
+{ungetc}
+    ret""",
+}
+
+START_X86 = """\
+__pycc_flush:
+    pushl %ebx
+    movl __pycc_olen, %edx
+    movl $__pycc_obuf, %ecx
+1:  testl %edx, %edx
+    jle 2f
+    movl $4, %eax
+    movl $1, %ebx
+    int $0x80
+    testl %eax, %eax
+    jle 2f
+    addl %eax, %ecx
+    subl %eax, %edx
+    jmp 1b
+2:  movl $0, __pycc_olen
+    popl %ebx
+    ret
+__pycc_put:
+    pushl %esi
+    pushl %edi
+    movl %ecx, %esi
+1:  testl %edx, %edx
+    jle 3f
+    movl __pycc_olen, %eax
+    movl ${bufsize}, %ecx
+    subl %eax, %ecx
+    jnz 2f
+    pushl %edx
+    call __pycc_flush
+    popl %edx
+    jmp 1b
+2:  cmpl %edx, %ecx
+    cmovg %edx, %ecx
+    leal __pycc_obuf(%eax), %edi
+    addl %ecx, %eax
+    movl %eax, __pycc_olen
+    subl %ecx, %edx
+    rep movsb
+    jmp 1b
+3:  popl %edi
+    popl %esi
+    ret
+__pycc_getc:
+    movl __pycc_ipos, %eax
+    cmpl __pycc_ilen, %eax
+    jl 2f
+    call __pycc_flush
+    pushl %ebx
+    movl $3, %eax
+    xorl %ebx, %ebx
+    movl $__pycc_ibuf, %ecx
+    movl ${bufsize}, %edx
+    int $0x80
+    popl %ebx
+    testl %eax, %eax
+    jg 1f
+    movl $-1, %eax
+    ret
+1:  movl %eax, __pycc_ilen
+    xorl %eax, %eax
+2:  movzbl __pycc_ibuf(%eax), %ecx
+    incl %eax
+    movl %eax, __pycc_ipos
+    movl %ecx, %eax
+    ret
+    .globl _start
+_start:
+    xorl %ebp, %ebp
+    andl $-16, %esp
+    call main
+    pushl %eax
+    call __pycc_flush
+    popl %ebx
+    movl $1, %eax
+    int $0x80"""
+
+
+# --- x86-64 --- #
+
+LIBC_X86_64 = {
+    "write": """\
+    movslq %esi, %rdx
+    movl $1, %esi
+    movq stdout@GOTPCREL(%rip), %rcx
+    movq (%rcx), %rcx
+    call fwrite@PLT""",
+    "getc": """\
+    movq stdin@GOTPCREL(%rip), %rax
+    movq (%rax), %rdi
+    call getc@PLT""",
+    "ungetc": """\
+    movl %eax, %edi
+    movq stdin@GOTPCREL(%rip), %rax
+    movq (%rax), %rsi
+    call ungetc@PLT""",
+}
+
+IO_X86_64 = {
+    "write": """\
+    call __pycc_put""",
+    "getc": """\
+    call __pycc_getc""",
+    "ungetc": """\
+    cmpl $-1, %eax
+    je 11f
+    decq __pycc_ipos(%rip)
+11:""",
+}
+
+RUNTIME_X86_64 = {
+    "__pycc_write": """\
+__pycc_write:
+    pushq %rbp
+    movq %rsp, %rbp
+{write}
+    popq %rbp
+    ret""",
+    "__pycc_write_int": """\
+__pycc_write_int:
+    pushq %rbp
+    movq %rsp, %rbp
+    subq $32, %rsp
+    movl %edi, %eax
+    movl %edi, %r8d
+    testl %eax, %eax
+    jns 1f
+    negl %eax
+1:  movq %rbp, %rsi
+    movl $0xcccccccd, %r9d
+2:  movl %eax, %ecx
+    mull %r9d
+    shrl $3, %edx
+    leal (%rdx,%rdx,4), %eax
+    addl %eax, %eax
+    subl %eax, %ecx
+    addb $48, %cl
+    decq %rsi
+    movb %cl, (%rsi)
+    movl %edx, %eax
+    testl %eax, %eax
+    jnz 2b
+    testl %r8d, %r8d
+    jns 3f
+    decq %rsi
+    movb $45, (%rsi)
+3:  movq %rbp, %rax
+    subq %rsi, %rax
+    movq %rsi, %rdi
+    movl %eax, %esi
+{write}
+    leave
+    ret""",
+    "__pycc_read_int": """\
+__pycc_read_int:
+    pushq %rbp
+    movq %rsp, %rbp
+    pushq %rbx
+    pushq %r12
+    pushq %r13
+    pushq %r14
+    pushq %r15
+    subq $8, %rsp
+    movq %rdi, %r12
+    xorl %r13d, %r13d
+1:
+{getc}
+    cmpl $32, %eax
+    je 1b
+    leal -9(%rax), %ecx
+    cmpl $4, %ecx
+    jbe 1b
+    cmpl $45, %eax
+    jne 2f
+    movl $1, %r13d
+    jmp 3f
+2:  cmpl $43, %eax
+    jne 4f
+3:
+{getc}
+4:  movl $10, %r14d
+    xorl %ebx, %ebx
+    xorl %r15d, %r15d
+    cmpl $48, %eax
+    jne 5f
+    movl $1, %r15d
+    movl $8, %r14d
+{getc}
+    movl %eax, %ecx
+    orl $32, %ecx
+    cmpl $120, %ecx
+    jne 5f
+    movl $16, %r14d
+6:
+{getc}
+5:  leal -48(%rax), %ecx
+    cmpl $9, %ecx
+    jbe 7f
+    movl %eax, %ecx
+    orl $32, %ecx
+    subl $87, %ecx
+    cmpl $10, %ecx
+    jb 8f
+7:  cmpl %r14d, %ecx
+    jae 8f
+    imull %r14d, %ebx
+    addl %ecx, %ebx
+    incl %r15d
+    jmp 6b
+8:
+{ungetc}
+    xorl %eax, %eax
+    testl %r15d, %r15d
+    jz 9f
+    movl %ebx, %eax
+    testl %r13d, %r13d
+    jz 10f
+    negl %eax
+10: movl %eax, (%r12)
+    movl $1, %eax
+9:  addq $8, %rsp
+    popq %r15
+    popq %r14
+    popq %r13
+    popq %r12
+    popq %rbx
+    popq %rbp
+    ret""",
+    "__pycc_skip_space": """\
+__pycc_skip_space:
+    pushq %rbp
+    movq %rsp, %rbp
+1:
+{getc}
+    cmpl $32, %eax
+    je 1b
+    leal -9(%rax), %ecx
+    cmpl $4, %ecx
+    jbe 1b
+{ungetc}
+    popq %rbp
+    ret""",
+}
+
+START_X86_64 = """\
+__pycc_flush:
+    movq __pycc_olen(%rip), %rdx
+    leaq __pycc_obuf(%rip), %rsi
+1:  testq %rdx, %rdx
+    jle 2f
+    movl $1, %eax
+    movl $1, %edi
+    syscall
+    testq %rax, %rax
+    jle 2f
+    addq %rax, %rsi
+    subq %rax, %rdx
+    jmp 1b
+2:  movq $0, __pycc_olen(%rip)
+    ret
+__pycc_put:
+    movslq %esi, %rdx
+    movq %rdi, %rsi
+1:  testq %rdx, %rdx
+    jle 3f
+    movq __pycc_olen(%rip), %rax
+    movl ${bufsize}, %ecx
+    subq %rax, %rcx
+    jnz 2f
+    pushq %rsi
+    pushq %rdx
+    call __pycc_flush
+    popq %rdx
+    popq %rsi
+    jmp 1b
+2:  cmpq %rdx, %rcx
+    cmovg %rdx, %rcx
+    leaq __pycc_obuf(%rip), %rdi
+    addq %rax, %rdi
+    addq %rcx, %rax
+    movq %rax, __pycc_olen(%rip)
+    subq %rcx, %rdx
+    rep movsb
+    jmp 1b
+3:  ret
+__pycc_getc:
+    movq __pycc_ipos(%rip), %rax
+    cmpq __pycc_ilen(%rip), %rax
+    jl 2f
+    call __pycc_flush
+    xorl %eax, %eax
+    xorl %edi, %edi
+    leaq __pycc_ibuf(%rip), %rsi
+    movl ${bufsize}, %edx
+    syscall
+    testq %rax, %rax
+    jg 1f
+    movl $-1, %eax
+    ret
+1:  movq %rax, __pycc_ilen(%rip)
+    xorl %eax, %eax
+2:  leaq __pycc_ibuf(%rip), %rcx
+    movzbl (%rcx,%rax), %edx
+    incq %rax
+    movq %rax, __pycc_ipos(%rip)
+    movl %edx, %eax
+    ret
+    .globl _start
+_start:
+    xorl %ebp, %ebp
+    andq $-16, %rsp
+    call main
+    movl %eax, %ebx
+    call __pycc_flush
+    movl %ebx, %edi
+    movl $231, %eax
+    syscall"""
@@ -0,0 +1,134 @@
+import tempfile
+from parser import CLexer, CParser, ParserError
+from resolver import Resolver, ResolverError
+from compiler import Compiler
+from runtime import runtime_asm
+from insn import render
+from commonitems import native_functions
+from passes import PassContext, PassManager, PassStats
+from target import Target
+from astnodes import Program
+from typing import Iterable, Iterator, TextIO
+
+# Streaming compilation.
+#
+# The source is read line by line and split into top-level declarations as
+# soon as each one is complete; every declaration is then parsed, resolved,
+# optimized and compiled on its own, its code written out, and its AST
+# dropped. Only the symbol table outlives a declaration, so memory is bounded
+# by the largest function instead of the whole file.
+#
+# The globals and constants a function needs are spooled to temporary files
+# and appended at the end, after all the code. Passes that need to see the
+# whole program at once (stripping, profile-guided ones) do not run here.
+
+
+def toplevel_tokens(lines: Iterable[str]) -> Iterator[list]:
+    # a declaration ends with a `;` outside braces, or with the `}` closing a
+    # function body (and not an initializer list)
+    lexer, tokens, depth, body = CLexer(), [], 0, False
+    for lineno, line in enumerate(lines, 1):
+        for tkn in lexer.tokenize(line, lineno=lineno):
+            if tkn.type == "{":
+                body = body or (depth == 0 and tokens and tokens[-1].type == ")")
+                depth += 1
+            elif tkn.type == "}":
+                depth -= 1
+            tokens.append(tkn)
+
+            if depth == 0 and (tkn.type == ";" or tkn.type == "}" and body):
+                yield tokens
+                tokens, body = [], False
+    if tokens:
+        yield tokens
+
+
+def drain(lines: list[str], out: TextIO):
+    for line in lines:
+        out.write(line + "\n")
+    lines.clear()
+
+
+def compile_stream(
+    lines: Iterable[str],
+    out: TextIO,
+    target: Target,
+    pm: PassManager,
+    unroll_factor: int = 4,
+    allocator: str = "libc",
+) -> bool:
+    res = Resolver(globals={**native_functions})
+    cmp = Compiler(globals=res.globals, target=target, unroll_factor=unroll_factor)
+    header, constants = tempfile.TemporaryFile("w+"), tempfile.TemporaryFile("w+")
+    totals: dict[str, PassStats] = {}
+
+    try:
+        for tokens in toplevel_tokens(lines):
+            merge_stats(pm, totals)
+            with pm.stage("parse"):
+                prog = CParser().parse(iter(tokens))
+
+            with pm.stage("resolve"):
+                for top in prog.topdecls:
+                    try:
+                        top.resolve(res)
+                    except ResolverError:
+                        pass
+            if res.error_state:
+                continue  # keep resolving to report every error
+
+            ctx = PassContext(
+                prog=prog,
+                globals=res.globals,
+                target=target,
+                whole_program=False,
+                allocator=allocator,
+            )
+            pm.run(ctx)
+            with pm.stage("codegen"):
+                cmp.compile(prog)
+                drain(render(cmp.asm, target), out)
+                cmp.asm.clear()
+                drain(cmp.header, header)
+                drain(cmp.constants, constants)
+    except ParserError as e:
+        tkn = e.args[0]
+        if tkn is None:
+            print("error: fin de fichero inesperado")
+        else:
+            print(f"error:{tkn.lineno}: error de gramática, en token '{tkn.value}'")
+        return False
+    finally:
+        merge_stats(pm, totals)
+        pm.stats = list(totals.values())
+
+    # main is checked once everything has been seen
+    Program(pos=1, topdecls=[]).resolve(res)
+    if res.error_state:
+        return False
+
+    if cmp.runtime:
+        drain(runtime_asm(cmp.runtime, target), out)
+    out.write("\n")
+    header.seek(0)
+    out.writelines(header)
+    constants.seek(0)
+    if constants.read(1):
+        constants.seek(0)
+        out.write(" " * 4 + ".section  .rodata\n")
+        out.writelines(constants)
+    out.write(" " * 4 + '.section  .note.GNU-stack, "", @progbits\n')
+    return True
+
+
+def merge_stats(pm: PassManager, totals: dict[str, PassStats]):
+    # one entry per stage, not per stage and declaration
+    for s in pm.stats:
+        total = totals.get(s.name, None)
+        if total is None:
+            totals[s.name] = s
+            continue
+        total.seconds += s.seconds
+        if s.changes is not None:
+            total.changes = (total.changes or 0) + s.changes
+    pm.stats = []
@@ -0,0 +1,99 @@
+from astnodes import *
+from typenodes import *
+from commonitems import *
+from resolver import constant_value
+from typing import Union
+
+# Else-if chain recognition.
+#
+# A chain of `if`s that compares one variable against constants,
+#
+#     if (x == 1) { A } else if (x == 2 || x == 3) { B } else { C }
+#
+# is a `switch` in disguise, and becomes one: cases 1, 2 and 3 run A and B
+# and the default runs C, so the compiler dispatches it with a jump table or
+# a binary search instead of testing the values one by one. The switch is
+# marked as a chain: a case never falls through into the next branch, and
+# a `break` in a branch still leaves the enclosing loop.
+#
+# The conditions have no side effects, so reading the variable once gives
+# the same result. A value tested again further down the chain never gets
+# there, and is dropped. Chains with profile probes are left alone: their
+# counts are for the `if`s (see pgo.py).
+
+MIN_CHAIN_VALUES = 4  # shorter chains are as cheap tested one at a time
+
+
+def tested_values(cond: Ast) -> Union[tuple[VarExp, list[int]], None]:
+    # the variable `cond` compares and the values it is compared against
+    if isinstance(cond, BinaryExp) and cond.op == "||":
+        a, b = tested_values(cond.exp1), tested_values(cond.exp2)
+        if a is None or b is None or a[0].resolved_as is not b[0].resolved_as:
+            return None
+        return a[0], a[1] + b[1]
+
+    if not (isinstance(cond, BinaryExp) and cond.op == "=="):
+        return None
+    var, const = cond.exp1, cond.exp2
+    if not isinstance(var, VarExp):
+        var, const = const, var
+    if not isinstance(var, VarExp):
+        return None
+    item, value = var.resolved_as, constant_value(const)
+    if not isinstance(item, (Local, Global)) or not item.typ.is_integer():
+        return None
+    return value is not None and (var, [value]) or None
+
+
+def else_if(stmt: Ast) -> Union[IfStmt, None]:
+    if isinstance(stmt, BlockStmt) and len(stmt.stmts) == 1:
+        stmt = stmt.stmts[0]
+    return isinstance(stmt, IfStmt) and stmt or None
+
+
+def chain_switch(node: IfStmt, sites: dict) -> Union[SwitchStmt, None]:
+    var, branches, default = None, [], node
+    while (stmt := else_if(default)) is not None and id(stmt) not in sites:
+        tested = tested_values(stmt.cond)
+        if tested is None or var and tested[0].resolved_as is not var.resolved_as:
+            break
+        var = var or tested[0]
+        branches.append((tested[1], stmt.then))
+        default = stmt.else_
+
+    cases, seen = [], set()
+    for values, then in branches:
+        values = [v for v in dict.fromkeys(values) if v not in seen]
+        seen.update(values)
+        for k, value in enumerate(values):
+            exp = NumExp(pos=then.pos, lit=value)
+            exp.rtype = TypeInt
+            stmts = k == len(values) - 1 and [then] or []
+            case = SwitchCase(pos=then.pos, exp=exp, stmts=stmts)
+            case.value = value
+            cases.append(case)
+    if len(seen) < MIN_CHAIN_VALUES:
+        return None
+
+    if default is not None:
+        cases.append(SwitchCase(pos=default.pos, exp=None, stmts=[default]))
+    return SwitchStmt(pos=node.pos, cond=var, cases=cases, chain=True)
+
+
+def recognize_switches(prog: Program, sites: dict) -> int:
+    found = 0
+
+    def visit(node: Ast) -> Ast:
+        nonlocal found
+        if isinstance(node, IfStmt):
+            switch = chain_switch(node, sites)
+            if switch is not None:
+                found += 1
+                node = switch
+        transform(node, visit)
+        return node
+
+    for top in prog.topdecls:
+        if isinstance(top, FunDefTop):
+            top.body = [visit(stmt) for stmt in top.body]
+    return found
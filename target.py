@@ -0,0 +1,108 @@
+import typenodes
+from dataclasses import dataclass
+from typing import Union
+
+
+@dataclass(frozen=True, slots=True)
+class Reg:
+    name: str  # 32-bit name
+    name64: str
+    name16: str
+    name8: str
+
+    def __add__(self, o):
+        # operands are shared: a stream holds thousands of the same few
+        mem = MEMS.get((self.name, o), None)
+        if mem is None:
+            mem = MEMS[self.name, o] = Mem(self, o)
+        return mem
+
+    def __sub__(self, o):
+        return self.__add__(-o)
+
+    def deref(self):
+        return Mem(self, 0)
+
+    def sized(self, size: int) -> str:
+        if size == 4:
+            return self.name
+        if size == 8:
+            return self.name64
+        return size == 2 and self.name16 or self.name8
+
+
+@dataclass(frozen=True, slots=True)
+class Mem:
+    base: Reg
+    off: int = 0
+
+
+MEMS: dict[tuple[str, int], Mem] = {}
+
+
+@dataclass(frozen=True, slots=True)
+class Indexed:
+    index: Reg
+    scale: int
+    base: Reg = None
+    table: str = None  # symbol the address is relative to, like a jump table
+
+
+@dataclass(frozen=True, slots=True)
+class Sym:
+    name: str  # memory at a global symbol
+
+
+@dataclass(frozen=True, slots=True)
+class Imm:
+    value: int
+
+
+# 32-bit names are used throughout the compiler, on x86-64 they stand for the
+# whole 64-bit register
+EAX = Reg("eax", "rax", "ax", "al")
+EBX = Reg("ebx", "rbx", "bx", "bl")
+ECX = Reg("ecx", "rcx", "cx", "cl")
+EDX = Reg("edx", "rdx", "dx", "dl")
+ESI = Reg("esi", "rsi", "si", "sil")  # the byte names of these four need
+EDI = Reg("edi", "rdi", "di", "dil")  # x86-64
+EBP = Reg("ebp", "rbp", "bp", "bpl")
+ESP = Reg("esp", "rsp", "sp", "spl")
+R8 = Reg("r8d", "r8", "r8w", "r8b")
+R9 = Reg("r9d", "r9", "r9w", "r9b")
+
+SUFFIXES = {1: "b", 2: "w", 4: "l", 8: "q"}
+
+
+@dataclass(frozen=True, slots=True)
+class Target:
+    name: str
+    word: int  # size of pointers, registers and stack slots
+    param_regs: tuple[Reg, ...]
+    sysv: bool = False  # System V AMD64: every call uses `param_regs`
+
+    def symbol(self, name: str) -> str:
+        return self.word == 8 and f"{name}(%rip)" or name
+
+    def call_symbol(self, name: str) -> str:
+        return self.sysv and f"{name}@PLT" or name
+
+    def stack_align(self) -> int:
+        return self.sysv and 16 or self.word
+
+
+# i386 cdecl, with the internal fastcall convention from callconv.py
+X86 = Target(name="x86", word=4, param_regs=(ECX, EDX))
+
+# x86-64 System V
+X86_64 = Target(
+    name="x86_64", word=8, param_regs=(EDI, ESI, EDX, ECX, R8, R9), sysv=True
+)
+
+TARGETS = {t.name: t for t in (X86, X86_64)}
+
+
+def select_target(name: Union[str, Target]) -> Target:
+    target = isinstance(name, Target) and name or TARGETS[name]
+    typenodes.PTR_SIZE = target.word
+    return target
@@ -1,7 +1,19 @@
 import main as m
+import vm
+import io
 import itertools
+from contextlib import redirect_stdout
 import sys
 import os
+import shutil
+import tempfile
+import subprocess
+from compiler import Compiler
+from passes import PassManager
+from objfile import assemble, object_differences, read_object
+from runtime import runtime_unit
+from allocator import allocator_unit
+from target import select_target
 
 
 def run_tests():
@@ -17,5 +29,62 @@ def run_tests():
             print("-" * 10 + " " + file + " " + "-" * 10)
 
 
+def run_vm_tests():
+    for path, _, files in os.walk("./examples/pass"):
+        for file in sorted(files):
+            file = path + "/" + file
+            print("-" * 10 + " vm " + file + " " + "-" * 10)
+            with open(file, "r") as f:
+                prog = vm.load_program(f.read())
+            if prog is not None:
+                prog.out, prog.inp = io.BytesIO(), io.BytesIO(b"10\n")
+                status = prog.run()
+                print(prog.out.getvalue().decode())
+                print(f"estado: {status}, {sum(prog.counts)} instrucciones")
+            print("-" * 10 + " vm " + file + " " + "-" * 10)
+
+
+def run_object_tests():
+    # the objects written by objfile.py, from the text and from the stream of
+    # instructions, against those `as` writes
+    if shutil.which("as") is None:
+        print("objeto: no hay as con el que comparar")
+        return
+    flags = {"x86": "--32", "x86_64": "--64"}
+    with tempfile.TemporaryDirectory(prefix="pycc") as tmp:
+        for target in sorted(flags):
+            t = select_target(target)
+            units = [
+                ("runtime", runtime_unit(t), None),
+                ("classes", allocator_unit(t, "classes"), None),
+            ]
+            for file in sorted(os.listdir("./examples/pass")):
+                with open("./examples/pass/" + file, "r") as f:
+                    out = io.StringIO()
+                    with redirect_stdout(out):
+                        analyzed = m.analyze(f.read(), PassManager(), t)
+                if analyzed is not None:
+                    ast, res, _ = analyzed
+                    cmp = Compiler(globals=res.globals, target=t).compile(ast)
+                    units.append((file, cmp.generate(), cmp))
+            for name, asm, cmp in units:
+                src, obj = os.path.join(tmp, "u.s"), os.path.join(tmp, "u.o")
+                with open(src, "w") as f:
+                    f.write(asm + "\n")
+                cmd = ["as", flags[target], src, "-o", obj]
+                if subprocess.run(cmd, capture_output=True).returncode != 0:
+                    print(f"objeto {target} {name}: as no lo ensambla")
+                    continue
+                with open(obj, "rb") as f:
+                    theirs = read_object(f.read())
+                diffs = object_differences(read_object(assemble(asm, t)), theirs)
+                if cmp is not None:
+                    ours = read_object(assemble(cmp.items(), t))
+                    diffs += object_differences(ours, theirs)
+                print(f"objeto {target} {name}: {diffs and diffs[0] or 'igual que as'}")
+
+
 if __name__ == "__main__":
     run_tests()
+    run_vm_tests()
+    run_object_tests()
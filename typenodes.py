@@ -2,6 +2,8 @@ from dataclasses import dataclass, field
 from typing import Union
 import copy
 
+PTR_SIZE = 4  # set by target.select_target
+
 
 @dataclass
 class Type:
@@ -13,7 +15,10 @@ class Type:
     def is_rvalue(self) -> bool: return not self.lvalue
     def is_const(self) -> bool: return self.const
     def sizeof(self) -> int: return 0
+    def alignof(self) -> int: return 1
     def is_ptr(self) -> bool: return False
+    def is_integer(self) -> bool: return False
+    def is_unsigned(self) -> bool: return False
     def as_ptr(self) -> "Type": return TypePtr(inner=self)
     def as_array(self, size: int) -> "Type": return TypeArray(inner=self, size=size)
     def __eq__(self, typ) -> bool: return False
@@ -32,6 +37,10 @@ class Type:
     def dup_as_lvalue(self) -> "Type":
         return self.dup(True)
 
+    def arg_size(self) -> int:
+        # arguments narrower than an int are passed as one
+        return max(self.sizeof(), 4)
+
     def pointify(self, n: int) -> "Type":
         typ = self
         for _ in range(n):
@@ -43,6 +52,7 @@ class Type:
 class TypeBuiltin(Type):
     name: str = ""
     size: int = 4
+    unsigned: bool = False
 
     def __str__(self) -> str:
         return self.name
@@ -50,6 +60,15 @@ class TypeBuiltin(Type):
     def sizeof(self) -> int:
         return self.size
 
+    def alignof(self) -> int:
+        return self.size
+
+    def is_integer(self) -> bool:
+        return self.name not in ("void", "float")
+
+    def is_unsigned(self) -> bool:
+        return self.unsigned
+
     def __eq__(self, typ):
         return isinstance(typ, TypeBuiltin) and typ.name == self.name
 
@@ -62,7 +81,10 @@ class TypePtr(Type):
         return f"{self.inner}*"
 
     def sizeof(self) -> int:
-        return 4  # ptr size in bytes
+        return PTR_SIZE
+
+    def alignof(self) -> int:
+        return self.sizeof()
 
     def is_ptr(self) -> bool:
         return True
@@ -82,6 +104,9 @@ class TypeArray(Type):
     def sizeof(self) -> int:
         return self.inner.sizeof() * self.size
 
+    def alignof(self) -> int:
+        return self.inner.alignof()
+
     def is_ptr(self) -> bool:
         return True
 
@@ -117,5 +142,44 @@ class TypeFun(Type):
 
 TypeVoid = TypeBuiltin(name="void", size=1)
 TypeChar = TypeBuiltin(name="char", size=1)
+TypeShort = TypeBuiltin(name="short", size=2)
 TypeInt = TypeBuiltin(name="int", size=4)
+TypeUChar = TypeBuiltin(name="unsigned char", size=1, unsigned=True)
+TypeUShort = TypeBuiltin(name="unsigned short", size=2, unsigned=True)
+TypeUInt = TypeBuiltin(name="unsigned int", size=4, unsigned=True)
 TypeFloat = TypeBuiltin(name="float", size=4)
+
+
+def wrap(n: int) -> int:
+    # the int with the same low 32 bits: ints are 32 bits on every target
+    return (n + 2**31) % 2**32 - 2**31
+
+
+def promote(*types: Type) -> Type:
+    # the type integer operands are computed in: narrower types become int,
+    # and an unsigned int operand makes the operation unsigned
+    if any(t.is_unsigned() and t.sizeof() == 4 for t in types):
+        return TypeUInt
+    return TypeInt
+
+
+def arithmetic_type(op: str, t1: Type, t2: Type) -> Type:
+    # the type `t1 op t2` is computed in
+    if op in {"+", "-"} and isinstance(t1, TypePtr):
+        return t1
+    if op in {"<<", ">>"}:
+        return promote(t1)  # the type of the value shifted
+    return promote(t1, t2)
+
+
+def assignable(to: Type, typ: Type) -> bool:
+    # integers convert into each other implicitly, other types must match
+    if to.is_integer() and typ.is_integer():
+        return True
+    if isinstance(to, TypeArray) and isinstance(typ, TypeArray):
+        return to.size == typ.size and assignable(to.inner, typ.inner)
+    return to == typ
+
+
+def align_up(n: int, align: int) -> int:
+    return (n + align - 1) // align * align
@@ -0,0 +1,1188 @@
+import sys
+import time
+import struct
+import argparse
+from ast import literal_eval
+from astnodes import *
+from typenodes import *
+from commonitems import *
+from passes import LEVELS, PassManager
+from runtime import RUNTIME_FUNS
+from target import select_target
+from dataclasses import dataclass, field
+from typing import Union
+from bisect import bisect
+
+# Bytecode virtual machine.
+#
+# The resolved and optimized program is lowered to a stack machine whose code
+# is a flat list: an opcode number followed by its operands. Memory is a
+# single bytearray laid out like the 32-bit target, so pointers are plain
+# offsets into it:
+#
+#     [ null page | globals and strings | ...   <- stack | heap -> ... ]
+#
+# Locals live in frames on the stack at the same offsets the frame layout
+# gave them; the operand stack is a Python list. Loads and stores through
+# pointers into the null page trap, as they would natively. Common opcode
+# sequences are fused into superinstructions before the code is assembled.
+#
+# The heap is last, so the bytearray grows with it. Blocks carry their size
+# in the 8 bytes before them; freed blocks are kept sorted by address, merged
+# with free neighbours and handed out again first fit.
+#
+# Values on the operand stack are signed 32-bit ints. Unsigned ints keep the
+# same bits, and the operations whose result depends on the sign have an
+# unsigned opcode of their own.
+
+MEMORY_SIZE = 1 << 22  # to start with
+MAX_MEMORY = 1 << 30
+DATA_START = 4096
+STACK_SIZE = 1 << 20
+
+INT = struct.Struct("<i")
+BYTE = struct.Struct("<b")
+SHORT = struct.Struct("<h")
+
+# fmt: off
+OPCODES = [
+    "PUSH", "POP", "DUP", "SWAP",
+    "LOADL", "STOREL", "SETL", "ADDRL", "LOAD4", "LOAD1", "STORE4", "STORE1",
+    "LOAD2", "LOADU1", "LOADU2", "STORE2",
+    "ADD", "SUB", "MUL", "DIV", "MOD", "AND", "OR", "XOR", "SHL", "SAR",
+    "EQ", "NE", "LT", "GT", "LE", "GE", "NEG", "NOT", "LNOT",
+    "DIVU", "MODU", "SHR", "LTU", "GTU", "LEU", "GEU",
+    "JMP", "JZ", "JNZ", "JZK", "JNZK",
+    "CALL", "CALLN", "RET", "HALT",
+    # superinstructions
+    "INCL", "LOADL2", "LOADLC", "ADDC", "MULC", "LOADG", "ADDLOAD4",
+    "JEQ", "JNE", "JLT", "JGT", "JLE", "JGE",
+]
+# fmt: on
+
+for _i, _name in enumerate(OPCODES):
+    globals()[_name] = _i
+
+BINARY_OPS = {
+    "+": "ADD",
+    "-": "SUB",
+    "*": "MUL",
+    "/": "DIV",
+    "%": "MOD",
+    "&": "AND",
+    "|": "OR",
+    "^": "XOR",
+    "<<": "SHL",
+    ">>": "SAR",
+    "==": "EQ",
+    "!=": "NE",
+    "<": "LT",
+    ">": "GT",
+    "<=": "LE",
+    ">=": "GE",
+}
+
+UNSIGNED_OPS = {
+    "/": "DIVU",
+    "%": "MODU",
+    ">>": "SHR",
+    "<": "LTU",
+    ">": "GTU",
+    "<=": "LEU",
+    ">=": "GEU",
+}
+
+# comparison followed by a conditional jump: (jump if true, jump if false)
+FUSED_JUMPS = {
+    "EQ": ("JEQ", "JNE"),
+    "NE": ("JNE", "JEQ"),
+    "LT": ("JLT", "JGE"),
+    "GT": ("JGT", "JLE"),
+    "LE": ("JLE", "JGT"),
+    "GE": ("JGE", "JLT"),
+}
+
+
+class VMError(Exception):
+    pass
+
+
+def c_string(lit: str) -> bytes:
+    return literal_eval(lit).encode("utf-8") + b"\0"
+
+
+@dataclass(eq=False)
+class Label:
+    pos: int = None
+
+
+@dataclass
+class FunInfo:
+    name: str
+    entry: Label = field(default_factory=Label)
+    frame_size: int = 0
+    param_top: int = 0  # bytes above the frame pointer taken by parameters
+    params: list[tuple[int, int]] = field(default_factory=list)  # (addr, size)
+
+
+# --- Lowering --- #
+
+
+@dataclass
+class Lowering:
+    insns: list[tuple] = field(default_factory=list)
+    funs: dict[str, FunInfo] = field(default_factory=dict)
+    data: bytearray = field(default_factory=bytearray)
+    addrs: dict[str, int] = field(default_factory=dict)  # globals and strings
+    break_stack: list[Label] = field(default_factory=list)
+    continue_stack: list[Label] = field(default_factory=list)
+
+    def emit(self, op: str, *args):
+        self.insns.append((op, *args))
+
+    def label(self, label: Label):
+        self.insns.append(("LABEL", label))
+
+    def fun(self, name: str) -> FunInfo:
+        if name not in self.funs:
+            self.funs[name] = FunInfo(name=name)
+        return self.funs[name]
+
+    def alloc(self, key: str, size: int, align: int = 4, init: bytes = b"") -> int:
+        if key not in self.addrs:
+            pad = -(DATA_START + len(self.data)) % align
+            self.data += bytes(pad)
+            self.addrs[key] = DATA_START + len(self.data)
+            self.data += init.ljust(size, b"\0")
+        return self.addrs[key]
+
+    def global_addr(self, item: Global) -> int:
+        return self.alloc(item.name, item.typ.sizeof(), item.typ.alignof())
+
+    def string_addr(self, lit: str) -> int:
+        s = c_string(lit)
+        return self.alloc("\0" + lit, len(s), 1, s)
+
+    def address(self, item: Item):
+        if isinstance(item, Global):
+            self.emit("PUSH", self.global_addr(item))
+        else:
+            self.emit("ADDRL", item.addr)
+
+    def lower(self, prog: Program) -> "Lowering":
+        self.emit("CALL", self.fun("main"), 0)
+        self.emit("HALT")
+        prog.lower(self)
+        return self
+
+
+def load_op(typ: Type) -> str:
+    size = typ.sizeof()
+    if size >= 4:
+        return "LOAD4"
+    return (typ.is_unsigned() and "LOADU" or "LOAD") + str(size)
+
+
+def store_op(typ: Type) -> str:
+    return f"STORE{min(typ.sizeof(), 4)}"
+
+
+def convert(lw: Lowering, typ: Type, frm: Type):
+    # narrows the value on top of the stack to `typ`; there is nothing to do
+    # on values left untyped by the resolver, such as the one of `p = arr`
+    if typ is None or frm is None or typ == frm:
+        return
+    if not (typ.is_integer() and frm.is_integer()):
+        return
+    bits = 8 * typ.sizeof()
+    if bits == 32:
+        return
+    if typ.is_unsigned():
+        lw.emit("PUSH", (1 << bits) - 1)
+        lw.emit("AND")
+    else:
+        lw.emit("PUSH", 32 - bits)
+        lw.emit("SHL")
+        lw.emit("PUSH", 32 - bits)
+        lw.emit("SAR")
+
+
+@monkeypatch(NumExp)
+def lower(self: NumExp, lw: Lowering):
+    lw.emit("PUSH", wrap(self.lit))
+
+
+@monkeypatch(StrExp)
+def lower(self: StrExp, lw: Lowering):
+    lw.emit("PUSH", lw.string_addr(self.lit))
+
+
+@monkeypatch(VarExp)
+def lower(self: VarExp, lw: Lowering):
+    item = self.resolved_as
+    if isinstance(item.typ, TypeArray):
+        lw.address(item)
+    elif isinstance(item, Local) and item.typ.sizeof() == 4:
+        lw.emit("LOADL", item.addr)
+    else:
+        lw.address(item)
+        lw.emit(load_op(item.typ))
+
+
+@monkeypatch(UnaryExp)
+def lower(self: UnaryExp, lw: Lowering):
+    if self.op == "&":
+        if isinstance(self.exp, VarExp):
+            lw.address(self.exp.resolved_as)
+        elif isinstance(self.exp, UnaryExp) and self.exp.op == "*":
+            self.exp.exp.lower(lw)
+        else:
+            self.exp.lower(lw)
+        return
+
+    if self.op == "*":
+        if isinstance(self.exp, UnaryExp) and self.exp.op == "&":
+            self.exp.exp.lower(lw)
+            return
+        self.exp.lower(lw)
+        if not isinstance(self.rtype, TypeArray):
+            lw.emit(load_op(self.rtype))
+        return
+
+    self.exp.lower(lw)
+    lw.emit({"-": "NEG", "~": "NOT", "!": "LNOT"}[self.op])
+
+
+@monkeypatch(BinaryExp)
+def lower(self: BinaryExp, lw: Lowering):
+    self.exp1.lower(lw)
+    if self.op in {"&&", "||"}:
+        # like the native code, the result is the last operand evaluated
+        end = Label()
+        lw.emit(self.op == "&&" and "JZK" or "JNZK", end)
+        self.exp2.lower(lw)
+        lw.label(end)
+        return
+
+    self.exp2.lower(lw)
+    if self.op in {"/", "%", ">>"}:
+        lw.emit(binary_op(self.op, self.rtype))
+    else:
+        lw.emit(binary_op(self.op, promote(self.exp1.rtype, self.exp2.rtype)))
+
+
+def binary_op(op: str, typ: Type) -> str:
+    # the opcode of `op` on values of type `typ`
+    if typ == TypeUInt and op in UNSIGNED_OPS:
+        return UNSIGNED_OPS[op]
+    return BINARY_OPS[op]
+
+
+@monkeypatch(CallExp)
+def lower(self: CallExp, lw: Lowering):
+    for arg in self.args:
+        arg.lower(lw)
+
+    name = self.callee.resolved_as.name
+    if name in NATIVES:
+        lw.emit("CALLN", name, len(self.args))
+    else:
+        lw.emit("CALL", lw.fun(name), len(self.args))
+        convert(lw, self.rtype, TypeInt)  # callees only set the low bits
+
+
+@monkeypatch(AssignExp)
+def lower(self: AssignExp, lw: Lowering):
+    if self.op is not None:
+        lower_update(self, lw, used=True)
+        return
+
+    self.exp.lower(lw)
+    if isinstance(self.var, VarExp):
+        store(lw, self.var.resolved_as)
+    else:
+        self.var.exp.lower(lw)
+        lw.emit(store_op(self.var.rtype))
+    convert(lw, self.rtype, self.exp.rtype)  # the value is the one stored
+
+
+def store(lw: Lowering, item: Union[Local, Global]):
+    # stores the value on top of the stack in a variable, leaving it there
+    if isinstance(item, Local) and item.typ.sizeof() == 4:
+        lw.emit("STOREL", item.addr)
+    else:
+        lw.address(item)
+        lw.emit(store_op(item.typ))
+
+
+def lower_update(self: AssignExp, lw: Lowering, used: bool):
+    # the address of `*e` is computed once and kept under the operands; the
+    # right side is evaluated before the old value is read, like the native
+    # code does, unless it is a constant
+    typ = self.rtype
+    optype = arithmetic_type(self.op, typ, self.exp.rtype)
+    if isinstance(self.var, VarExp):
+        if isinstance(self.exp, NumExp):
+            self.var.lower(lw)
+            self.exp.lower(lw)
+        else:
+            self.exp.lower(lw)
+            self.var.lower(lw)
+            lw.emit("SWAP")
+        lw.emit(binary_op(self.op, optype))
+        convert(lw, typ, optype)
+        store(lw, self.var.resolved_as)
+    else:
+        self.var.exp.lower(lw)
+        lw.emit("DUP")
+        self.exp.lower(lw)
+        lw.emit("SWAP")
+        lw.emit(load_op(typ))
+        lw.emit("SWAP")
+        lw.emit(binary_op(self.op, optype))
+        convert(lw, typ, optype)
+        lw.emit("SWAP")
+        lw.emit(store_op(typ))
+
+    if used and self.postfix:
+        # the value before: the step undone on the one stored
+        self.exp.lower(lw)
+        lw.emit(self.op == "+" and "SUB" or "ADD")
+        convert(lw, typ, optype)
+
+
+@monkeypatch(SizeofExp)
+def lower(self: SizeofExp, lw: Lowering):
+    lw.emit("PUSH", self.type.sizeof())
+
+
+@monkeypatch(CastExp)
+def lower(self: CastExp, lw: Lowering):
+    self.exp.lower(lw)
+    convert(lw, self.to, self.exp.rtype)
+
+
+def lower_effect(lw: Lowering, exp: Ast):
+    # lowers an expression whose value is not used
+    if isinstance(exp, AssignExp) and exp.op is not None:
+        lower_update(exp, lw, used=False)
+    else:
+        exp.lower(lw)
+    lw.emit("POP")
+
+
+@monkeypatch(ExpStmt)
+def lower(self: ExpStmt, lw: Lowering):
+    lower_effect(lw, self.exp)
+
+
+@monkeypatch(VarStmt)
+def lower(self: VarStmt, lw: Lowering):
+    for var in self.vars:
+        item = var.resolved_as
+        if self.is_static:
+            lw.global_addr(item)
+        if var.exp is None:
+            continue
+
+        if len(var.size_arrays) > 0:
+            lower_array(lw, var.exp, item, item.typ)
+        else:
+            var.exp.lower(lw)
+            if isinstance(item, Local) and item.typ.sizeof() == 4:
+                lw.emit("STOREL", item.addr)
+            else:
+                lw.address(item)
+                lw.emit(store_op(item.typ))
+            lw.emit("POP")
+
+
+def lower_array(lw: Lowering, exp: Ast, item: Local, typ: Type, idx: int = 0):
+    if isinstance(exp, ArrayExp):
+        step = typ.inner.sizeof()
+        for off in range(0, typ.size):
+            lower_array(lw, exp.exps[off], item, typ.inner, idx + off * step)
+    else:
+        exp.lower(lw)
+        lw.emit("ADDRL", item.addr - idx)
+        lw.emit(store_op(typ))
+        lw.emit("POP")
+
+
+@monkeypatch(ReturnStmt)
+def lower(self: ReturnStmt, lw: Lowering):
+    if self.exp is not None:
+        self.exp.lower(lw)
+    else:
+        lw.emit("PUSH", 0)
+    lw.emit("RET")
+
+
+@monkeypatch(BlockStmt)
+def lower(self: BlockStmt, lw: Lowering):
+    for stmt in self.stmts:
+        stmt.lower(lw)
+
+
+@monkeypatch(IfStmt)
+def lower(self: IfStmt, lw: Lowering):
+    else_, end = Label(), Label()
+    self.cond.lower(lw)
+    lw.emit("JZ", else_)
+    self.then.lower(lw)
+    if self.else_ is not None:
+        lw.emit("JMP", end)
+    lw.label(else_)
+    if self.else_ is not None:
+        self.else_.lower(lw)
+        lw.label(end)
+
+
+@monkeypatch(WhileStmt)
+def lower(self: WhileStmt, lw: Lowering):
+    # bottom-tested, like the native loops
+    body, step, test, end = Label(), Label(), Label(), Label()
+    lw.break_stack.append(end)
+    lw.continue_stack.append(step)
+
+    lw.emit("JMP", test)
+    lw.label(body)
+    self.block.lower(lw)
+    lw.label(step)
+    if self.step is not None:
+        lower_effect(lw, self.step)
+    lw.label(test)
+    self.cond.lower(lw)
+    lw.emit("JNZ", body)
+    lw.label(end)
+
+    lw.break_stack.pop()
+    lw.continue_stack.pop()
+
+
+@monkeypatch(SwitchStmt)
+def lower(self: SwitchStmt, lw: Lowering):
+    # compares the value against each case in turn; a match pops it on the
+    # way to the case
+    end = Label()
+    labels = [Label() for _ in self.cases]
+    default = end
+    self.cond.lower(lw)
+    matches = []
+    for case, label in zip(self.cases, labels):
+        if case.exp is None:
+            default = label
+            continue
+        match = Label()
+        lw.emit("DUP")
+        lw.emit("PUSH", case.value)
+        lw.emit("EQ")
+        lw.emit("JNZ", match)
+        matches.append((match, label))
+    lw.emit("POP")
+    lw.emit("JMP", default)
+    for match, label in matches:
+        lw.label(match)
+        lw.emit("POP")
+        lw.emit("JMP", label)
+
+    if not self.chain:
+        lw.break_stack.append(end)
+    for case, label in zip(self.cases, labels):
+        lw.label(label)
+        for stmt in case.stmts:
+            stmt.lower(lw)
+        if self.chain and case.stmts and case is not self.cases[-1]:
+            lw.emit("JMP", end)
+    if not self.chain:
+        lw.break_stack.pop()
+    lw.label(end)
+
+
+@monkeypatch(BreakStmt)
+def lower(self: BreakStmt, lw: Lowering):
+    lw.emit("JMP", lw.break_stack[-1])
+
+
+@monkeypatch(ContinueStmt)
+def lower(self: ContinueStmt, lw: Lowering):
+    lw.emit("JMP", lw.continue_stack[-1])
+
+
+@monkeypatch(FunDeclTop)
+def lower(self: FunDeclTop, lw: Lowering):
+    ...
+
+
+@monkeypatch(FunDefTop)
+def lower(self: FunDefTop, lw: Lowering):
+    info = lw.fun(self.head.name)
+    info.frame_size = self.max_stack_size
+    for local in self.param_locals:
+        size = local.typ.sizeof()
+        info.params.append((local.addr, size))
+        info.param_top = max(info.param_top, -local.addr + size)
+
+    lw.label(info.entry)
+    for stmt in self.body:
+        stmt.lower(lw)
+    lw.emit("PUSH", 0)
+    lw.emit("RET")
+
+
+@monkeypatch(VarTop)
+def lower(self: VarTop, lw: Lowering):
+    for var in self.vars:
+        lw.global_addr(var.resolved_as)
+
+
+@monkeypatch(Program)
+def lower(self: Program, lw: Lowering):
+    for top in self.topdecls:
+        top.lower(lw)
+
+
+# --- Superinstructions --- #
+
+
+def fuse(insns: list[tuple]) -> list[tuple]:
+    out = []
+    for insn in insns:
+        out.append(insn)
+        while len(out) >= 2 and fuse_tail(out):
+            pass
+    return out
+
+
+def fuse_tail(out: list[tuple]) -> bool:
+    # rewrites the end of `out` in place, returns whether anything changed
+    a, b = out[-2], out[-1]
+
+    if a[0] == "STOREL" and b[0] == "POP":
+        out[-2:] = [("SETL", a[1])]
+        return True
+
+    if a[0] == "PUSH" and b[0] in {"ADD", "SUB"}:
+        out[-2:] = [("ADDC", a[1] if b[0] == "ADD" else wrap(-a[1]))]
+        return True
+    if a[0] == "PUSH" and b[0] == "MUL":
+        out[-2:] = [("MULC", a[1])]
+        return True
+
+    if a[0] == "LOADLC" and b[0] in {"ADD", "SUB", "MUL"}:
+        out[-2:] = [("LOADL", a[1]), ("PUSH", a[2]), b]
+        return True
+
+    if len(out) >= 3:
+        x = out[-3]
+        if x[0] == "LOADL" and a[0] == "ADDC" and b[0] == "SETL" and x[1] == b[1]:
+            out[-3:] = [("INCL", x[1], a[1])]
+            return True
+
+    if a[0] in FUSED_JUMPS and b[0] in {"JZ", "JNZ"}:
+        jumps = FUSED_JUMPS[a[0]]
+        out[-2:] = [(b[0] == "JNZ" and jumps[0] or jumps[1], b[1])]
+        return True
+
+    if a[0] == "LOADL" and b[0] == "LOADL":
+        out[-2:] = [("LOADL2", a[1], b[1])]
+        return True
+    if a[0] == "LOADL" and b[0] == "PUSH":
+        out[-2:] = [("LOADLC", a[1], b[1])]
+        return True
+    if a[0] == "PUSH" and b[0] == "LOAD4" and a[1] >= DATA_START:
+        out[-2:] = [("LOADG", a[1])]
+        return True
+    if a[0] == "ADD" and b[0] == "LOAD4":
+        out[-2:] = [("ADDLOAD4",)]
+        return True
+
+    return False
+
+
+def assemble(insns: list[tuple]) -> list:
+    pos = 0
+    for insn in insns:
+        if insn[0] == "LABEL":
+            insn[1].pos = pos
+        else:
+            pos += len(insn)
+
+    code = []
+    for insn in insns:
+        if insn[0] == "LABEL":
+            continue
+        code.append(OPCODES.index(insn[0]))
+        for arg in insn[1:]:
+            code.append(arg.pos if isinstance(arg, Label) else arg)
+    return code
+
+
+# --- Runtime --- #
+
+
+NATIVES = {"printf", "scanf", "malloc", "calloc", "realloc", "free", *RUNTIME_FUNS}
+
+
+@dataclass
+class VM:
+    code: list
+    memory: bytearray
+    stack_top: int
+    heap: int  # first free byte after the stack
+    out: "object" = None
+    inp: "object" = None
+    counts: list[int] = field(default_factory=lambda: [0] * len(OPCODES))
+    free_blocks: list[int] = field(default_factory=list)  # their headers
+    input_buf: bytes = None
+    input_pos: int = 0
+
+    @staticmethod
+    def of_lowering(lw: Lowering, out=None, inp=None) -> "VM":
+        memory = bytearray(MEMORY_SIZE)
+        memory[DATA_START : DATA_START + len(lw.data)] = lw.data
+        stack_top = (DATA_START + len(lw.data) + STACK_SIZE + 4095) & ~4095
+        code = assemble(fuse(lw.insns))
+        for info in lw.funs.values():
+            if info.entry.pos is None:
+                raise VMError(f"función '{info.name}' declarada pero no definida")
+        return VM(
+            code=code,
+            memory=memory,
+            stack_top=stack_top,
+            heap=stack_top,
+            out=out or sys.stdout.buffer,
+            inp=inp or sys.stdin.buffer,
+        )
+
+    # --- Memory --- #
+
+    def read_int(self, addr: int) -> int:
+        return INT.unpack_from(self.memory, addr)[0]
+
+    def write_int(self, addr: int, val: int):
+        INT.pack_into(self.memory, addr, val)
+
+    def read_cstr(self, addr: int) -> bytes:
+        end = self.memory.index(0, addr)
+        return bytes(self.memory[addr:end])
+
+    def malloc(self, size: int) -> int:
+        size = max(8, (size + 7) & ~7)
+        for i, head in enumerate(self.free_blocks):
+            free = self.read_int(head)
+            if free < size:
+                continue
+            if free - size >= 16:
+                # the rest stays free as a block of its own
+                rest = head + 8 + size
+                self.write_int(rest, free - size - 8)
+                self.write_int(head, size)
+                self.free_blocks[i] = rest
+            else:
+                del self.free_blocks[i]
+            return head + 8
+
+        head = self.heap
+        self.grow_heap(head + 8 + size)
+        self.write_int(head, size)
+        return head + 8
+
+    def grow_heap(self, end: int):
+        if end > len(self.memory):
+            if end > MAX_MEMORY:
+                raise VMError("memoria dinámica agotada")
+            size = min(max(end, 2 * len(self.memory)), MAX_MEMORY)
+            self.memory.extend(bytes(size - len(self.memory)))
+        self.heap = end
+
+    def free(self, addr: int):
+        if addr == 0:
+            return
+        head = addr - 8
+        blocks = self.free_blocks
+        i = bisect(blocks, head)
+        blocks.insert(i, head)
+        if i + 1 < len(blocks) and addr + self.read_int(head) == blocks[i + 1]:
+            self.write_int(head, self.read_int(head) + 8 + self.read_int(blocks[i + 1]))
+            del blocks[i + 1]
+        if i > 0 and blocks[i - 1] + 8 + self.read_int(blocks[i - 1]) == head:
+            head = blocks[i - 1]
+            self.write_int(head, self.read_int(head) + 8 + self.read_int(addr - 8))
+            del blocks[i]
+        if head + 8 + self.read_int(head) == self.heap:
+            # the last block goes back to the unused memory
+            blocks.pop()
+            self.heap = head
+
+    def realloc(self, addr: int, size: int) -> int:
+        if addr == 0:
+            return self.malloc(size)
+        old = self.read_int(addr - 8)
+        if size <= old:
+            return addr
+        size = (size + 7) & ~7
+        if addr + old == self.heap:
+            self.grow_heap(addr + size)
+            self.write_int(addr - 8, size)
+            return addr
+        new = self.malloc(size)
+        self.memory[new : new + old] = self.memory[addr : addr + old]
+        self.free(addr)
+        return new
+
+    # --- Natives --- #
+
+    def printf(self, args: list[int]) -> int:
+        fmt = self.read_cstr(args[0])
+        out = bytearray()
+        rest = iter(args[1:])
+        i = 0
+        while i < len(fmt):
+            c = fmt[i]
+            i += 1
+            if c != ord("%") or i == len(fmt):
+                out.append(c)
+                continue
+
+            spec = chr(fmt[i])
+            i += 1
+            if spec in "id":
+                out += str(next(rest)).encode()
+            elif spec == "u":
+                out += str(next(rest) % 2**32).encode()
+            elif spec == "x":
+                out += format(next(rest) % 2**32, "x").encode()
+            elif spec == "c":
+                out.append(next(rest) & 0xFF)
+            elif spec == "s":
+                out += self.read_cstr(next(rest))
+            else:
+                out += b"%" + spec.encode()
+        self.out.write(out)
+        return len(out)
+
+    def input(self) -> bytes:
+        if self.input_buf is None:
+            self.input_buf = self.inp.read()
+        return self.input_buf
+
+    def skip_space(self):
+        buf, pos = self.input(), self.input_pos
+        while pos < len(buf) and chr(buf[pos]).isspace():
+            pos += 1
+        self.input_pos = pos
+
+    def scan_int(self, ptr: int) -> bool:
+        # like %i and __pycc_read_int: octal after a 0, hexadecimal after 0x
+        self.skip_space()
+        buf, pos = self.input_buf, self.input_pos
+        sign = buf[pos : pos + 1] == b"-" and -1 or 1
+        if buf[pos : pos + 1] in {b"+", b"-"}:
+            pos += 1
+        base, digits, val = 10, 0, 0
+        if buf[pos : pos + 1] == b"0":
+            base, digits = 8, 1
+            pos += 1
+            if buf[pos : pos + 1] in {b"x", b"X"}:
+                base = 16
+                pos += 1
+        while pos < len(buf):
+            digit = "0123456789abcdef".find(chr(buf[pos]).lower())
+            if not 0 <= digit < base:
+                break
+            val = val * base + digit
+            digits += 1
+            pos += 1
+        if not digits:
+            return False
+        self.write_int(ptr, wrap(sign * val))
+        self.input_pos = pos
+        return True
+
+    def scanf(self, args: list[int]) -> int:
+        buf = self.input()
+        fmt = self.read_cstr(args[0])
+        ptrs = iter(args[1:])
+        read = 0
+
+        i = 0
+        while i < len(fmt):
+            c = fmt[i]
+            i += 1
+            if chr(c).isspace():
+                self.skip_space()
+            elif c == ord("%") and fmt[i : i + 1] in {b"i", b"d"}:
+                i += 1
+                if not self.scan_int(next(ptrs)):
+                    break
+                read += 1
+            elif self.input_pos < len(buf) and buf[self.input_pos] == c:
+                self.input_pos += 1
+            else:
+                break
+
+        return read if read or self.input_pos < len(buf) else -1
+
+    def native(self, name: str, args: list[int]) -> int:
+        if name == "printf":
+            return self.printf(args)
+        if name == "scanf":
+            return self.scanf(args)
+        if name == "__pycc_write":
+            self.out.write(self.memory[args[0] : args[0] + args[1]])
+            return 0
+        if name == "__pycc_write_int":
+            self.out.write(str(args[0]).encode())
+            return 0
+        if name == "__pycc_read_int":
+            return int(self.scan_int(args[0]))
+        if name == "__pycc_skip_space":
+            self.skip_space()
+            return 0
+        if name == "malloc":
+            return self.malloc(args[0])
+        if name == "calloc":
+            addr = self.malloc(args[0] * args[1])
+            self.memory[addr : addr + args[0] * args[1]] = bytes(args[0] * args[1])
+            return addr
+        if name == "realloc":
+            return self.realloc(args[0], args[1])
+        if name == "free":
+            self.free(args[0])
+            return 0
+        raise VMError(f"función nativa desconocida '{name}'")
+
+    # --- Interpreter --- #
+
+    @property
+    def stack_limit(self) -> int:
+        return self.stack_top - STACK_SIZE
+
+    def run(self) -> int:
+        code, counts, mem = self.code, self.counts, self.memory
+        unpack, pack = INT.unpack_from, INT.pack_into
+        stack = []
+        push, pop = stack.append, stack.pop
+        frames = []
+        fp = msp = self.stack_top
+        pc = 0
+
+        try:
+            while True:
+                op = code[pc]
+                counts[op] += 1
+
+                if op == LOADL:
+                    push(unpack(mem, fp - code[pc + 1])[0])
+                    pc += 2
+                elif op == LOADL2:
+                    push(unpack(mem, fp - code[pc + 1])[0])
+                    push(unpack(mem, fp - code[pc + 2])[0])
+                    pc += 3
+                elif op == LOADLC:
+                    push(unpack(mem, fp - code[pc + 1])[0])
+                    push(code[pc + 2])
+                    pc += 3
+                elif op == PUSH:
+                    push(code[pc + 1])
+                    pc += 2
+                elif op == SETL:
+                    pack(mem, fp - code[pc + 1], pop())
+                    pc += 2
+                elif op == INCL:
+                    addr = fp - code[pc + 1]
+                    val = unpack(mem, addr)[0] + code[pc + 2]
+                    pack(mem, addr, (val + 0x80000000) % 0x100000000 - 0x80000000)
+                    pc += 3
+                elif op == ADDC:
+                    val = stack[-1] + code[pc + 1]
+                    stack[-1] = (val + 0x80000000) % 0x100000000 - 0x80000000
+                    pc += 2
+                elif op == MULC:
+                    val = stack[-1] * code[pc + 1]
+                    stack[-1] = (val + 0x80000000) % 0x100000000 - 0x80000000
+                    pc += 2
+                elif op == ADDLOAD4:
+                    addr = pop() + stack[-1]
+                    if addr < DATA_START:
+                        raise struct.error
+                    stack[-1] = unpack(mem, addr)[0]
+                    pc += 1
+                elif op == JLT:
+                    b = pop()
+                    pc = code[pc + 1] if pop() < b else pc + 2
+                elif op == JGE:
+                    b = pop()
+                    pc = code[pc + 1] if pop() >= b else pc + 2
+                elif op == JGT:
+                    b = pop()
+                    pc = code[pc + 1] if pop() > b else pc + 2
+                elif op == JLE:
+                    b = pop()
+                    pc = code[pc + 1] if pop() <= b else pc + 2
+                elif op == JEQ:
+                    b = pop()
+                    pc = code[pc + 1] if pop() == b else pc + 2
+                elif op == JNE:
+                    b = pop()
+                    pc = code[pc + 1] if pop() != b else pc + 2
+                elif op == JZ:
+                    pc = code[pc + 1] if pop() == 0 else pc + 2
+                elif op == JNZ:
+                    pc = code[pc + 1] if pop() != 0 else pc + 2
+                elif op == JMP:
+                    pc = code[pc + 1]
+                elif op == ADD:
+                    b = pop()
+                    val = stack[-1] + b
+                    stack[-1] = (val + 0x80000000) % 0x100000000 - 0x80000000
+                    pc += 1
+                elif op == SUB:
+                    b = pop()
+                    val = stack[-1] - b
+                    stack[-1] = (val + 0x80000000) % 0x100000000 - 0x80000000
+                    pc += 1
+                elif op == MUL:
+                    b = pop()
+                    val = stack[-1] * b
+                    stack[-1] = (val + 0x80000000) % 0x100000000 - 0x80000000
+                    pc += 1
+                elif op == LOAD4:
+                    if stack[-1] < DATA_START:
+                        raise struct.error
+                    stack[-1] = unpack(mem, stack[-1])[0]
+                    pc += 1
+                elif op == LOADG:
+                    push(unpack(mem, code[pc + 1])[0])
+                    pc += 2
+                elif op == STOREL:
+                    pack(mem, fp - code[pc + 1], stack[-1])
+                    pc += 2
+                elif op == STORE4:
+                    addr = pop()
+                    if addr < DATA_START:
+                        raise struct.error
+                    pack(mem, addr, stack[-1])
+                    pc += 1
+                elif op == ADDRL:
+                    push(fp - code[pc + 1])
+                    pc += 2
+                elif op == POP:
+                    pop()
+                    pc += 1
+                elif op == CALL:
+                    info, nargs = code[pc + 1], code[pc + 2]
+                    args = stack[len(stack) - nargs :]
+                    del stack[len(stack) - nargs :]
+                    frames.append((pc + 3, fp, msp))
+                    fp = msp - info.param_top
+                    msp = fp - info.frame_size
+                    if msp < self.stack_limit:
+                        raise VMError("desbordamiento de pila")
+                    for (addr, size), val in zip(info.params, args):
+                        if size == 1:
+                            BYTE.pack_into(mem, fp - addr, (val + 128) % 256 - 128)
+                        elif size == 2:
+                            SHORT.pack_into(
+                                mem, fp - addr, (val + 32768) % 65536 - 32768
+                            )
+                        else:
+                            pack(mem, fp - addr, val)
+                    pc = info.entry.pos
+                elif op == RET:
+                    pc, fp, msp = frames.pop()
+                elif op == CALLN:
+                    name, nargs = code[pc + 1], code[pc + 2]
+                    args = stack[len(stack) - nargs :]
+                    del stack[len(stack) - nargs :]
+                    push(self.native(name, args))
+                    pc += 3
+                elif op == DIV or op == MOD:
+                    b = pop()
+                    a = stack[-1]
+                    if b == 0:
+                        raise VMError("división entre cero")
+                    q = abs(a) // abs(b) * (1 if (a < 0) == (b < 0) else -1)
+                    val = q if op == DIV else a - q * b
+                    stack[-1] = (val + 0x80000000) % 0x100000000 - 0x80000000
+                    pc += 1
+                elif op == DIVU or op == MODU:
+                    b = pop() & 0xFFFFFFFF
+                    a = stack[-1] & 0xFFFFFFFF
+                    if b == 0:
+                        raise VMError("división entre cero")
+                    val = a // b if op == DIVU else a % b
+                    stack[-1] = (val + 0x80000000) % 0x100000000 - 0x80000000
+                    pc += 1
+                elif op == JZK:
+                    if stack[-1] == 0:
+                        pc = code[pc + 1]
+                    else:
+                        pop()
+                        pc += 2
+                elif op == JNZK:
+                    if stack[-1] != 0:
+                        pc = code[pc + 1]
+                    else:
+                        pop()
+                        pc += 2
+                elif op == HALT:
+                    self.out.flush()
+                    return stack and stack[-1] or 0
+                elif op == LOAD1:
+                    if stack[-1] < DATA_START:
+                        raise struct.error
+                    stack[-1] = BYTE.unpack_from(mem, stack[-1])[0]
+                    pc += 1
+                elif op == STORE1:
+                    addr = pop()
+                    if addr < DATA_START:
+                        raise struct.error
+                    BYTE.pack_into(mem, addr, (stack[-1] + 128) % 256 - 128)
+                    pc += 1
+                elif op == LOAD2:
+                    if stack[-1] < DATA_START:
+                        raise struct.error
+                    stack[-1] = SHORT.unpack_from(mem, stack[-1])[0]
+                    pc += 1
+                elif op == LOADU1:
+                    if stack[-1] < DATA_START:
+                        raise struct.error
+                    stack[-1] = BYTE.unpack_from(mem, stack[-1])[0] & 0xFF
+                    pc += 1
+                elif op == LOADU2:
+                    if stack[-1] < DATA_START:
+                        raise struct.error
+                    stack[-1] = SHORT.unpack_from(mem, stack[-1])[0] & 0xFFFF
+                    pc += 1
+                elif op == STORE2:
+                    addr = pop()
+                    if addr < DATA_START:
+                        raise struct.error
+                    SHORT.pack_into(mem, addr, (stack[-1] + 32768) % 65536 - 32768)
+                    pc += 1
+                elif op == DUP:
+                    push(stack[-1])
+                    pc += 1
+                elif op == SWAP:
+                    stack[-1], stack[-2] = stack[-2], stack[-1]
+                    pc += 1
+                elif op == NEG:
+                    stack[-1] = wrap(-stack[-1])
+                    pc += 1
+                elif op == NOT:
+                    stack[-1] = ~stack[-1]
+                    pc += 1
+                elif op == LNOT:
+                    stack[-1] = int(stack[-1] == 0)
+                    pc += 1
+                else:
+                    b = pop()
+                    a = stack[-1]
+                    if op == AND:
+                        val = a & b
+                    elif op == OR:
+                        val = a | b
+                    elif op == XOR:
+                        val = a ^ b
+                    elif op == SHL:
+                        val = wrap(a << (b & 31))
+                    elif op == SAR:
+                        val = a >> (b & 31)
+                    elif op == EQ:
+                        val = int(a == b)
+                    elif op == NE:
+                        val = int(a != b)
+                    elif op == LT:
+                        val = int(a < b)
+                    elif op == GT:
+                        val = int(a > b)
+                    elif op == LE:
+                        val = int(a <= b)
+                    elif op == GE:
+                        val = int(a >= b)
+                    elif op == SHR:
+                        val = wrap((a & 0xFFFFFFFF) >> (b & 31))
+                    elif op == LTU:
+                        val = int(a & 0xFFFFFFFF < b & 0xFFFFFFFF)
+                    elif op == GTU:
+                        val = int(a & 0xFFFFFFFF > b & 0xFFFFFFFF)
+                    elif op == LEU:
+                        val = int(a & 0xFFFFFFFF <= b & 0xFFFFFFFF)
+                    elif op == GEU:
+                        val = int(a & 0xFFFFFFFF >= b & 0xFFFFFFFF)
+                    else:
+                        raise VMError(f"opcode desconocido {op}")
+                    stack[-1] = val
+                    pc += 1
+        except struct.error:
+            raise VMError("acceso a memoria fuera de rango")
+
+    def report(self) -> list[str]:
+        total = sum(self.counts)
+        lines = [
+            f"{name:<10} {count:12}"
+            for name, count in sorted(zip(OPCODES, self.counts), key=lambda nc: -nc[1])
+            if count
+        ]
+        lines.append(f"{'total':<10} {total:12}")
+        return lines
+
+
+def load_program(inp: str, level: str = "2") -> Union[VM, None]:
+    from main import analyze
+
+    # the VM uses the memory layout of the 32-bit target
+    target = select_target("x86")
+    analyzed = analyze(inp, PassManager(level=level), target)
+    if analyzed is None:
+        return None
+    ast, _, _ = analyzed
+    try:
+        return VM.of_lowering(Lowering().lower(ast))
+    except VMError as e:
+        print(f"error: {e}")
+        return None
+
+
+def main():
+    args = argparse.ArgumentParser(prog="vm.py")
+    args.add_argument("fichero")
+    args.add_argument(
+        "-O",
+        dest="level",
+        choices=LEVELS,
+        default="2",
+        help="nivel de optimización (-O0, -O1, -O2, -Os)",
+    )
+    args.add_argument(
+        "--stats",
+        action="store_true",
+        help="muestra cuántas instrucciones de cada tipo se ejecutaron",
+    )
+    opts = args.parse_args()
+
+    with open(opts.fichero, "r") as f:
+        vm = load_program(f.read(), level=opts.level)
+    if vm is None:
+        sys.exit(1)
+
+    start = time.perf_counter()
+    try:
+        status = vm.run()
+    except VMError as e:
+        vm.out.flush()
+        print(f"error de ejecución: {e}", file=sys.stderr)
+        sys.exit(1)
+    elapsed = time.perf_counter() - start
+
+    if opts.stats:
+        for line in vm.report():
+            print(line, file=sys.stderr)
+        print(f"tiempo     {elapsed * 1000:12.3f} ms", file=sys.stderr)
+    sys.exit(status & 0xFF)
+
+
+if __name__ == "__main__":
+    main()